@@ -1,3 +1,5 @@
 # Basic RESTful API structure adopted from:
 # https://scotch.io/tutorials/build-a-rest- \
 # api-with-django-a-test-driven-approach-part-1
+
+default_app_config = 'api.apps.ApiConfig'
@@ -1,5 +1,26 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
 
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        """Keep game versions, the game cache, player sessions and the
+        move log coherent with direct saves and deletes, tune sqlite
+        connections, and solve 3x3 tic-tac-toe for the computer player."""
+        from .cache import forget_saved_game
+        from .models import (
+            Game, advance_version, close_stale_sessions, trim_move_log)
+        from .solver import get_solver
+        from .sqlite import tune_connection
+        pre_save.connect(advance_version, sender=Game)
+        post_save.connect(forget_saved_game, sender=Game)
+        post_save.connect(close_stale_sessions, sender=Game)
+        post_save.connect(trim_move_log, sender=Game)
+        post_delete.connect(forget_saved_game, sender=Game)
+        connection_created.connect(tune_connection)
+        if getattr(settings, 'GAME_AI_PRECOMPUTE', False):
+            get_solver(Game.BOARD_SIZE, Game.BOARD_SIZE).solve()
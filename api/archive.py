@@ -0,0 +1,84 @@
+import json
+import zlib
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Prefetch
+from django.utils import timezone
+from .models import ArchivedGame, Game, Move
+from .serializers import serialize_game
+from .sharding import atomic_on, shards
+
+ARCHIVE_CHUNK_SIZE = 500
+
+
+def archive_games(older_than, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Move games finished longer than older_than ago into ArchivedGame.
+
+    older_than is a timedelta. Games are moved chunk_size at a time in
+    id order, each chunk in its own short transaction that copies the
+    games (with their move logs) into the archive and deletes them, so
+    no lock is held for longer than one chunk takes. A game changed
+    since it was picked (e.g. by a late join) is left for the next run.
+    With games sharded, each shard is archived in turn. Returns the
+    number of games archived."""
+    cutoff = timezone.now() - older_than
+    return sum(
+        _archive_shard(alias, cutoff, chunk_size) for alias in shards())
+
+
+def _archive_shard(alias, cutoff, chunk_size):
+    """Archive one shard's games finished before cutoff.
+
+    The archive lives in the default database; its rows are committed
+    before the games are deleted from their shard, so a game is never
+    lost, and one left behind by a failure in between is deleted
+    without being archived twice by the next run."""
+    candidates = Game.objects.using(alias).filter(
+        status__in=Game.FINISHED, modified__lt=cutoff).order_by('id')
+    archived = 0
+    last_id = 0
+    while True:
+        ids = list(candidates.filter(id__gt=last_id).values_list(
+            'id', flat=True)[:chunk_size])
+        if not ids:
+            return archived
+        with atomic_on([alias, DEFAULT_DB_ALIAS]):
+            games = list(
+                candidates.select_for_update().filter(id__in=ids)
+                .prefetch_related(Prefetch(
+                    'moves', queryset=Move.objects.order_by('ply'))))
+            if alias != DEFAULT_DB_ALIAS:
+                done = set(ArchivedGame.objects.filter(
+                    id__in=ids).values_list('id', flat=True))
+            else:
+                done = set()
+            ArchivedGame.objects.bulk_create(
+                [_archived(game) for game in games if game.pk not in done])
+            Game.objects.using(alias).filter(
+                id__in=[game.pk for game in games]).delete()
+        archived += len(games)
+        last_id = ids[-1]
+
+
+def _archived(game):
+    """Return the unsaved archive row of a game.
+
+    Holds the game as GameDetail serves it, its version and its move
+    log as [ply, row, col, player] lists, as compressed JSON."""
+    record = {
+        'game': serialize_game(game),
+        'version': game.version,
+        'moves': [[move.ply, move.row, move.col, move.player]
+                  for move in game.moves.all()],
+    }
+    return ArchivedGame(
+        id=game.pk, status=game.status, modified=game.modified,
+        data=zlib.compress(json.dumps(record).encode('utf-8')))
+
+
+def get_archived_game(pk):
+    """Return (version, serialized game) of an archived game, or None."""
+    try:
+        record = ArchivedGame.objects.get(pk=pk).load()
+    except ArchivedGame.DoesNotExist:
+        return None
+    return record['version'], record['game']
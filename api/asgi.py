@@ -0,0 +1,208 @@
+"""Serving the API over ASGI.
+
+Django 1.11 has no async views and no async ORM, so ASGIHandler puts an
+event loop in front of the ordinary request path instead of beside it:
+reading request bodies, writing responses and holding idle connections
+happen on the loop, and each request is handed to Django's own handler
+in a pool of settings.GAME_ASGI_THREADS threads. A thread is only
+taken while a request is being answered, so a process can hold many
+more connections open than it has threads, and requests beyond the
+pool's size wait on the loop for a thread to free up.
+
+Event streams (/games/<pk>/events/) hold their thread for as long as
+they are open, so they are answered in a pool of their own, of
+settings.GAME_ASGI_STREAMS threads: however many clients subscribe,
+the request pool stays free for everything else, and subscribers
+beyond that cap wait for a stream to end.
+
+Every request goes through the same middleware, authentication,
+permission checks (IsOwnerOrReadOnly) and serializer validation as
+under WSGI, and gets the same response. Streamed responses (event
+streams, exports) are produced in their thread and sent a chunk at a
+time as they come; an event stream lets its thread go at its next
+chunk once the client has disconnected."""
+import asyncio
+import io
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+# Threads answering requests when settings.GAME_ASGI_THREADS is not set
+DEFAULT_THREADS = 32
+# Event streams open at once when settings.GAME_ASGI_STREAMS is not set
+DEFAULT_STREAMS = 256
+# Chunks of a streamed response queued for a slow client before the
+# thread producing them waits
+STREAM_BUFFER = 16
+
+_END = object()
+# Paths answered in the event stream pool
+_STREAM_PATH = re.compile(r'/games/[0-9]+/events/$')
+
+
+def _environ(scope, body):
+    """Return the WSGI environ of an ASGI http scope and its body."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        # WSGI strings are bytes decoded as latin-1
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    # the body is read in full, however it was sent
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+class ASGIHandler(object):
+    """An ASGI application answering requests with a WSGI application
+    run in a bounded thread pool; see the module docstring."""
+
+    def __init__(self, wsgi_application, threads=None, streams=None):
+        """Wrap wsgi_application, answering with at most threads requests
+        (default: settings.GAME_ASGI_THREADS) and streams event streams
+        (default: settings.GAME_ASGI_STREAMS) at once."""
+        if threads is None:
+            threads = getattr(settings, 'GAME_ASGI_THREADS', DEFAULT_THREADS)
+        if streams is None:
+            streams = getattr(settings, 'GAME_ASGI_STREAMS', DEFAULT_STREAMS)
+        self.wsgi_application = wsgi_application
+        self.threads = threads
+        self.streams = streams
+        self.executor = ThreadPoolExecutor(threads)
+        self.stream_executor = ThreadPoolExecutor(streams)
+
+    async def __call__(self, scope, receive, send):
+        """Handle one ASGI connection."""
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError(
+                'Unsupported ASGI scope type {}'.format(scope['type']))
+
+    async def lifespan(self, receive, send):
+        """Acknowledge startup, and let the threads go at shutdown."""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                self.stream_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        """Read a request, answer it in the pool and send the response."""
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        environ = _environ(scope, b''.join(chunks))
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue(STREAM_BUFFER)
+        gone = threading.Event()
+        if _STREAM_PATH.search(scope['path']):
+            executor = self.stream_executor
+        else:
+            executor = self.executor
+        answer = loop.run_in_executor(
+            executor, self._answer, environ, loop, queue, gone)
+        watch = asyncio.ensure_future(self._disconnect(receive, gone))
+        error = None
+        try:
+            # keep taking chunks until the thread is done, so it never
+            # waits on a full queue, but stop sending once the client
+            # has gone
+            while True:
+                message = await queue.get()
+                if message is _END:
+                    break
+                if gone.is_set():
+                    continue
+                try:
+                    await send(message)
+                except Exception as e:
+                    gone.set()
+                    error = e
+        finally:
+            watch.cancel()
+        await answer
+        if error is not None:
+            raise error
+
+    def _answer(self, environ, loop, queue, gone):
+        """Answer a request in a pool thread, queueing the ASGI messages
+        of the response for the loop to send.
+
+        The whole response is produced in this one thread, as under
+        WSGI, as Django keeps its database connections per thread."""
+        def put(message):
+            asyncio.run_coroutine_threadsafe(queue.put(message), loop).result()
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+
+        try:
+            result = self.wsgi_application(environ, start_response)
+            try:
+                status, headers = started
+                put({
+                    'type': 'http.response.start',
+                    'status': int(status.split(' ', 1)[0]),
+                    'headers': [
+                        (name.lower().encode('latin-1'),
+                         value.encode('latin-1'))
+                        for name, value in headers],
+                })
+                for chunk in result:
+                    if gone.is_set():
+                        break
+                    if chunk:
+                        put({'type': 'http.response.body', 'body': chunk,
+                             'more_body': True})
+                put({'type': 'http.response.body', 'body': b''})
+            finally:
+                close = getattr(result, 'close', None)
+                if close is not None:
+                    close()
+        finally:
+            put(_END)
+
+    async def _disconnect(self, receive, gone):
+        """Note when the client has gone."""
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        gone.set()
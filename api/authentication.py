@@ -0,0 +1,54 @@
+from django.contrib.auth.models import AnonymousUser
+from rest_framework import authentication
+from .instrumentation import phase
+from .models import PlayerSession
+from .sharding import game_db, shards
+
+
+class GameTokenAuthentication(authentication.BaseAuthentication):
+    """Authenticate a player by the token from joining a game.
+
+    Expects "Authorization: Token <token>". On success request.auth is
+    the player's PlayerSession, with its game already loaded; a missing
+    or unknown token leaves the request unauthenticated. Players have no
+    user account, so request.user stays anonymous.
+
+    With games sharded, sessions are stored in their game's shard, so a
+    request for a game looks there first and then in the other shards."""
+
+    def authenticate(self, request):
+        """Return (AnonymousUser, PlayerSession), or None."""
+        token = parse_header_token(request)
+        if not token:
+            return None
+        sessions = PlayerSession.objects.select_related('game')
+        token_hash = PlayerSession.hash_token(token)
+        with phase('auth'):
+            for alias in self._shards(request):
+                try:
+                    session = sessions.using(alias).get(token_hash=token_hash)
+                except PlayerSession.DoesNotExist:
+                    continue
+                return AnonymousUser(), session
+        return None
+
+    def _shards(self, request):
+        """Return the shards to look for a session in, likeliest first."""
+        aliases = shards()
+        context = getattr(request, 'parser_context', None) or {}
+        pk = context.get('kwargs', {}).get('pk')
+        if pk is None or len(aliases) == 1:
+            return aliases
+        first = game_db(pk)
+        return [first] + [alias for alias in aliases if alias != first]
+
+
+def parse_header_token(request):
+    """Extract authorization token from request headers."""
+    try:
+        # per http://stackoverflow.com/a/3889790
+        return request.META.get(
+            'HTTP_AUTHORIZATION'
+        ).strip().split()[1]
+    except Exception:
+        return None
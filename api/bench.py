@@ -0,0 +1,442 @@
+"""Shared plumbing for the bench_* management commands.
+
+Benchmarks run against a throwaway database created the way the test
+runner creates its own, so they never touch real games."""
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import timeit
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import DEFAULT_DB_ALIAS, connection, connections, reset_queries
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment,
+    teardown_test_environment)
+from rest_framework.test import APIClient
+from .board import Board
+from .cache import GAME_CACHE
+from .models import Game, PlayerSession
+from .serializers import GameSerializer, serialize_game
+
+
+@contextmanager
+def throwaway_database():
+    """Run the body against a freshly migrated, then destroyed, database."""
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+@contextmanager
+def temporary_shards(count):
+    """Run the body with games spread over the default database and
+    count more, created as sqlite files for the purpose.
+
+    The extra databases are added to the connections under the aliases
+    yielded, migrated, and removed along with their files on exit."""
+    directory = tempfile.mkdtemp()
+    aliases = ['temporary_shard{}'.format(i) for i in range(1, count + 1)]
+    try:
+        for alias in aliases:
+            connections.databases[alias] = {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(directory, alias + '.sqlite3'),
+            }
+        with override_settings(GAME_SHARDS=[DEFAULT_DB_ALIAS] + aliases):
+            for alias in aliases:
+                call_command(
+                    'migrate', database=alias, interactive=False,
+                    verbosity=0)
+            yield aliases
+    finally:
+        for alias in aliases:
+            if alias not in connections.databases:
+                continue
+            connections[alias].close()
+            if hasattr(connections._connections, alias):
+                delattr(connections._connections, alias)
+            connections.databases.pop(alias, None)
+        shutil.rmtree(directory)
+
+
+def run_concurrently(work, count, threads):
+    """Call work(i) for each i in range(count) from a pool of threads.
+
+    Returns (seconds elapsed, results in order of i). If work raises,
+    the remaining calls are skipped and the first error is re-raised."""
+    results = [None] * count
+    errors = []
+    next_index = iter(range(count))
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        try:
+            while True:
+                with lock:
+                    i = None if errors else next(next_index, None)
+                if i is None:
+                    return
+                results[i] = work(i)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+        finally:
+            for thread_connection in connections.all():
+                thread_connection.close()
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return time.perf_counter() - started, results
+
+
+def percentile(sorted_values, fraction):
+    """Return the nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(math.ceil(fraction * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, elapsed):
+    """Summarize request latencies (in seconds) measured over elapsed
+    seconds: count, requests per second and p50/p95/p99/max in ms."""
+    latencies = sorted(latencies)
+    summary = {
+        'count': len(latencies),
+        'per_second': len(latencies) / elapsed if elapsed else None,
+    }
+    for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99),
+                           ('max', 1.0)):
+        value = percentile(latencies, fraction)
+        summary[name + '_ms'] = None if value is None else value * 1000
+    return summary
+
+
+class ClientTransport(object):
+    """Send requests through the Django test client, in process."""
+
+    def __init__(self):
+        """Give each thread a client of its own."""
+        self._local = threading.local()
+
+    def request(self, method, path, data=None, token=None):
+        """Return (status code, decoded JSON body or None)."""
+        if not hasattr(self._local, 'client'):
+            self._local.client = APIClient()
+        headers = {}
+        if token:
+            headers['HTTP_AUTHORIZATION'] = 'Token ' + token
+        response = getattr(self._local.client, method.lower())(
+            path, data, format='json', **headers)
+        return response.status_code, getattr(response, 'data', None)
+
+
+class HTTPTransport(object):
+    """Send requests to a running server."""
+
+    def __init__(self, base_url):
+        """Target the server at base_url, e.g. http://localhost:8000."""
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, data=None, token=None):
+        """Return (status code, decoded JSON body or None)."""
+        headers = {'Accept': 'application/json'}
+        body = None
+        if data is not None:
+            body = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if token:
+            headers['Authorization'] = 'Token ' + token
+        request = urllib.request.Request(
+            self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                code, content = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            code, content = e.code, e.read()
+        try:
+            return code, json.loads(content.decode('utf-8'))
+        except ValueError:
+            return code, None
+
+
+# Moves of a classic game that ends in a forced draw after 8 plies
+GAME_MOVES = [
+    (1, 1), (0, 0), (0, 1), (2, 1), (1, 0), (1, 2), (0, 2), (2, 0)]
+
+
+def play_game(transport, timings):
+    """Drive one game through the API the way a pair of players would.
+
+    Creates it, joins both sides, plays GAME_MOVES, reading the game
+    after each move and listing games once. Appends each request's
+    latency to timings[endpoint name]."""
+    def timed(name, method, path, data=None, token=None):
+        started = time.perf_counter()
+        code, body = transport.request(method, path, data, token)
+        timings.setdefault(name, []).append(time.perf_counter() - started)
+        if code >= 400:
+            raise RuntimeError('{} {} answered {}: {}'.format(
+                method, path, code, body))
+        return body
+
+    game = timed('GameList.post', 'POST', reverse('create'), {})
+    pk = game['id']
+    tokens = {}
+    for player in ('x', 'o'):
+        tokens[player] = timed(
+            'JoinGame.post', 'POST',
+            reverse('join', kwargs={'pk': pk, 'player': player}))['token']
+    detail = reverse('details', kwargs={'pk': pk})
+    for ply, (row, col) in enumerate(GAME_MOVES):
+        timed('GameDetail.post', 'POST', detail, {'row': row, 'col': col},
+              tokens['x' if ply % 2 == 0 else 'o'])
+        timed('GameDetail.get', 'GET', detail)
+    timed('GameList.get', 'GET', reverse('create') + '?page_size=20')
+
+
+def run_api(transport, games, threads):
+    """Play games concurrently; return the per-endpoint summaries."""
+    local = threading.local()
+    timings = []
+    lock = threading.Lock()
+
+    def work(i):
+        if not hasattr(local, 'timings'):
+            local.timings = {}
+            with lock:
+                timings.append(local.timings)
+        play_game(transport, local.timings)
+
+    elapsed, _ = run_concurrently(work, games, threads)
+    merged = {}
+    for thread_timings in timings:
+        for name, latencies in thread_timings.items():
+            merged.setdefault(name, []).extend(latencies)
+    endpoints = {name: summarize(latencies, elapsed)
+                 for name, latencies in sorted(merged.items())}
+    return {
+        'seconds': elapsed,
+        'games_per_second': games / elapsed,
+        'endpoints': endpoints,
+    }
+
+
+def run_micro(number):
+    """Time the hot model, serializer and board helpers in isolation.
+
+    Returns microseconds per call of each, best of 3 runs of number
+    calls."""
+    rows = [[True, False, True], [True, False, False], [False, True, None]]
+    board = Board.from_rows(rows)
+    encoded = board.to_json()
+    game = Game(pk=1, x_token='x', o_token='o')
+    serializer = GameSerializer()
+    cases = {
+        'Game._and_the_winner_is': lambda: game._and_the_winner_is(rows),
+        'GameSerializer.validate_board':
+            lambda: serializer.validate_board(encoded),
+        'GameSerializer(game).data': lambda: GameSerializer(game).data,
+        'serialize_game': lambda: serialize_game(game),
+        'Board.to_json': board.to_json,
+        'Board.from_json': lambda: Board.from_json(encoded),
+    }
+    return {
+        name: min(timeit.repeat(case, number=number, repeat=3)) / number * 1e6
+        for name, case in cases.items()}
+
+
+def _seated_games(count):
+    """Create count games with both seats taken by random tokens."""
+    seated = []
+    for _ in range(count):
+        x_token, o_token = PlayerSession.new_tokens(2)
+        game = Game.objects.create(x_token=x_token, o_token=o_token)
+        PlayerSession.open(game, True, game.x_token)
+        PlayerSession.open(game, False, game.o_token)
+        seated.append(game)
+    return seated
+
+
+def _play_moves(client, game):
+    """Post GAME_MOVES to a seated game, failing on any refusal."""
+    url = reverse('details', kwargs={'pk': game.pk})
+    for ply, (row, col) in enumerate(GAME_MOVES):
+        token = game.x_token if ply % 2 == 0 else game.o_token
+        response = client.post(
+            url, {'row': row, 'col': col}, format='json',
+            HTTP_AUTHORIZATION='Token ' + token)
+        if response.status_code != 200:
+            raise RuntimeError('Move answered {}: {}'.format(
+                response.status_code, response.data))
+
+
+def run_moves(games):
+    """Play GAME_MOVES in fresh games through GameDetail.post, alone.
+
+    Returns the moves made and the SQL queries, CPU seconds and wall
+    seconds they took in total, for comparing the cost of one move."""
+    client = APIClient()
+    moves = queries = 0
+    cpu = wall = 0.0
+    for game in _seated_games(games):
+        url = reverse('details', kwargs={'pk': game.pk})
+        for ply, (row, col) in enumerate(GAME_MOVES):
+            token = game.x_token if ply % 2 == 0 else game.o_token
+            # the query log holds at most 9000 queries; keep it short
+            reset_queries()
+            with CaptureQueriesContext(connection) as captured:
+                cpu_started = time.process_time()
+                started = time.perf_counter()
+                response = client.post(
+                    url, {'row': row, 'col': col}, format='json',
+                    HTTP_AUTHORIZATION='Token ' + token)
+                wall += time.perf_counter() - started
+                cpu += time.process_time() - cpu_started
+            if response.status_code != 200:
+                raise RuntimeError('Move answered {}: {}'.format(
+                    response.status_code, response.data))
+            moves += 1
+            queries += len(captured)
+    return {'moves': moves, 'queries': queries, 'cpu_seconds': cpu,
+            'wall_seconds': wall}
+
+
+def run_serialization(games, requests):
+    """Answer GameDetail.get on uncached games and GameList.get pages,
+    with games serialized by GameSerializer and then by game_reader
+    (GAME_FAST_SERIALIZATION off, then on).
+
+    Returns {'GameSerializer' or 'game_reader': {endpoint: CPU
+    milliseconds per request}}."""
+    client = APIClient()
+    urls = [reverse('details', kwargs={'pk': game.pk})
+            for game in _seated_games(games)]
+    listing = reverse('create') + '?page_size={}'.format(games)
+    results = {}
+    for name, fast in (('GameSerializer', False), ('game_reader', True)):
+        cpu = {'GameDetail.get': 0.0, 'GameList.get': 0.0}
+        with override_settings(GAME_FAST_SERIALIZATION=fast):
+            for i in range(requests):
+                # every read misses the cache, so every read serializes
+                caches[GAME_CACHE].clear()
+                for endpoint, url in (('GameDetail.get', urls[i % games]),
+                                      ('GameList.get', listing)):
+                    started = time.process_time()
+                    response = client.get(url, format='json')
+                    cpu[endpoint] += time.process_time() - started
+                    if response.status_code != 200:
+                        raise RuntimeError('{} answered {}'.format(
+                            endpoint, response.status_code))
+        results[name] = {
+            endpoint: seconds * 1000 / requests
+            for endpoint, seconds in cpu.items()}
+    return results
+
+
+def run_sharded_moves(shard_counts, games, threads):
+    """Play GAME_MOVES in games games from threads at once, with games
+    spread over each number of shards in turn.
+
+    Shards past the default database are temporary sqlite files.
+    Returns {number of shards: moves per second}."""
+    results = {}
+    for count in shard_counts:
+        with temporary_shards(count - 1):
+            seated = _seated_games(games)
+            local = threading.local()
+
+            def work(i):
+                if not hasattr(local, 'client'):
+                    local.client = APIClient()
+                _play_moves(local.client, seated[i])
+
+            elapsed, _ = run_concurrently(work, games, threads)
+        results[count] = games * len(GAME_MOVES) / elapsed
+    return results
+
+
+# Pragmas giving sqlite as it comes, to compare the tuned settings with
+STOCK_SQLITE_PRAGMAS = {'journal_mode': 'delete', 'synchronous': 'full'}
+
+
+def _close_connections():
+    """Close every database connection of this thread."""
+    for each in connections.all():
+        each.close()
+
+
+def _play_seated(games):
+    """Play GAME_MOVES in each seated game; runs in a worker process.
+
+    Returns (moves made, games abandoned on a refused move)."""
+    client = APIClient()
+    made = abandoned = 0
+    for game in games:
+        url = reverse('details', kwargs={'pk': game.pk})
+        for ply, (row, col) in enumerate(GAME_MOVES):
+            token = game.x_token if ply % 2 == 0 else game.o_token
+            response = client.post(
+                url, {'row': row, 'col': col}, format='json',
+                HTTP_AUTHORIZATION='Token ' + token)
+            if response.status_code != 200:
+                abandoned += 1
+                break
+            made += 1
+    _close_connections()
+    return made, abandoned
+
+
+def run_processes(games, processes, pragmas, conn_max_age):
+    """Play GAME_MOVES in games games from worker processes at once.
+
+    Every connection gets the given sqlite pragmas and CONN_MAX_AGE.
+    Returns (moves per second, games abandoned on a refused move)."""
+    max_ages = {}
+    with override_settings(GAME_SQLITE_PRAGMAS=pragmas):
+        for each in connections.all():
+            max_ages[each.alias] = each.settings_dict['CONN_MAX_AGE']
+            each.settings_dict['CONN_MAX_AGE'] = conn_max_age
+        try:
+            _close_connections()
+            seated = _seated_games(games)
+            # the workers must not share this process's connections
+            _close_connections()
+            pool = multiprocessing.Pool(processes)
+            try:
+                started = time.perf_counter()
+                results = pool.map(_play_seated, [
+                    seated[i::processes] for i in range(processes)])
+                elapsed = time.perf_counter() - started
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            for each in connections.all():
+                each.settings_dict['CONN_MAX_AGE'] = max_ages[each.alias]
+            _close_connections()
+    made = sum(result[0] for result in results)
+    return made / elapsed, sum(result[1] for result in results)
@@ -0,0 +1,134 @@
+"""Bitboard representation of a game board.
+
+Each side's pieces are kept as one integer, with the cell at (row, col)
+stored in bit row * size + col. Move validation and winner detection
+are then a handful of mask operations instead of walks over nested
+lists, and the JSON shape is only produced at the API edge."""
+import json
+from functools import lru_cache
+
+# (row, col) steps along a row, a column and both diagonals
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+@lru_cache(maxsize=None)
+def _windows(size, win_length):
+    """Return every winning window, and the windows through each cell.
+
+    A window is the mask of win_length consecutive cells along a row,
+    column or diagonal. Computed once per board geometry."""
+    windows = []
+    by_cell = [[] for _ in range(size * size)]
+    for r in range(size):
+        for c in range(size):
+            for dr, dc in DIRECTIONS:
+                last_r = r + dr * (win_length - 1)
+                last_c = c + dc * (win_length - 1)
+                if not (0 <= last_r < size and 0 <= last_c < size):
+                    continue
+                cells = [(r + dr * i) * size + c + dc * i
+                         for i in range(win_length)]
+                mask = 0
+                for cell in cells:
+                    mask |= 1 << cell
+                windows.append(mask)
+                for cell in cells:
+                    by_cell[cell].append(mask)
+    return tuple(windows), tuple(tuple(masks) for masks in by_cell)
+
+
+class Board(object):
+    """A size x size board as a pair of bitboards.
+
+    As elsewhere, the X-player is represented by True and the O-player
+    by False; empty cells are None."""
+
+    __slots__ = ('size', 'win_length', 'x', 'o')
+
+    def __init__(self, size, win_length=None, x=0, o=0):
+        """Create a board, empty unless bitboards are given."""
+        self.size = size
+        self.win_length = win_length or size
+        self.x = x
+        self.o = o
+
+    @classmethod
+    def from_rows(cls, rows, win_length=None):
+        """Build a board from a list of lists of True/False/None."""
+        size = len(rows)
+        x = o = 0
+        for r, row in enumerate(rows):
+            for c, val in enumerate(row):
+                if val is None:
+                    continue
+                if val:
+                    x |= 1 << (r * size + c)
+                else:
+                    o |= 1 << (r * size + c)
+        return cls(size, win_length, x, o)
+
+    @classmethod
+    def from_json(cls, value, win_length=None):
+        """Build a board from its JSON encoding."""
+        return cls.from_rows(json.loads(value), win_length)
+
+    def to_rows(self):
+        """Return the board as a list of lists of True/False/None."""
+        return [[self.get(r, c) for c in range(self.size)]
+                for r in range(self.size)]
+
+    def to_json(self):
+        """Return the JSON encoding served by the API."""
+        return json.dumps(self.to_rows())
+
+    def get(self, row, col):
+        """Return the player at (row, col), or None."""
+        bit = 1 << (row * self.size + col)
+        if self.x & bit:
+            return True
+        if self.o & bit:
+            return False
+        return None
+
+    def is_free(self, row, col):
+        """Return whether (row, col) is empty."""
+        return not (self.x | self.o) & (1 << (row * self.size + col))
+
+    def count(self):
+        """Return the number of pieces on the board."""
+        return bin(self.x | self.o).count('1')
+
+    def is_full(self):
+        """Return whether every cell is taken."""
+        return (self.x | self.o) == (1 << (self.size * self.size)) - 1
+
+    def place(self, row, col, player):
+        """Put the player's piece at (row, col)."""
+        if player:
+            self.x |= 1 << (row * self.size + col)
+        else:
+            self.o |= 1 << (row * self.size + col)
+
+    def winner_through(self, row, col):
+        """Return the player at (row, col) if it completes a window."""
+        cell = row * self.size + col
+        bit = 1 << cell
+        if self.x & bit:
+            bits, player = self.x, True
+        elif self.o & bit:
+            bits, player = self.o, False
+        else:
+            return None
+        for mask in _windows(self.size, self.win_length)[1][cell]:
+            if bits & mask == mask:
+                return player
+        return None
+
+    def winner(self):
+        """Return the winner anywhere on the board, if one exists."""
+        for mask in _windows(self.size, self.win_length)[0]:
+            if self.x & mask == mask:
+                return True
+            if self.o & mask == mask:
+                return False
+        return None
@@ -0,0 +1,87 @@
+import threading
+from collections import defaultdict, deque
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+# Events a slow subscriber may fall behind by before the oldest are
+# dropped; each event carries the whole game, so only the latest matters
+SUBSCRIPTION_BACKLOG = 16
+
+
+class Subscription(object):
+    """A queue of events for one subscriber to one game."""
+
+    def __init__(self, backlog=SUBSCRIPTION_BACKLOG):
+        """Create an empty subscription."""
+        self._events = deque(maxlen=backlog)
+        self._ready = threading.Condition()
+
+    def put(self, event):
+        """Queue an event, dropping the oldest if the backlog is full."""
+        with self._ready:
+            self._events.append(event)
+            self._ready.notify()
+
+    def get(self, timeout=None):
+        """Return the next event, or None if none arrives in time."""
+        with self._ready:
+            if not self._events:
+                self._ready.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+
+class LocalBroker(object):
+    """Fan game updates out to subscribers in this process.
+
+    Subscribers connected to other processes do not see the events, so
+    a multi-process deployment routes its push connections to a single
+    process or sets GAME_BROKER to a broker backed by shared pub/sub."""
+
+    def __init__(self):
+        """Create a broker with no subscribers."""
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, pk):
+        """Return a new Subscription to the game's events."""
+        subscription = Subscription()
+        with self._lock:
+            self._subscribers[pk].add(subscription)
+        return subscription
+
+    def unsubscribe(self, pk, subscription):
+        """Stop delivering the game's events to subscription."""
+        with self._lock:
+            self._subscribers[pk].discard(subscription)
+            if not self._subscribers[pk]:
+                del self._subscribers[pk]
+
+    def publish(self, pk, event):
+        """Deliver an event to every subscriber to the game."""
+        with self._lock:
+            subscriptions = list(self._subscribers.get(pk, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+
+_broker = None
+
+
+def get_broker():
+    """Return the process-wide broker named by settings.GAME_BROKER."""
+    global _broker
+    if _broker is None:
+        _broker = import_string(
+            getattr(settings, 'GAME_BROKER', 'api.broker.LocalBroker'))()
+    return _broker
+
+
+def _reset_broker(setting, **kwargs):
+    """Pick up a new GAME_BROKER, e.g. from override_settings in tests."""
+    global _broker
+    if setting == 'GAME_BROKER':
+        _broker = None
+
+
+setting_changed.connect(_reset_broker)
@@ -0,0 +1,95 @@
+"""Creating games in bulk, e.g. ahead of a tournament.
+
+create_games inserts games a batch at a time, one transaction and one
+bulk insert per table each, rather than a request and an INSERT per
+game. Games can be created with both seats taken: their tokens are
+drawn for the whole batch at once by PlayerSession.new_tokens and their
+player sessions opened in the same transaction, so the tokens work as
+soon as they are handed out."""
+from django.db import connections
+from .models import Game, PlayerSession
+from .sharding import allocate_game_ids, atomic_on, is_sharded, shards
+
+# Games inserted per transaction
+BULK_CREATE_BATCH_SIZE = 1000
+
+
+def create_games(count, board_size=Game.BOARD_SIZE, win_length=None,
+                 seated=False, batch_size=BULK_CREATE_BATCH_SIZE):
+    """Create count new games, batch_size at a time.
+
+    With seated, both seats of every game are taken by fresh tokens.
+    Yields (id, x_token, o_token) for each game, the tokens None unless
+    seated, once its batch is committed, so the results can be streamed
+    out as they come; batches already yielded stay created if the
+    caller stops early. board_size and win_length are not validated
+    here; GameSerializer validates them for the API."""
+    if win_length is None:
+        win_length = board_size
+    template = Game(board_size=board_size, win_length=win_length)
+    if seated:
+        template.x_token = template.o_token = 'seated'
+    status = template._compute_status(template.get_board())
+    database = shards()[0]
+    read_back = not (is_sharded() or connections[
+        database].features.can_return_ids_from_bulk_insert)
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        if seated:
+            tokens = PlayerSession.new_tokens(2 * size)
+        else:
+            tokens = [None] * (2 * size)
+        games = [
+            Game(board_size=board_size, win_length=win_length,
+                 x_token=tokens[2 * i], o_token=tokens[2 * i + 1],
+                 status=status)
+            for i in range(size)]
+        if is_sharded():
+            # outside the batch's transaction, so a rollback cannot
+            # hand the same ids out again
+            for game, pk in zip(games, allocate_game_ids(size)):
+                game.pk = pk
+        with atomic_on(shards()):
+            if read_back:
+                _insert_and_read_back(games, database, seated)
+            else:
+                Game.objects.bulk_create(games)
+            if seated:
+                PlayerSession.objects.bulk_create([
+                    PlayerSession(
+                        token_hash=PlayerSession.hash_token(token),
+                        game=game, player=player)
+                    for game in games
+                    for player, token in (
+                        (True, game.x_token), (False, game.o_token))])
+        for game in games:
+            yield game.pk, game.x_token, game.o_token
+
+
+def _insert_and_read_back(games, database, seated):
+    """Bulk insert games into a database that does not return the ids
+    of bulk inserted rows (e.g. sqlite, MySQL), and set their ids.
+
+    Each game is found by its x_token among the rows above the highest
+    id before the insert, so games others insert meanwhile are told
+    apart from the batch. Open games get a marker in x_token, shared by
+    the batch's prefix, that is cleared again before the batch commits."""
+    if not seated:
+        batch = PlayerSession.new_tokens(1)[0]
+        for i, game in enumerate(games):
+            game.x_token = '{}-{}'.format(batch, i)
+    games_in = Game.objects.using(database)
+    after = games_in.order_by('-pk').values_list(
+        'pk', flat=True).first() or 0
+    games_in.bulk_create(games)
+    ids = dict(games_in.filter(pk__gt=after).values_list('x_token', 'pk'))
+    for game in games:
+        try:
+            game.pk = ids[game.x_token]
+        except KeyError:
+            raise RuntimeError('Could not read back the ids of new games')
+    if not seated:
+        games_in.filter(pk__gt=after, x_token__startswith=batch).update(
+            x_token=None)
+        for game in games:
+            game.x_token = None
@@ -0,0 +1,179 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from .serializers import GameSerializer, serialize_game
+
+# Alias in settings.CACHES of the cache holding serialized games
+GAME_CACHE = 'games'
+
+# Per-name stores shared by every thread's backend instance, as
+# django.core.cache.backends.locmem does
+_stores = {}
+_locks = {}
+
+
+class LRUMemCache(BaseCache):
+    """Thread-safe in-process cache that evicts least recently used keys.
+
+    Like LocMemCache, but once MAX_ENTRIES is reached each new key
+    evicts the key read or written longest ago, rather than culling a
+    fraction of the cache regardless of use."""
+
+    def __init__(self, name, params):
+        """Attach to the store for this cache's LOCATION."""
+        super().__init__(params)
+        self._store = _stores.setdefault(name, OrderedDict())
+        self._lock = _locks.setdefault(name, threading.Lock())
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """Set the value unless the key already has one."""
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            self._set(key, pickled, timeout)
+            return True
+
+    def get(self, key, default=None, version=None):
+        """Return the value, marking it as most recently used."""
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            pickled = self._get(key)
+        if pickled is None:
+            return default
+        return pickle.loads(pickled)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """Set the value, evicting the least recently used key if full."""
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._set(key, pickled, timeout)
+
+    def delete(self, key, version=None):
+        """Remove the key, if present."""
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._store.pop(key, None)
+
+    def clear(self):
+        """Remove every key."""
+        with self._lock:
+            self._store.clear()
+
+    def _get(self, key):
+        """Return the pickled value, dropping it if expired."""
+        try:
+            expiry, pickled = self._store[key]
+        except KeyError:
+            return None
+        if expiry is not None and expiry <= time.time():
+            del self._store[key]
+            return None
+        self._store.move_to_end(key)
+        return pickled
+
+    def _set(self, key, pickled, timeout):
+        """Store the pickled value as the most recently used."""
+        self._store.pop(key, None)
+        while len(self._store) >= self._max_entries:
+            self._store.popitem(last=False)
+        self._store[key] = (self.get_backend_timeout(timeout), pickled)
+
+
+def _pointer_key(pk):
+    """Return the key holding the version of the game cached last."""
+    return 'game:{}'.format(pk)
+
+
+def _game_key(pk, version):
+    """Return the key holding a version of a game."""
+    return 'game:{}:{}'.format(pk, version)
+
+
+def get_cached_game(pk):
+    """Return (version, serialized game) from the cache, or None."""
+    cache = caches[GAME_CACHE]
+    version = cache.get(_pointer_key(pk))
+    if version is None:
+        return None
+    data = cache.get(_game_key(pk, version))
+    if data is None:
+        return None
+    return version, data
+
+
+def cache_game(game):
+    """Cache the game's serialization; return (version, serialized game).
+
+    Called with each new version of a game as it is written, so readers
+    never need to go to the database for it."""
+    data = serialize_game(game)
+    cache = caches[GAME_CACHE]
+    cache.set(_game_key(game.pk, game.version), data)
+    _point_to(cache, game.pk, game.version)
+    return game.version, data
+
+
+def _point_to(cache, pk, version):
+    """Point readers at a version of a game, unless a later one is
+    cached already.
+
+    A reader caches the version it read, which a write may have
+    overtaken by then; the pointer must never move back to it."""
+    current = cache.get(_pointer_key(pk))
+    if current is None or current < version:
+        cache.set(_pointer_key(pk), version)
+
+
+def _fields_from_columns():
+    """Map each Game column to the serialized fields computed from it."""
+    fields = {}
+    for name in GameSerializer.Meta.fields:
+        for column in GameSerializer.SOURCE_COLUMNS.get(name, (name,)):
+            fields.setdefault(column, set()).add(name)
+    return fields
+
+
+_FIELDS_FROM_COLUMNS = _fields_from_columns()
+
+
+def cache_saved_game(game, update_fields):
+    """Cache a game just saved with save_if_current(update_fields).
+
+    Rather than serializing the whole game afresh, the cached
+    serialization of the version before is copied with only the fields
+    computed from update_fields replaced. If that version is not cached
+    the game is cached whole. Either way the pointer moves on to the
+    new version, so a reader still caching an older one cannot move it
+    back."""
+    cache = caches[GAME_CACHE]
+    data = cache.get(_game_key(game.pk, game.version - 1))
+    if data is None:
+        cache_game(game)
+        return
+    data = dict(data)
+    for column in update_fields:
+        for name in _FIELDS_FROM_COLUMNS.get(column, ()):
+            data[name] = getattr(game, name)
+    cache.set(_game_key(game.pk, game.version), data)
+    _point_to(cache, game.pk, game.version)
+
+
+def forget_game(pk):
+    """Drop the cached game, for writes that do not go through
+    cache_game (e.g. creating, deleting or saving a Game directly)."""
+    caches[GAME_CACHE].delete(_pointer_key(pk))
+
+
+def forget_saved_game(sender, instance, **kwargs):
+    """Drop a game from the cache after Game.save() or delete()."""
+    forget_game(instance.pk)
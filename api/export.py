@@ -0,0 +1,71 @@
+import heapq
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .board import Board
+from .models import Game
+from .sharding import shards
+
+EXPORT_CHUNK_SIZE = 1000
+
+
+def parse_since(value):
+    """Parse an ISO 8601 timestamp, assuming UTC if it has no offset.
+
+    Raises ValueError if value is not a timestamp."""
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError('Invalid timestamp: {}'.format(value))
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since, timezone.utc)
+    return since
+
+
+def export_games(after_id=None, modified_since=None,
+                 chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield every game as a line of JSON, in id order.
+
+    Games are read chunk_size at a time by keyset (id > last id seen)
+    rather than by loading the table or holding one long cursor open,
+    so memory stays flat however many games there are, and an export
+    that breaks off can resume from the last id it wrote via after_id.
+    modified_since limits the export to games modified at or after it.
+    With games sharded, each shard is read this way and the rows merged
+    by id. Tokens are never exported."""
+    queryset = Game.objects.order_by('id')
+    if modified_since is not None:
+        queryset = queryset.filter(modified__gte=modified_since)
+    queryset = queryset.values_list(
+        'id', 'x_board', 'o_board', 'board_size', 'win_length',
+        'current_player', 'winner', 'status', 'move_count', 'created',
+        'modified')
+    rows = heapq.merge(*(
+        _keyset(queryset.using(alias), after_id or 0, chunk_size)
+        for alias in shards()))
+    for (pk, x_board, o_board, board_size, win_length, current_player,
+            winner, status, move_count, created, modified) in rows:
+        yield json.dumps({
+            'id': pk,
+            'board': Board(
+                board_size, win_length, x_board, o_board).to_json(),
+            'board_size': board_size,
+            'win_length': win_length,
+            'current_player': current_player,
+            'winner': winner,
+            'status': status,
+            'move_count': move_count,
+            'created': created,
+            'modified': modified,
+        }, cls=DjangoJSONEncoder) + '\n'
+
+
+def _keyset(queryset, last_id, chunk_size):
+    """Yield the rows of an id-ordered queryset after last_id, reading
+    chunk_size at a time."""
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1][0]
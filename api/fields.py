@@ -0,0 +1,38 @@
+from base64 import b64decode, b64encode
+from django.db import models
+
+
+class BitboardField(models.BinaryField):
+    """Store a bitboard, a non-negative int, as big-endian bytes.
+
+    An empty board takes no bytes at all, and a full 19x19 board
+    takes 46."""
+
+    def from_db_value(self, value, expression, connection, context):
+        """Convert the stored bytes back into an int."""
+        if value is None:
+            return value
+        return int.from_bytes(bytes(value), 'big')
+
+    def to_python(self, value):
+        """Accept ints, raw bytes or the base64 used by fixtures."""
+        if value is None or isinstance(value, int):
+            return value
+        if isinstance(value, str):
+            value = b64decode(value.encode('ascii'))
+        return int.from_bytes(bytes(value), 'big')
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        """Convert the int into bytes for storage."""
+        if isinstance(value, int):
+            value = self._to_bytes(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        """Serialize as base64, like BinaryField."""
+        value = self.value_from_object(obj)
+        return b64encode(self._to_bytes(value)).decode('ascii')
+
+    def _to_bytes(self, value):
+        """Return the shortest big-endian encoding of value."""
+        return value.to_bytes((value.bit_length() + 7) // 8, 'big')
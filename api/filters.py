@@ -0,0 +1,37 @@
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+from .models import Game
+
+
+class GameStatusFilter(filters.BaseFilterBackend):
+    """Filter games by ?status= and ?winner=.
+
+    status is one of Game's statuses (waiting, in_progress, x_won,
+    o_won or draw), or:
+        open: waiting, as a seat is free
+        finished: won by either side or drawn
+    winner is x or o.
+
+    Both filter on Game.status alone, so each is served by one scan of
+    the (status, id) index."""
+
+    STATUSES = dict(
+        {status: (status,) for status, _ in Game.STATUSES},
+        open=(Game.WAITING,),
+        finished=Game.FINISHED)
+    WINNERS = {'x': Game.X_WON, 'o': Game.O_WON}
+
+    def filter_queryset(self, request, queryset, view):
+        """Return the games matching the query parameters."""
+        status = request.query_params.get('status')
+        if status is not None:
+            if status not in self.STATUSES:
+                raise ValidationError('status must be one of: {}'.format(
+                    ', '.join(sorted(self.STATUSES))))
+            queryset = queryset.filter(status__in=self.STATUSES[status])
+        winner = request.query_params.get('winner')
+        if winner is not None:
+            if winner not in self.WINNERS:
+                raise ValidationError('winner must be x or o')
+            queryset = queryset.filter(status=self.WINNERS[winner])
+        return queryset
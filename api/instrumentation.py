@@ -0,0 +1,192 @@
+"""Opt-in timing of requests and of the phases of the move path.
+
+With settings.GAME_INSTRUMENTATION on, InstrumentationMiddleware times
+every request, counts its SQL queries and their time, and sums the
+time spent in each phase() block the request runs through. Each
+response gets a Server-Timing header with the breakdown, and the
+measurements are collected into in-process histograms served in
+Prometheus text format by the metrics view.
+
+With it off, the middleware removes itself at startup and phase() is a
+thread-local lookup returning a shared no-op context manager."""
+import bisect
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+# Upper bounds of the histogram buckets of durations, in seconds
+SECONDS_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0)
+# ... and of query counts
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_local = threading.local()
+
+
+class _NoPhase(object):
+    """The context manager phase() returns when nothing is recording."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+class _Phase(object):
+    """Add the time spent in a block to the request's phase totals."""
+
+    __slots__ = ('phases', 'name', 'started')
+
+    def __init__(self, phases, name):
+        self.phases = phases
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        self.phases[self.name] = self.phases.get(self.name, 0) + elapsed
+        return False
+
+
+def phase(name):
+    """Return a context manager timing a phase of the current request.
+
+    Time spent in several blocks of the same name adds up, so retried
+    work is counted in full."""
+    phases = getattr(_local, 'phases', None)
+    if phases is None:
+        return _NO_PHASE
+    return _Phase(phases, name)
+
+
+class Histogram(object):
+    """A Prometheus-style histogram, split by labels."""
+
+    def __init__(self, name, help_text, label_names, buckets=SECONDS_BUCKETS):
+        """Create an empty histogram."""
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        """Record a value for the given tuple of label values."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        """Return the histogram's lines in Prometheus text format."""
+        lines = ['# HELP {} {}'.format(self.name, self.help_text),
+                 '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            series = sorted(
+                (labels, list(counts), total)
+                for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            pairs = ['{}="{}"'.format(name, value)
+                     for name, value in zip(self.label_names, labels)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{{{}}} {}'.format(
+                    self.name, ','.join(pairs + ['le="{}"'.format(bound)]),
+                    cumulative))
+            labels_text = '{' + ','.join(pairs) + '}'
+            lines.append('{}_sum{} {}'.format(self.name, labels_text, total))
+            lines.append('{}_count{} {}'.format(
+                self.name, labels_text, cumulative))
+        return lines
+
+    def clear(self):
+        """Forget every observation."""
+        with self._lock:
+            self._series.clear()
+
+
+REQUEST_SECONDS = Histogram(
+    'tictactoe_request_duration_seconds',
+    'Time to answer a request.', ('endpoint', 'method', 'status'))
+PHASE_SECONDS = Histogram(
+    'tictactoe_phase_duration_seconds',
+    'Time spent in each phase of a request.', ('endpoint', 'phase'))
+QUERY_SECONDS = Histogram(
+    'tictactoe_db_duration_seconds',
+    'Time spent in SQL queries per request.', ('endpoint',))
+QUERY_COUNTS = Histogram(
+    'tictactoe_db_queries',
+    'SQL queries per request.', ('endpoint',), COUNT_BUCKETS)
+METRICS = (REQUEST_SECONDS, PHASE_SECONDS, QUERY_SECONDS, QUERY_COUNTS)
+
+
+def render_metrics():
+    """Return every metric in Prometheus text format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class InstrumentationMiddleware(object):
+    """Time requests and their phases; see the module docstring."""
+
+    def __init__(self, get_response):
+        """Install only if settings.GAME_INSTRUMENTATION is on."""
+        if not getattr(settings, 'GAME_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Answer the request, measuring it."""
+        for connection in connections.all():
+            connection.force_debug_cursor = True
+        logged = {connection.alias: len(connection.queries_log)
+                  for connection in connections.all()}
+        _local.phases = phases = {}
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            del _local.phases
+        elapsed = time.perf_counter() - started
+        queries = 0
+        query_seconds = 0.0
+        for connection in connections.all():
+            log = list(connection.queries_log)[logged.get(
+                connection.alias, 0):]
+            queries += len(log)
+            query_seconds += sum(float(query['time']) for query in log)
+
+        match = request.resolver_match
+        endpoint = match.url_name if match is not None else 'unknown'
+        REQUEST_SECONDS.observe(
+            (endpoint, request.method, str(response.status_code)), elapsed)
+        for name, seconds in phases.items():
+            PHASE_SECONDS.observe((endpoint, name), seconds)
+        QUERY_SECONDS.observe((endpoint,), query_seconds)
+        QUERY_COUNTS.observe((endpoint,), queries)
+
+        timings = ['{};dur={:.3f}'.format(name, seconds * 1000)
+                   for name, seconds in sorted(phases.items())]
+        timings.append('db;dur={:.3f};desc="{} queries"'.format(
+            query_seconds * 1000, queries))
+        timings.append('total;dur={:.3f}'.format(elapsed * 1000))
+        response['Server-Timing'] = ', '.join(timings)
+        return response
@@ -0,0 +1,37 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.archive import ARCHIVE_CHUNK_SIZE, archive_games
+
+
+class Command(BaseCommand):
+    """Move long-finished games into the archive."""
+
+    help = 'Archive games finished longer ago than a given number of days.'
+
+    def add_arguments(self, parser):
+        """Define the command line arguments."""
+        parser.add_argument(
+            '--days', type=float, default=None,
+            help='Archive games finished at least this many days ago '
+                 '(default: settings.GAME_ARCHIVE_AFTER_DAYS).')
+        parser.add_argument(
+            '--chunk-size', type=int, default=ARCHIVE_CHUNK_SIZE,
+            help='Games moved per transaction.')
+        parser.add_argument(
+            '--every', type=float, default=None,
+            help='Keep running, archiving again every this many seconds.')
+
+    def handle(self, *args, **options):
+        """Archive once, or repeatedly as a background job."""
+        days = options['days']
+        if days is None:
+            days = settings.GAME_ARCHIVE_AFTER_DAYS
+        while True:
+            archived = archive_games(
+                timedelta(days=days), chunk_size=options['chunk_size'])
+            self.stdout.write('Archived {} games'.format(archived))
+            if options['every'] is None:
+                return
+            time.sleep(options['every'])
@@ -0,0 +1,77 @@
+import json
+import platform
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from api.bench import (
+    ClientTransport, HTTPTransport, run_api, run_micro, throwaway_database)
+
+
+class Command(BaseCommand):
+    """Load-test the games API and time its hot helpers."""
+
+    help = ('Play games through the API concurrently and report '
+            'throughput and latency percentiles per endpoint, plus '
+            'micro-benchmarks; optionally save the results as JSON.')
+
+    def add_arguments(self, parser):
+        """Define the command line arguments."""
+        parser.add_argument(
+            '--games', type=int, default=200,
+            help='Games to play through the API.')
+        parser.add_argument(
+            '--threads', type=int, default=8,
+            help='Games played at once.')
+        parser.add_argument(
+            '--url', default=None,
+            help='Base URL of a running server to load-test, e.g. '
+                 'http://localhost:8000. By default requests go through '
+                 'the Django test client against a throwaway database.')
+        parser.add_argument(
+            '--micro-calls', type=int, default=10000,
+            help='Calls per micro-benchmark run; 0 skips them.')
+        parser.add_argument(
+            '--output', default=None,
+            help='File to save the results to as JSON.')
+
+    def handle(self, *args, **options):
+        """Run the benchmarks, print a report and save the results."""
+        results = {
+            'started': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'config': {key: options[key] for key in (
+                'games', 'threads', 'url', 'micro_calls')},
+        }
+        try:
+            if options['url']:
+                results['api'] = run_api(
+                    HTTPTransport(options['url']), options['games'],
+                    options['threads'])
+            else:
+                with throwaway_database():
+                    results['api'] = run_api(
+                        ClientTransport(), options['games'],
+                        options['threads'])
+        except RuntimeError as e:
+            raise CommandError(str(e)) from e
+        if options['micro_calls']:
+            results['micro'] = run_micro(options['micro_calls'])
+
+        self._report(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+
+    def _report(self, results):
+        """Print the results as a table."""
+        api = results['api']
+        self.stdout.write('{} games in {:.2f}s ({:.1f} games/s)'.format(
+            results['config']['games'], api['seconds'],
+            api['games_per_second']))
+        self.stdout.write('{:<20} {:>7} {:>9} {:>8} {:>8} {:>8}'.format(
+            'endpoint', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for name, summary in api['endpoints'].items():
+            self.stdout.write(
+                '{:<20} {count:>7} {per_second:>9.1f} {p50_ms:>8.2f} '
+                '{p95_ms:>8.2f} {p99_ms:>8.2f}'.format(name, **summary))
+        for name, micros in sorted(results.get('micro', {}).items()):
+            self.stdout.write('{:<32} {:>8.2f} us/call'.format(name, micros))
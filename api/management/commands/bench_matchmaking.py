@@ -0,0 +1,49 @@
+import threading
+from collections import Counter
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from rest_framework.test import APIClient
+from api.bench import run_concurrently, throwaway_database
+from api.models import Game, MatchTicket
+
+
+class Command(BaseCommand):
+    """Measure how fast Matchmaking pairs concurrent joiners."""
+
+    help = ('Send many concurrent joiners through /games/match/ on a '
+            'throwaway database and report pairing throughput.')
+
+    def add_arguments(self, parser):
+        """Define the command line arguments."""
+        parser.add_argument(
+            '--joiners', type=int, default=2000,
+            help='Players joining the queue.')
+        parser.add_argument(
+            '--threads', type=int, default=32,
+            help='Players joining at once.')
+
+    def handle(self, *args, **options):
+        """Run the benchmark and print its results."""
+        joiners = options['joiners']
+        with throwaway_database():
+            url = reverse('match')
+            local = threading.local()
+
+            def join(i):
+                if not hasattr(local, 'client'):
+                    local.client = APIClient()
+                return local.client.post(url).status_code
+
+            elapsed, statuses = run_concurrently(
+                join, joiners, options['threads'])
+            games = Game.objects.count()
+            waiting = MatchTicket.objects.count()
+        counts = Counter(statuses)
+        self.stdout.write(
+            '{} joiners on {} threads in {:.2f}s: {:.0f} joins/s, '
+            '{:.0f} games/s'.format(
+                joiners, options['threads'], elapsed, joiners / elapsed,
+                games / elapsed))
+        self.stdout.write(
+            '{} games created, {} players still queued, responses: {}'.format(
+                games, waiting, dict(sorted(counts.items()))))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.bench import run_moves, throwaway_database
+
+
+class Command(BaseCommand):
+    """Measure what one move costs the server."""
+
+    help = ('Make moves one at a time through GameDetail.post on a '
+            'throwaway database and report SQL queries, CPU time and '
+            'wall time per move.')
+
+    def add_arguments(self, parser):
+        """Define the command line arguments."""
+        parser.add_argument(
+            '--games', type=int, default=100,
+            help='Games to play, 8 moves each.')
+
+    def handle(self, *args, **options):
+        """Run the benchmark and print its results."""
+        try:
+            with throwaway_database():
+                result = run_moves(options['games'])
+        except RuntimeError as e:
+            raise CommandError(str(e)) from e
+        moves = result['moves']
+        self.stdout.write(
+            '{} moves: {:.2f} queries, {:.3f} ms CPU, {:.3f} ms wall '
+            'per move'.format(
+                moves, result['queries'] / moves,
+                result['cpu_seconds'] * 1000 / moves,
+                result['wall_seconds'] * 1000 / moves))
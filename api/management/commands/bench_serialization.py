@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.bench import run_serialization, throwaway_database
+
+
+class Command(BaseCommand):
+    """Compare serializing games by GameSerializer and by game_reader."""
+
+    help = ('Read uncached games and pages of games on a throwaway '
+            'database, serializing them with GameSerializer and then '
+            'with the hand-written game_reader, and report CPU time per '
+            'request for each.')
+
+    def add_arguments(self, parser):
+        """Define the command line arguments."""
+        parser.add_argument(
+            '--games', type=int, default=100,
+            help='Games to read; each listed page holds all of them.')
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Requests per endpoint and serializer.')
+
+    def handle(self, *args, **options):
+        """Run the benchmark and print its results."""
+        if options['games'] < 1 or options['requests'] < 1:
+            raise CommandError('--games and --requests must be at least 1')
+        try:
+            with throwaway_database():
+                results = run_serialization(
+                    options['games'], options['requests'])
+        except RuntimeError as e:
+            raise CommandError(str(e)) from e
+        baseline = results['GameSerializer']
+        for name, timings in results.items():
+            for endpoint, ms in sorted(timings.items()):
+                self.stdout.write(
+                    '{} with {}: {:.3f} ms CPU per request ({:.2f}x)'.format(
+                        endpoint, name, ms, baseline[endpoint] / ms))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.bench import run_sharded_moves, throwaway_database
+
+
+class Command(BaseCommand):
+    """Measure how move throughput scales with the number of shards."""
+
+    help = ('Make moves from many threads at once on a throwaway database, '
+            'with games spread over 1, 2, 4... sqlite shards in turn, and '
+            'report moves per second for each.')
+
+    def add_arguments(self, parser):
+        """Define the command line arguments."""
+        parser.add_argument(
+            '--shards', type=int, nargs='+', default=[1, 2, 4],
+            help='Numbers of shards to compare.')
+        parser.add_argument(
+            '--games', type=int, default=200,
+            help='Games to play per run, 8 moves each.')
+        parser.add_argument(
+            '--threads', type=int, default=16,
+            help='Games played at once.')
+
+    def handle(self, *args, **options):
+        """Run the benchmark and print its results."""
+        if min(options['shards']) < 1:
+            raise CommandError('--shards must be at least 1')
+        try:
+            with throwaway_database():
+                results = run_sharded_moves(
+                    options['shards'], options['games'], options['threads'])
+        except RuntimeError as e:
+            raise CommandError(str(e)) from e
+        baseline = results[options['shards'][0]]
+        for count, per_second in results.items():
+            self.stdout.write(
+                '{} shard{}: {:.0f} moves/s ({:.2f}x)'.format(
+                    count, '' if count == 1 else 's', per_second,
+                    per_second / baseline))
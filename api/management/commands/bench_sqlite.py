@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.bench import STOCK_SQLITE_PRAGMAS, run_processes, throwaway_database
+
+
+class Command(BaseCommand):
+    """Compare move throughput on stock and tuned sqlite."""
+
+    help = ('Make moves from several worker processes at once on a '
+            'throwaway sqlite database, first as sqlite comes (rollback '
+            'journal, full sync, a connection per request), then with '
+            'GAME_SQLITE_PRAGMAS and persistent connections, and report '
+            'moves per second for each.')
+
+    def add_arguments(self, parser):
+        """Define the command line arguments."""
+        parser.add_argument(
+            '--games', type=int, default=200,
+            help='Games to play per run, 8 moves each.')
+        parser.add_argument(
+            '--processes', type=int, default=4,
+            help='Worker processes making moves at once.')
+
+    def handle(self, *args, **options):
+        """Run the benchmark and print its results."""
+        runs = (
+            ('stock', STOCK_SQLITE_PRAGMAS, 0),
+            ('tuned', settings.GAME_SQLITE_PRAGMAS,
+             settings.DATABASES['default'].get('CONN_MAX_AGE', 0)),
+        )
+        baseline = None
+        for name, pragmas, conn_max_age in runs:
+            with throwaway_database():
+                per_second, abandoned = run_processes(
+                    options['games'], options['processes'], pragmas,
+                    conn_max_age)
+            if baseline is None:
+                baseline = per_second
+            self.stdout.write(
+                '{}: {:.0f} moves/s ({:.2f}x) over {} processes, {} games '
+                'abandoned on a refused move'.format(
+                    name, per_second, per_second / baseline,
+                    options['processes'], abandoned))
@@ -0,0 +1,27 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.outcomes import build
+
+
+class Command(BaseCommand):
+    """Write the outcome table of every 3x3 position."""
+
+    help = 'Solve every 3x3 position and write the outcome table.'
+
+    def add_arguments(self, parser):
+        """Define the command line arguments."""
+        parser.add_argument(
+            '--output', default=None,
+            help='File to write to instead of settings.GAME_OUTCOME_TABLE.')
+
+    def handle(self, *args, **options):
+        """Build the table and replace the file in one rename, so
+        processes mapping the old file keep a consistent view."""
+        path = options['output'] or settings.GAME_OUTCOME_TABLE
+        table = build()
+        partial = path + '.partial'
+        with open(partial, 'wb') as output:
+            output.write(table)
+        os.replace(partial, path)
+        self.stdout.write('Wrote {} bytes to {}'.format(len(table), path))
@@ -0,0 +1,55 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from api.bulk import BULK_CREATE_BATCH_SIZE, create_games
+from api.models import Game
+
+
+class Command(BaseCommand):
+    """Create games in bulk."""
+
+    help = ('Create games in batches, one bulk insert each, optionally '
+            'with both seats taken, and write each game as a line of '
+            'JSON: its id, and its X and O tokens if seated.')
+
+    def add_arguments(self, parser):
+        """Define the command line arguments."""
+        parser.add_argument(
+            'count', type=int, help='Games to create.')
+        parser.add_argument(
+            '--board-size', type=int, default=Game.BOARD_SIZE,
+            help='Board size.')
+        parser.add_argument(
+            '--win-length', type=int, default=None,
+            help='Pieces in a row to win (default: the board size).')
+        parser.add_argument(
+            '--seats', action='store_true',
+            help='Take both seats of every game with fresh tokens.')
+        parser.add_argument(
+            '--batch-size', type=int, default=BULK_CREATE_BATCH_SIZE,
+            help='Games inserted per transaction.')
+
+    def handle(self, *args, **options):
+        """Create the games, writing each out as its batch commits."""
+        if options['count'] < 1 or options['batch_size'] < 1:
+            raise CommandError('count and --batch-size must be at least 1')
+        size = options['board_size']
+        win_length = options['win_length'] or size
+        if not Game.MIN_BOARD_SIZE <= size <= Game.MAX_BOARD_SIZE:
+            raise CommandError('--board-size must be between {} and {}'.format(
+                Game.MIN_BOARD_SIZE, Game.MAX_BOARD_SIZE))
+        if not Game.MIN_BOARD_SIZE <= win_length <= size:
+            raise CommandError('--win-length must be between {} and {}'.format(
+                Game.MIN_BOARD_SIZE, size))
+        started = time.perf_counter()
+        for pk, x_token, o_token in create_games(
+                options['count'], size, win_length, options['seats'],
+                options['batch_size']):
+            line = {'id': pk}
+            if options['seats']:
+                line.update(x_token=x_token, o_token=o_token)
+            self.stdout.write(json.dumps(line))
+        elapsed = time.perf_counter() - started
+        self.stderr.write(
+            'Created {} games in {:.2f}s: {:.0f} games/sec'.format(
+                options['count'], elapsed, options['count'] / elapsed))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.export import EXPORT_CHUNK_SIZE, export_games, parse_since
+
+
+class Command(BaseCommand):
+    """Dump games as newline-delimited JSON."""
+
+    help = 'Export games as newline-delimited JSON, in id order.'
+
+    def add_arguments(self, parser):
+        """Define the command line arguments."""
+        parser.add_argument(
+            '--after-id', type=int, default=None,
+            help='Resume after the game with this id.')
+        parser.add_argument(
+            '--since', default=None,
+            help='Only export games modified at or after this ISO 8601 '
+                 'timestamp.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+            help='Games read from the database per query.')
+        parser.add_argument(
+            '--output', default=None,
+            help='File to write to instead of stdout.')
+
+    def handle(self, *args, **options):
+        """Stream the export to stdout or the output file."""
+        since = None
+        if options['since']:
+            try:
+                since = parse_since(options['since'])
+            except ValueError as e:
+                raise CommandError(str(e)) from e
+        lines = export_games(
+            after_id=options['after_id'],
+            modified_since=since,
+            chunk_size=options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
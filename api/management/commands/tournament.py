@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.models import Game
+from api.tournament import STRATEGIES, run_tournament
+
+
+class Command(BaseCommand):
+    """Play bot-vs-bot tournaments offline."""
+
+    help = ('Play games between strategies in a pool of worker processes '
+            'and report the standings and games per second per core.')
+
+    def add_arguments(self, parser):
+        """Define the command line arguments."""
+        parser.add_argument(
+            'strategies', nargs='+',
+            help='Strategies to play: {} or the dotted path of a '
+                 'callable.'.format(', '.join(sorted(STRATEGIES))))
+        parser.add_argument(
+            '--games', type=int, default=1000,
+            help='Games per pairing; every strategy plays every other, '
+                 'and itself, as X and as O.')
+        parser.add_argument(
+            '--board-size', type=int, default=Game.BOARD_SIZE,
+            help='Board size.')
+        parser.add_argument(
+            '--win-length', type=int, default=None,
+            help='Pieces in a row to win (default: the board size).')
+        parser.add_argument(
+            '--processes', type=int, default=None,
+            help='Worker processes (default: one per CPU).')
+        parser.add_argument(
+            '--seed', type=int, default=None,
+            help='Seed, for reproducible results.')
+        parser.add_argument(
+            '--save', action='store_true',
+            help='Save the finished games into the Game table.')
+
+    def handle(self, *args, **options):
+        """Run the tournament and print its results."""
+        if options['games'] < 1:
+            raise CommandError('--games must be at least 1')
+        try:
+            result = run_tournament(
+                options['strategies'], options['games'],
+                board_size=options['board_size'],
+                win_length=options['win_length'],
+                processes=options['processes'], seed=options['seed'],
+                save=options['save'])
+        except ValueError as e:
+            raise CommandError(str(e)) from e
+        for pairing in result['pairings']:
+            self.stdout.write(
+                '{x} (X) vs {o} (O): {x_wins} X wins, {o_wins} O wins, '
+                '{draws} draws, {x_forfeits}/{o_forfeits} '
+                'forfeits'.format(**pairing))
+        for name, standing in sorted(
+                result['standings'].items(),
+                key=lambda item: (-item[1]['wins'], item[1]['losses'])):
+            self.stdout.write(
+                '{}: {wins} wins, {draws} draws, {losses} losses'.format(
+                    name, **standing))
+        if options['save']:
+            self.stdout.write('Saved {} games'.format(result['saved']))
+        self.stdout.write(
+            '{} games in {:.2f}s: {:.0f} games/sec, {:.0f} games/sec per '
+            'core over {} processes'.format(
+                result['games'], result['seconds'],
+                result['games_per_second'],
+                result['games_per_second'] / result['processes'],
+                result['processes']))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+from django.db import migrations, models
+
+
+def count_lines(apps, schema_editor):
+    """Rebuild the per-line tallies of existing games from their boards."""
+    Game = apps.get_model('api', 'Game')
+    for game in Game.objects.all():
+        board = json.loads(game.board)
+        size = len(board)
+        counts = [0] * (2 * size + 2)
+        for r in range(size):
+            for c in range(size):
+                if board[r][c] is None:
+                    continue
+                delta = 1 if board[r][c] else -1
+                counts[r] += delta
+                counts[size + c] += delta
+                if r == c:
+                    counts[2 * size] += delta
+                if r + c == size - 1:
+                    counts[2 * size + 1] += delta
+        game.line_counts = json.dumps(counts)
+        game.save(update_fields=['line_counts'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_auto_20170523_0330'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='line_counts',
+            field=models.CharField(default='[0, 0, 0, 0, 0, 0, 0, 0]', max_length=255),
+        ),
+        migrations.RunPython(count_lines, migrations.RunPython.noop),
+    ]
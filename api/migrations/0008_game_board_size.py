@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_game_line_counts'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='game',
+            name='line_counts',
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='board_size',
+            field=models.PositiveSmallIntegerField(default=3),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='win_length',
+            field=models.PositiveSmallIntegerField(default=3),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='board',
+            field=models.TextField(default='[[null, null, null], [null, null, null], [null, null, null]]'),
+        ),
+    ]
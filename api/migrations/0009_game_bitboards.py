@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+from django.db import migrations
+import api.fields
+
+
+def rows_to_bitboards(apps, schema_editor):
+    """Pack each JSON board into X and O bitboards."""
+    Game = apps.get_model('api', 'Game')
+    for game in Game.objects.all():
+        rows = json.loads(game.board)
+        size = len(rows)
+        x = o = 0
+        for r, row in enumerate(rows):
+            for c, val in enumerate(row):
+                if val is None:
+                    continue
+                if val:
+                    x |= 1 << (r * size + c)
+                else:
+                    o |= 1 << (r * size + c)
+        game.x_board = x
+        game.o_board = o
+        game.save(update_fields=['x_board', 'o_board'])
+
+
+def bitboards_to_rows(apps, schema_editor):
+    """Unpack X and O bitboards into JSON boards."""
+    Game = apps.get_model('api', 'Game')
+    for game in Game.objects.all():
+        size = game.board_size
+        rows = [[None] * size for _ in range(size)]
+        for r in range(size):
+            for c in range(size):
+                bit = 1 << (r * size + c)
+                if game.x_board & bit:
+                    rows[r][c] = True
+                elif game.o_board & bit:
+                    rows[r][c] = False
+        game.board = json.dumps(rows)
+        game.save(update_fields=['board'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_game_board_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='x_board',
+            field=api.fields.BitboardField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='o_board',
+            field=api.fields.BitboardField(default=0),
+        ),
+        migrations.RunPython(rows_to_bitboards, bitboards_to_rows),
+        migrations.RemoveField(
+            model_name='game',
+            name='board',
+        ),
+    ]
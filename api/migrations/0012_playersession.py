@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 12:04
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def open_sessions(apps, schema_editor):
+    """Create a session for every token already handed out."""
+    Game = apps.get_model('api', 'Game')
+    PlayerSession = apps.get_model('api', 'PlayerSession')
+    seen = set()
+    sessions = []
+    for game in Game.objects.exclude(x_token=None, o_token=None).iterator():
+        for player, token in ((True, game.x_token), (False, game.o_token)):
+            if not token:
+                continue
+            token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+            # tokens are unique in practice; keep the first if not
+            if token_hash in seen:
+                continue
+            seen.add(token_hash)
+            sessions.append(PlayerSession(
+                token_hash=token_hash, game_id=game.pk, player=player))
+    PlayerSession.objects.bulk_create(sessions, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_game_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerSession',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token_hash', models.CharField(max_length=64, unique=True)),
+                ('player', models.BooleanField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sessions', to='api.Game')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='playersession',
+            unique_together=set([('game', 'player')]),
+        ),
+        migrations.RunPython(open_sessions, migrations.RunPython.noop),
+    ]
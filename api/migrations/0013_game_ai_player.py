@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 12:06
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_playersession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='ai_player',
+            field=models.NullBooleanField(),
+        ),
+    ]
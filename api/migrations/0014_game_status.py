@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 12:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# The game rules as they stood at this migration, copied rather than
+# imported so later changes to them cannot change what it computes
+SIZE = 3
+LINES = (
+    [sum(1 << (row * SIZE + col) for col in range(SIZE))
+     for row in range(SIZE)] +
+    [sum(1 << (row * SIZE + col) for row in range(SIZE))
+     for col in range(SIZE)] +
+    [sum(1 << (i * SIZE + i) for i in range(SIZE)),
+     sum(1 << (i * SIZE + SIZE - 1 - i) for i in range(SIZE))])
+FULL = (1 << SIZE * SIZE) - 1
+
+
+def derive_status(apps, schema_editor):
+    """Count the moves and set the status of every existing game."""
+    Game = apps.get_model('api', 'Game')
+    can_be_won = _winnable_positions()
+    for game in Game.objects.iterator():
+        game.move_count = _count(game.x_board) + _count(game.o_board)
+        if game.winner is not None:
+            game.status = 'x_won' if game.winner else 'o_won'
+        elif (game.move_count == game.board_size * game.board_size or
+              _forced_draw(game, can_be_won)):
+            game.status = 'draw'
+        elif game.x_token and game.o_token:
+            game.status = 'in_progress'
+        else:
+            game.status = 'waiting'
+        game.save(update_fields=['move_count', 'status'])
+
+
+def _count(bits):
+    """Return the number of pieces on a bitboard."""
+    return bin(bits).count('1')
+
+
+def _winnable_positions():
+    """Return {(x, o): whether either side can still win} for every 3x3
+    position that can arise in play, X moving first."""
+    winnable = {}
+
+    def visit(x, o):
+        if (x, o) in winnable:
+            return winnable[x, o]
+        if any(bits & line == line for bits in (x, o) for line in LINES):
+            result = True
+        elif x | o == FULL:
+            result = False
+        else:
+            x_to_move = _count(x) == _count(o)
+            results = [
+                visit(x | bit, o) if x_to_move else visit(x, o | bit)
+                for bit in (1 << cell for cell in range(SIZE * SIZE))
+                if not (x | o) & bit]
+            result = any(results)
+        winnable[x, o] = result
+        return result
+
+    visit(0, 0)
+    return winnable
+
+
+def _forced_draw(game, can_be_won):
+    """Return whether neither player can win any more, which was only
+    known for classic 3x3 games in positions reachable by alternating
+    moves with X first."""
+    if game.board_size != SIZE or game.win_length != SIZE:
+        return False
+    move_count = _count(game.x_board) + _count(game.o_board)
+    if (move_count % 2 == 0) != game.current_player:
+        return False
+    return can_be_won.get((game.x_board, game.o_board)) is False
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_game_ai_player'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='game',
+            name='api_game_winner_86ba41_idx',
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='move_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='status',
+            field=models.CharField(choices=[('waiting', 'Waiting for a player'), ('in_progress', 'In progress'), ('x_won', 'Won by X'), ('o_won', 'Won by O'), ('draw', 'Drawn')], default='waiting', max_length=11),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['status', 'id'], name='api_game_status_93a590_idx'),
+        ),
+        migrations.RunPython(derive_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 12:12
+from __future__ import unicode_literals
+
+import api.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def snapshot_games(apps, schema_editor):
+    """Snapshot every game with moves, whose history is not known, so
+    the log replays from its current board onwards."""
+    Game = apps.get_model('api', 'Game')
+    Snapshot = apps.get_model('api', 'Snapshot')
+    snapshots = [
+        Snapshot(game_id=pk, ply=move_count, x_board=x_board, o_board=o_board)
+        for pk, move_count, x_board, o_board in Game.objects.filter(
+            move_count__gt=0).values_list(
+                'id', 'move_count', 'x_board', 'o_board').iterator()]
+    Snapshot.objects.bulk_create(snapshots, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_game_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Move',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ply', models.PositiveSmallIntegerField()),
+                ('row', models.PositiveSmallIntegerField()),
+                ('col', models.PositiveSmallIntegerField()),
+                ('player', models.BooleanField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='moves', to='api.Game')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Snapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ply', models.PositiveSmallIntegerField()),
+                ('x_board', api.fields.BitboardField()),
+                ('o_board', api.fields.BitboardField()),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='api.Game')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='snapshot',
+            unique_together=set([('game', 'ply')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='move',
+            unique_together=set([('game', 'ply')]),
+        ),
+        migrations.RunPython(snapshot_games, migrations.RunPython.noop),
+    ]
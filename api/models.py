@@ -1,5 +1,15 @@
+import binascii
+import hashlib
 import json
+import os
+import zlib
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
+from .board import Board
+from .fields import BitboardField
+from .outcomes import OutcomeTable, get_outcome_table
+from .sharding import ShardedQuerySet, shard_of
 
 
 class Game(models.Model):
@@ -8,27 +18,177 @@ class Game(models.Model):
     Each player, upon joining the game as their chosen piece (X or O)
     is given a "secret" token, which authorizes them to make moves.
     Internally, the X-player is represented by True and the O-player
-    by False."""
+    by False.
+
+    The board is board_size x board_size, and a player wins by placing
+    win_length pieces in a row, column or diagonal (e.g. 15x15 with 5
+    in a row for gomoku). Both default to classic 3x3 tic-tac-toe.
+    Each side's pieces are stored as a bitboard; see board.Board.
+
+    Every save through save_if_current bumps version, so concurrent
+    writers can detect that the game changed under them, and so does a
+    direct save of a stored game (see advance_version): a version never
+    comes back, so it names one state of the game in ETags and in the
+    game cache.
+
+    status follows the game through its lifecycle: waiting for a player
+    to take a free seat, in progress once both are seated, then won by
+    either side or drawn. The move path keeps it and move_count current
+    as each move is made; save() derives both from the board.
+
+    Games may be spread over several databases by id; see sharding."""
 
     BOARD_SIZE = 3
+    MIN_BOARD_SIZE = 3
+    MAX_BOARD_SIZE = 19
+
+    WAITING = 'waiting'
+    IN_PROGRESS = 'in_progress'
+    X_WON = 'x_won'
+    O_WON = 'o_won'
+    DRAW = 'draw'
+    STATUSES = (
+        (WAITING, 'Waiting for a player'),
+        (IN_PROGRESS, 'In progress'),
+        (X_WON, 'Won by X'),
+        (O_WON, 'Won by O'),
+        (DRAW, 'Drawn'),
+    )
+    FINISHED = (X_WON, O_WON, DRAW)
 
-    board = models.CharField(max_length=255, blank=False, default=json.dumps(
-        [[None] * BOARD_SIZE] * BOARD_SIZE))
+    x_board = BitboardField(default=0)
+    o_board = BitboardField(default=0)
+    board_size = models.PositiveSmallIntegerField(default=BOARD_SIZE)
+    win_length = models.PositiveSmallIntegerField(default=BOARD_SIZE)
     current_player = models.BooleanField(default=True)
     winner = models.NullBooleanField()
     x_token = models.CharField(max_length=255, null=True)
     o_token = models.CharField(max_length=255, null=True)
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=0)
+    # The side played by the computer, if any; see solver
+    ai_player = models.NullBooleanField()
+    status = models.CharField(
+        max_length=11, choices=STATUSES, default=WAITING)
+    move_count = models.PositiveSmallIntegerField(default=0)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        """Index the columns GameList orders and filters by."""
+
+        indexes = [
+            models.Index(fields=['modified', 'id']),
+            models.Index(fields=['status', 'id']),
+        ]
 
     def __str__(self):
         """Return string representation."""
-        board = json.loads(self.board)
         retval = ''
-        for row in board:
+        for row in self.get_board().to_rows():
             retval += ' '.join(map(self._player_to_str, row)) + '\n'
         return retval
 
+    @property
+    def board(self):
+        """Return the board as JSON, the shape served by the API."""
+        return self.get_board().to_json()
+
+    @board.setter
+    def board(self, value):
+        """Replace the board from its JSON encoding."""
+        self.set_board(Board.from_json(value, self.win_length))
+
+    def get_board(self):
+        """Return the board as a Board."""
+        return Board(
+            self.board_size, self.win_length, self.x_board, self.o_board)
+
+    def set_board(self, board):
+        """Store the given Board."""
+        self.x_board = board.x
+        self.o_board = board.o
+
+    def save(self, *args, **kwargs):
+        """Save the game, first deriving move_count and status from the
+        board."""
+        if self.pk is None:
+            kwargs.setdefault('using', shard_of(self))
+        board = self.get_board()
+        self.move_count = board.count()
+        self.status = self._compute_status(board)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {
+                'move_count', 'status', 'version'}
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding and self.move_count:
+            # the log replays from the board the game started with
+            Snapshot.objects.create(
+                game=self, ply=self.move_count,
+                x_board=self.x_board, o_board=self.o_board)
+
+    def save_if_current(self, update_fields):
+        """Save update_fields unless the game changed since it was read.
+
+        Issues a single UPDATE ... WHERE version = <version read>, so of
+        several requests racing on the same game exactly one wins, on
+        any database and across any number of processes. Returns False
+        if another write got there first; the caller should re-read the
+        game and try again."""
+        self.modified = timezone.now()
+        values = {name: getattr(self, name) for name in update_fields}
+        values['modified'] = self.modified
+        updated = Game.objects.filter(
+            pk=self.pk, version=self.version).update(
+                version=F('version') + 1, **values)
+        if updated:
+            self.version += 1
+        return bool(updated)
+
+    def board_at(self, ply):
+        """Return the board as it was after the given ply.
+
+        Rebuilt from the nearest snapshot at or before the ply, so at
+        most Snapshot.INTERVAL logged moves are replayed. Raises
+        ValueError if the log does not reach back to the ply."""
+        snapshot = self.snapshots.filter(ply__lte=ply).order_by(
+            '-ply').first()
+        if snapshot is None:
+            board = Board(self.board_size, self.win_length)
+            start = 0
+        else:
+            board = Board(
+                self.board_size, self.win_length,
+                snapshot.x_board, snapshot.o_board)
+            start = snapshot.ply
+        moves = self.moves.filter(
+            ply__gt=start, ply__lte=ply).order_by('ply')
+        count = 0
+        for move in moves:
+            board.place(move.row, move.col, move.player)
+            count += 1
+        if count != ply - start:
+            raise ValueError('No history of ply {}'.format(ply))
+        return board
+
+    def _log_move(self, board, player, row, col):
+        """Return the unsaved log rows for the move just made.
+
+        That is the Move and, every Snapshot.INTERVAL plies, a Snapshot
+        of the board after it; the caller saves them in the move's
+        transaction."""
+        rows = [Move(
+            game=self, ply=self.move_count, row=row, col=col,
+            player=player)]
+        if self.move_count % Snapshot.INTERVAL == 0:
+            rows.append(Snapshot(
+                game=self, ply=self.move_count,
+                x_board=board.x, o_board=board.o))
+        return rows
+
     def _player_to_str(self, player):
         """Return string representation."""
         if player is None:
@@ -38,81 +198,230 @@ class Game(models.Model):
         else:
             return 'O'
 
-    def _get_player(self, token):
-        """Return the player the given token belongs to."""
-        if token == self.x_token:
-            return True
-        elif token == self.o_token:
-            return False
-        else:
-            raise ValueError('Unauthorized token: {}'.format(token))
+    def _winner_after_move(self, board, row, col):
+        """Return the winner after a move at (row, col), if one yet exists.
+
+        Only the windows through the move are checked, so the cost does
+        not grow with how full the board is."""
+        if self.winner is not None:
+            return self.winner
+        return board.winner_through(row, col)
+
+    def _outcome(self, board):
+        """Return (value, best moves, forced draw) for the player to move.
+
+        Comes from the precomputed outcome table, so it is only known
+        for classic 3x3 games in positions reachable by alternating
+        moves with X first; otherwise returns None."""
+        if not OutcomeTable.covers(board):
+            return None
+        x_to_move = bin(board.x).count('1') == bin(board.o).count('1')
+        if x_to_move != self.current_player:
+            return None
+        try:
+            return get_outcome_table().lookup(board)
+        except ValueError:
+            return None
+
+    def _compute_status(self, board):
+        """Return the game's status with the given board.
+
+        winner and move_count must already account for the board. A
+        full board is a draw, and so is a classic game as soon as
+        neither player can win any more."""
+        if self.winner is not None:
+            return self.X_WON if self.winner else self.O_WON
+        if self.move_count == board.size * board.size:
+            return self.DRAW
+        outcome = self._outcome(board)
+        if outcome is not None and outcome[2]:
+            return self.DRAW
+        if self.x_token and self.o_token:
+            return self.IN_PROGRESS
+        return self.WAITING
+
+    def is_over(self):
+        """Return whether no more moves may be made."""
+        return self.status in self.FINISHED
 
     def _and_the_winner_is(self, board):
-        """Return the winner, if one yet exists."""
+        """Return the winner, if one yet exists.
+
+        Takes the board as a list of lists and checks every window; the
+        move path uses _winner_after_move."""
         if self.winner is not None:
             return self.winner
+        return Board.from_rows(board, self.win_length).winner()
+
+
+def advance_version(sender, instance, using, **kwargs):
+    """Move a stored game's version past the one in the database before
+    a direct Game.save(), which may carry an older one (e.g. loading a
+    fixture to reset the game)."""
+    if instance.pk is None:
+        return
+    stored = Game.objects.using(using).filter(pk=instance.pk).values_list(
+        'version', flat=True).first()
+    if stored is not None:
+        instance.version = stored + 1
+
+
+class PlayerSession(models.Model):
+    """A player's seat in a game, looked up by a hash of their token.
+
+    Every token handed out by JoinGame gets a session, so authorizing a
+    request is one indexed lookup that resolves both the game and the
+    side, and a token's games can be found without scanning Game. The
+    session keeps only the SHA-256 of the token; the token itself is
+    still stored in the game's x_token or o_token, which GameSerializer
+    serves, and in a MatchTicket while its player is queued."""
+
+    token_hash = models.CharField(max_length=64, unique=True)
+    game = models.ForeignKey(
+        Game, on_delete=models.CASCADE, related_name='sessions')
+    player = models.BooleanField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        """One session per seat."""
+
+        unique_together = ('game', 'player')
+
+    @staticmethod
+    def hash_token(token):
+        """Return the hash a token is stored under."""
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def new_tokens(count):
+        """Return count fresh random tokens, formatted like uuid4's.
+
+        The randomness for all of them is read from os.urandom at once,
+        and each token formatted straight from its hex digits."""
+        raw = bytearray(os.urandom(16 * count))
+        # the version (4) and variant bits of a random UUID
+        raw[6::16] = bytes(byte & 0x0f | 0x40 for byte in raw[6::16])
+        raw[8::16] = bytes(byte & 0x3f | 0x80 for byte in raw[8::16])
+        digits = binascii.hexlify(raw).decode()
+        return [
+            '-'.join((digits[i:i + 8], digits[i + 8:i + 12],
+                      digits[i + 12:i + 16], digits[i + 16:i + 20],
+                      digits[i + 20:i + 32]))
+            for i in range(0, len(digits), 32)]
+
+    @classmethod
+    def open(cls, game, player, token):
+        """Create the session for the player's seat in the game."""
+        return cls.objects.create(
+            token_hash=cls.hash_token(token), game=game, player=player)
+
+
+def close_stale_sessions(sender, instance, created, using, **kwargs):
+    """Delete the sessions of seats whose token a direct Game.save()
+    cleared or replaced (e.g. loading a fixture to reset the game), so
+    the old tokens stop working and the seats can be taken again."""
+    if created:
+        return
+    tokens = [token for token in (instance.x_token, instance.o_token)
+              if token]
+    PlayerSession.objects.using(using).filter(game_id=instance.pk).exclude(
+        token_hash__in=[PlayerSession.hash_token(token)
+                        for token in tokens]).delete()
+
+
+class MatchTicket(models.Model):
+    """A player queued by Matchmaking, waiting for an opponent.
+
+    Tickets are served oldest first. Pairing claims a ticket by
+    deleting it, so a ticket goes to exactly one opponent without any
+    lock being held. The token becomes the player's X token once
+    paired."""
+
+    token = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class Move(models.Model):
+    """One move in a game's append-only move log.
+
+    ply counts the game's moves from 1, so the board after a ply is the
+    board after the move logged under it."""
+
+    game = models.ForeignKey(
+        Game, on_delete=models.CASCADE, related_name='moves')
+    ply = models.PositiveSmallIntegerField()
+    row = models.PositiveSmallIntegerField()
+    col = models.PositiveSmallIntegerField()
+    player = models.BooleanField()
+    created = models.DateTimeField(default=timezone.now)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        """One move per ply."""
+
+        unique_together = ('game', 'ply')
+
+
+class Snapshot(models.Model):
+    """A game's board as of a ply, so Game.board_at replays a bounded
+    number of moves.
+
+    Games keep one every INTERVAL plies, plus one of the board they
+    started with if that was not empty."""
+
+    INTERVAL = 16
+
+    game = models.ForeignKey(
+        Game, on_delete=models.CASCADE, related_name='snapshots')
+    ply = models.PositiveSmallIntegerField()
+    x_board = BitboardField()
+    o_board = BitboardField()
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        """One snapshot per ply."""
+
+        unique_together = ('game', 'ply')
+
+
+def trim_move_log(sender, instance, created, using, **kwargs):
+    """Delete the logged moves and snapshots past a game's move_count
+    after a direct Game.save() took moves back (e.g. loading a fixture
+    to reset the game), so the game is logged and replayed afresh."""
+    if created:
+        return
+    for model in (Move, Snapshot):
+        model.objects.using(using).filter(
+            game_id=instance.pk, ply__gt=instance.move_count).delete()
+
+
+class ArchivedGame(models.Model):
+    """A finished game moved out of Game by archive.archive_games.
+
+    Keeps the id it had as a Game, so it stays reachable at the same
+    URL, and only the columns needed to find it again; the rest is
+    compressed JSON (see load)."""
+
+    id = models.IntegerField(primary_key=True)
+    status = models.CharField(max_length=11, choices=Game.STATUSES)
+    modified = models.DateTimeField()
+    archived = models.DateTimeField(auto_now_add=True)
+    data = models.BinaryField()
+
+    def load(self):
+        """Return the archived record: the serialized game, its version
+        and its move log."""
+        return json.loads(zlib.decompress(self.data).decode('utf-8'))
+
+
+class GameSequence(models.Model):
+    """The next game id to hand out when games are sharded.
+
+    A single row in the default database; sharding.allocate_game_ids
+    reserves ids from it a block at a time."""
 
-        row_winner = self._row_winner(board)
-        column_winner = self._column_winner(board)
-        diagonal_ul_lr = self._diagonal_ul_lr(board)
-        diagonal_ll_ur = self._diagonal_ll_ur(board)
-
-        # verbosely check for None because False is a valid value
-        if row_winner is not None:
-            return row_winner
-        if column_winner is not None:
-            return column_winner
-        if diagonal_ul_lr is not None:
-            return diagonal_ul_lr
-        if diagonal_ll_ur is not None:
-            return diagonal_ll_ur
-        return None
-
-    def _row_winner(self, board):
-        """Return the winner by row."""
-        for r in range(len(board)):
-            ref = board[r][0]
-            if ref is None:
-                continue
-            if all([ref == val for val in board[r][1:]]):
-                return ref
-        return None
-
-    def _column_winner(self, board):
-        """Return the winner by column."""
-        for c in range(len(board[0])):
-            ref = board[0][c]
-            if ref is None:
-                continue
-            all_match = True  # innocent until proven guilty
-            for r in range(1, len(board)):
-                if ref != board[r][c]:
-                    all_match = False
-                    break
-            if all_match:
-                return ref
-        return None
-
-    def _diagonal_ul_lr(self, board):
-        """Return the winner by the upper-left to lower-right diagonal."""
-        all_match = True  # innocent until proven guilty
-        ref = board[0][0]
-        for d in range(1, len(board)):
-            if ref != board[d][d]:
-                all_match = False
-                break
-        if all_match:
-            return ref
-        return None
-
-    def _diagonal_ll_ur(self, board):
-        """Return the winner by the lower-left to upper-right diagonal."""
-        all_match = True  # innocent until proven guilty
-        ref = board[-1][0]
-        for d in range(1, len(board)):
-            if ref != board[-1 - d][d]:
-                all_match = False
-                break
-        if all_match:
-            return ref
-        return None
+    next_id = models.BigIntegerField()
@@ -0,0 +1,163 @@
+"""Precomputed outcomes of every reachable 3x3 position.
+
+The table is a flat array of 16-bit little-endian entries, one per
+3x3 position, addressed by the position's base-3 code (cell r * 3 + c
+contributes 1 * 3 ** cell for X, 2 * 3 ** cell for O). Only positions
+that are the canonical form of their symmetry class are filled in, so
+the 8 rotations and reflections of a position share one entry; other
+slots stay zero. Looking a position up is therefore a canonicalization
+and one array read. Each entry holds:
+
+    bits 0-1: value for the side to move (WIN, DRAW or LOSS; 0 if the
+              position cannot arise in play)
+    bits 2-10: mask of the cells (in canonical orientation) of every
+              move achieving that value
+    bit 11: set if neither side can win any more, however play goes
+
+The file is memory-mapped read-only, so every process shares the one
+copy in the operating system's page cache."""
+import mmap
+import os
+import struct
+from django.conf import settings
+from .board import _windows
+from .solver import canonical, symmetries
+
+SIZE = 3
+CELLS = SIZE * SIZE
+ENTRY = struct.Struct('<H')
+TABLE_BYTES = ENTRY.size * 3 ** CELLS
+
+UNKNOWN, WIN, DRAW, LOSS = 0, 1, 2, 3
+VALUE_MASK = 0b11
+MOVES_SHIFT = 2
+DEAD = 1 << 11
+
+
+def _code(x, o):
+    """Return the base-3 code addressing a position."""
+    code = 0
+    power = 1
+    for cell in range(CELLS):
+        bit = 1 << cell
+        if x & bit:
+            code += power
+        elif o & bit:
+            code += 2 * power
+        power *= 3
+    return code
+
+
+def build():
+    """Solve every reachable position; return the table as bytes."""
+    table = bytearray(TABLE_BYTES)
+    windows, by_cell = _windows(SIZE, SIZE)
+    full = (1 << CELLS) - 1
+    solved = {}
+
+    def won(bits):
+        return any(bits & mask == mask for mask in windows)
+
+    def solve(x, o):
+        """Return (value, winners still possible) for the side to move.
+
+        Fills in the canonical position's entry on the way."""
+        (cx, co), _ = canonical(SIZE, x, o)
+        if (cx, co) in solved:
+            return solved[cx, co]
+        x_to_move = bin(cx).count('1') == bin(co).count('1')
+        mine, theirs = (cx, co) if x_to_move else (co, cx)
+        if won(theirs):
+            result = (LOSS, {not x_to_move})
+            moves = 0
+        elif cx | co == full:
+            result = (DRAW, set())
+            moves = 0
+        else:
+            replies = {}
+            possible = set()
+            for cell in range(CELLS):
+                if (cx | co) & (1 << cell):
+                    continue
+                if x_to_move:
+                    value, winners = solve(cx | (1 << cell), co)
+                else:
+                    value, winners = solve(cx, co | (1 << cell))
+                # the reply's value is for the opponent
+                replies[cell] = {WIN: LOSS, DRAW: DRAW, LOSS: WIN}[value]
+                possible |= winners
+            value = min(replies.values(), key=(WIN, DRAW, LOSS).index)
+            moves = 0
+            for cell, reply in replies.items():
+                if reply == value:
+                    moves |= 1 << cell
+            result = (value, possible)
+        entry = result[0] | moves << MOVES_SHIFT
+        if not result[1]:
+            entry |= DEAD
+        ENTRY.pack_into(table, ENTRY.size * _code(cx, co), entry)
+        solved[cx, co] = result
+        return result
+
+    solve(0, 0)
+    return bytes(table)
+
+
+class OutcomeTable(object):
+    """Look up the outcome of 3x3 positions in a built table."""
+
+    def __init__(self, buffer):
+        """Wrap a buffer holding a table, e.g. an mmap of its file."""
+        if len(buffer) != TABLE_BYTES:
+            raise ValueError('Outcome table must be {} bytes'.format(
+                TABLE_BYTES))
+        self._buffer = buffer
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a table file read-only."""
+        with open(path, 'rb') as table_file:
+            return cls(mmap.mmap(
+                table_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @staticmethod
+    def covers(board):
+        """Return whether the table knows the board's geometry."""
+        return board.size == SIZE and board.win_length == SIZE
+
+    def lookup(self, board):
+        """Return (value, best moves, dead) for the side to move.
+
+        value is WIN, DRAW or LOSS with perfect play from both sides,
+        best moves a list of (row, col), and dead whether the game can
+        only end in a draw. Raises ValueError for an unreachable
+        position."""
+        (x, o), index = canonical(SIZE, board.x, board.o)
+        entry = ENTRY.unpack_from(self._buffer, ENTRY.size * _code(x, o))[0]
+        value = entry & VALUE_MASK
+        if value == UNKNOWN:
+            raise ValueError('Position cannot arise in play')
+        permutation = symmetries(SIZE)[index]
+        moves = entry >> MOVES_SHIFT
+        best = [divmod(permutation.index(cell), SIZE)
+                for cell in range(CELLS) if moves & (1 << cell)]
+        return value, sorted(best), bool(entry & DEAD)
+
+
+_table = None
+
+
+def get_outcome_table():
+    """Return the process-wide table.
+
+    Maps settings.GAME_OUTCOME_TABLE if the file has been built (see
+    the build_outcome_table command); otherwise builds the table in
+    memory, which takes a fraction of a second."""
+    global _table
+    if _table is None:
+        path = getattr(settings, 'GAME_OUTCOME_TABLE', None)
+        if path and os.path.exists(path):
+            _table = OutcomeTable.load(path)
+        else:
+            _table = OutcomeTable(build())
+    return _table
@@ -0,0 +1,23 @@
+from rest_framework.pagination import CursorPagination, _positive_int
+
+
+class GamePagination(CursorPagination):
+    """Page through games by keyset rather than by offset.
+
+    Each page picks up where the previous one's last id (or modified
+    timestamp) left off, so deep pages cost the same as the first.
+    The ordering comes from the view's ?ordering= parameter."""
+
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        """Honor ?page_size=, which CursorPagination ignores."""
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
@@ -14,16 +14,6 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        header_token = self._parse_header_token(request)
-        return header_token and header_token in [obj.x_token, obj.o_token]
-
-    # @DRY views.py
-    def _parse_header_token(self, request):
-        """Extract authorization token from request headers."""
-        try:
-            # per http://stackoverflow.com/a/3889790
-            return request.META.get(
-                'HTTP_AUTHORIZATION'
-            ).strip().split()[1]
-        except Exception:
-            return None
+        # request.auth is the PlayerSession of the request's token, if
+        # any; see authentication.GameTokenAuthentication
+        return request.auth is not None and request.auth.game_id == obj.pk
@@ -0,0 +1,50 @@
+"""The rules of making a move, apart from the API serving them.
+
+parse_row_col, check_move and apply_move are the checks and bookkeeping
+of the move path, free of HTTP and of Django REST framework: the views
+turn IllegalMove into their responses, and offline tournaments play by
+the very same rules without importing the views."""
+
+
+class IllegalMove(ValueError):
+    """A move the rules do not allow; its message says why."""
+
+
+def parse_row_col(data, size):
+    """Return the row and col of a move given as a mapping.
+
+    Both must be integers falling on the game's size x size board;
+    raises IllegalMove otherwise."""
+    try:
+        row = int(data.get('row'))
+        col = int(data.get('col'))
+    except Exception:
+        raise IllegalMove('Row and col required in request body')
+    if not 0 <= row < size or not 0 <= col < size:
+        raise IllegalMove('Row and col must be between {} and {}'.format(
+            0, size - 1))
+    return row, col
+
+
+def check_move(game, board, player, row, col):
+    """Ensure moves are made in turn, in running games, on free cells.
+
+    Raises IllegalMove if the move is not allowed."""
+    if game.is_over():
+        raise IllegalMove('Game is over')
+    if not board.is_free(row, col):
+        raise IllegalMove('Moves cannot overwrite existing moves')
+    if player != game.current_player:
+        raise IllegalMove('Not your turn')
+
+
+def apply_move(game, board, player, row, col):
+    """Make a move checked by check_move on the board and the game, in
+    memory: the piece, the move count, the turn, the winner and the
+    status."""
+    board.place(row, col, player)
+    game.set_board(board)
+    game.move_count += 1
+    game.current_player = not game.current_player
+    game.winner = game._winner_after_move(board, row, col)
+    game.status = game._compute_status(board)
@@ -1,11 +1,31 @@
 import json
+import operator
+from django.conf import settings
 from rest_framework import serializers
-from .models import Game
+from .models import Game, Move
+from .rules import IllegalMove, check_move
 
 
 class GameSerializer(serializers.ModelSerializer):
     """Serialize a game."""
 
+    # The board is stored as bitboards; its JSON encoding is kept at
+    # the API edge for backward compatibility.
+    board = serializers.CharField(required=False)
+
+    # Model columns each non-column field is computed from
+    SOURCE_COLUMNS = {
+        'board': ('x_board', 'o_board', 'board_size', 'win_length'),
+    }
+
+    def __init__(self, *args, **kwargs):
+        """Optionally restrict the output to the given fields."""
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     class Meta:
         """Map serializer fields to model fields."""
 
@@ -13,10 +33,20 @@ class GameSerializer(serializers.ModelSerializer):
         fields = (
             'id',
             'board',
+            'board_size',
+            'win_length',
             'x_token',
             'o_token',
             'current_player',
-            'winner')
+            'winner',
+            'ai_player',
+            'status',
+            'move_count')
+        # Seats (tokens and ai_player) are taken only through JoinGame,
+        # which opens each token's session; status and move_count
+        # follow from the board
+        read_only_fields = (
+            'x_token', 'o_token', 'ai_player', 'status', 'move_count')
         # Ideally these secret tokens would be 'write_only' to
         # ensure they remain secret to the users. Unfortunately,
         # doing so also ensures they remain secret to the views
@@ -26,20 +56,44 @@ class GameSerializer(serializers.ModelSerializer):
         #     'x_token': {'write_only': True},
         #     'o_token': {'write_only': True}}
 
+    def create(self, validated_data):
+        """Create a game, defaulting to a line across the whole board."""
+        size = validated_data.setdefault('board_size', Game.BOARD_SIZE)
+        validated_data.setdefault('win_length', size)
+        return super().create(validated_data)
+
+    def validate_board_size(self, value):
+        """Ensure the board size is within the supported range."""
+        if not Game.MIN_BOARD_SIZE <= value <= Game.MAX_BOARD_SIZE:
+            raise serializers.ValidationError(
+                'Board size must be between {} and {}'.format(
+                    Game.MIN_BOARD_SIZE, Game.MAX_BOARD_SIZE))
+        return value
+
+    def validate(self, attrs):
+        """Ensure a line of win_length fits on the board."""
+        size = attrs.get('board_size', self._board_size())
+        win_length = attrs.get('win_length', size)
+        if not Game.MIN_BOARD_SIZE <= win_length <= size:
+            raise serializers.ValidationError(
+                'Win length must be between {} and {}'.format(
+                    Game.MIN_BOARD_SIZE, size))
+        return attrs
 
     def validate_board(self, value):
         """Ensure board is an NxN array of booleans."""
+        size = self._board_size()
         try:
             board = json.loads(value)
         except Exception as e:
             raise serializers.ValidationError(str(e)) from e
-        if not isinstance(board, list) or len(board) != Game.BOARD_SIZE:
+        if not isinstance(board, list) or len(board) != size:
             raise serializers.ValidationError(
-                'Board must be a {0}x{0} array'.format(Game.BOARD_SIZE))
+                'Board must be a {0}x{0} array'.format(size))
         for row in board:
-            if not isinstance(row, list) or len(row) != Game.BOARD_SIZE:
+            if not isinstance(row, list) or len(row) != size:
                 raise serializers.ValidationError(
-                    'Board must be a {0}x{0} array'.format(Game.BOARD_SIZE))
+                    'Board must be a {0}x{0} array'.format(size))
             for val in row:
                 if val is not None and not isinstance(val, bool):
                     raise serializers.ValidationError(
@@ -47,10 +101,98 @@ class GameSerializer(serializers.ModelSerializer):
         return value
 
     def validate_move(self, game, board, player, row, col):
-        """Ensure moves cannot overwrite existing moves."""
-        if board[row][col] is not None:
-            raise serializers.ValidationError(
-                'Moves cannot overwrite existing moves')
-        if player != game.current_player:
-            raise serializers.ValidationError(
-                'Not your turn')
+        """Ensure moves are made in turn, in running games, on free cells."""
+        validate_move(game, board, player, row, col)
+
+    def _board_size(self):
+        """Return the size the board under validation must have.
+
+        Views updating an existing game pass it in the context; new
+        games take theirs from the request data."""
+        game = self.context.get('game')
+        if game is not None:
+            return game.board_size
+        try:
+            return int(self.initial_data.get('board_size', Game.BOARD_SIZE))
+        except (AttributeError, TypeError, ValueError):
+            return Game.BOARD_SIZE
+
+
+def validate_move(game, board, player, row, col):
+    """Ensure moves are made in turn, in running games, on free cells.
+
+    GameSerializer.validate_move, for the move path to call without
+    building a serializer: rules.check_move, raising ValidationError."""
+    try:
+        check_move(game, board, player, row, col)
+    except IllegalMove as e:
+        raise serializers.ValidationError(str(e)) from e
+
+
+# Validates tokens as the model's x_token and o_token columns allow
+_TOKEN_FIELD = serializers.CharField(
+    max_length=Game._meta.get_field('x_token').max_length)
+
+
+def validate_token(field_name, token):
+    """Return a new token for a seat (field_name: 'x_token' or
+    'o_token'), validated against the token columns.
+
+    The token fields are read-only in GameSerializer, so tokens given
+    out by JoinGame are validated by a field of their own, built once.
+    Raises ValidationError as GameSerializer.is_valid(
+    raise_exception=True) would for a field, keyed by field_name."""
+    try:
+        return _TOKEN_FIELD.to_representation(
+            _TOKEN_FIELD.run_validation(token))
+    except serializers.ValidationError as e:
+        raise serializers.ValidationError({field_name: e.detail}) from e
+
+
+def game_reader(fields=None):
+    """Return a function serializing a game as GameSerializer does.
+
+    The function returns what GameSerializer(game, fields=fields).data
+    holds, as a plain dict, without building a serializer: the fields
+    are read off the game by one precomputed getter into a tuple and
+    zipped with their names. Every field GameSerializer renders is a
+    model attribute or the board property, already of the type it is
+    rendered as. Only the given fields are read, so a game loaded with
+    only() their columns costs no further queries.
+
+    With settings.GAME_FAST_SERIALIZATION off, the function is
+    GameSerializer itself."""
+    if not getattr(settings, 'GAME_FAST_SERIALIZATION', True):
+        return lambda game: GameSerializer(game, fields=fields).data
+    if fields is None:
+        return _read_game
+    return _reader(tuple(
+        name for name in GameSerializer.Meta.fields if name in fields))
+
+
+def _reader(names):
+    """Return a function reading the named fields off a game into a
+    dict."""
+    if len(names) == 1:
+        name = names[0]
+        return lambda game: {name: getattr(game, name)}
+    read = operator.attrgetter(*names)
+    return lambda game: dict(zip(names, read(game)))
+
+
+_read_game = _reader(GameSerializer.Meta.fields)
+
+
+def serialize_game(game):
+    """Return what GameSerializer(game).data holds; see game_reader."""
+    return game_reader()(game)
+
+
+class MoveSerializer(serializers.ModelSerializer):
+    """Serialize a move from a game's move log."""
+
+    class Meta:
+        """Map serializer fields to model fields."""
+
+        model = Move
+        fields = ('ply', 'row', 'col', 'player', 'created')
@@ -0,0 +1,256 @@
+"""Spreading games over several databases.
+
+settings.GAME_SHARDS lists the database aliases games are stored in. A
+game lives in the shard its id picks (id modulo the number of shards),
+together with its move log, snapshots and player sessions; every other
+model stays in 'default'. With a single shard, the default, nothing
+changes and ids come from the database as usual.
+
+With several, a new game's id is allocated before it is inserted, from
+a counter in 'default' handed out a block at a time per process, so ids
+are unique across shards and each write goes straight to its shard.
+GameRouter sends a query to a game's shard when it is given a hint: an
+instance, or a lookup of one game picked up by ShardedQuerySet. Code
+reading or writing many games at once goes through shards() itself.
+
+Games are placed by id modulo the number of shards, so changing the
+number of shards of a database already holding games means moving them
+to their new shards first."""
+import itertools
+import threading
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, models, transaction
+from django.db.models import F, Max
+
+# Models stored in their game's shard
+SHARDED_MODELS = ('game', 'move', 'snapshot', 'playersession')
+# Game ids reserved from the counter at a time by each process
+GAME_ID_BLOCK = 100
+
+_ids_lock = threading.Lock()
+_ids = iter(())
+
+
+def shards():
+    """Return the aliases of the databases games are spread over."""
+    return getattr(settings, 'GAME_SHARDS', [DEFAULT_DB_ALIAS])
+
+
+def is_sharded():
+    """Return whether games are spread over more than one database."""
+    return len(shards()) > 1
+
+
+def game_db(pk):
+    """Return the alias of the database holding the game with id pk."""
+    aliases = shards()
+    return aliases[int(pk) % len(aliases)]
+
+
+def allocate_game_ids(count):
+    """Return count unused game ids, for games about to be inserted."""
+    global _ids
+    with _ids_lock:
+        ids = list(itertools.islice(_ids, count))
+        if len(ids) < count:
+            block = max(count - len(ids), GAME_ID_BLOCK)
+            start = _reserve(block)
+            _ids = iter(range(start, start + block))
+            ids.extend(itertools.islice(_ids, count - len(ids)))
+    return ids
+
+
+def _reserve(count):
+    """Take count ids off the counter; return the first."""
+    from .models import Game, GameSequence
+    while True:
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            counter = GameSequence.objects.using(DEFAULT_DB_ALIAS)
+            if counter.filter(pk=1).update(next_id=F('next_id') + count):
+                return counter.get(pk=1).next_id - count
+        # No counter yet: start it past every id in use
+        start = 1 + max(
+            Game.objects.using(alias).aggregate(Max('id'))['id__max'] or 0
+            for alias in shards())
+        try:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                counter.create(pk=1, next_id=start + count)
+            return start
+        except IntegrityError:
+            # another process started it first
+            continue
+
+
+def shard_of(obj):
+    """Return the alias of the database a Game or one of its rows goes
+    in, first giving a new game its id if games are sharded."""
+    if obj._meta.model_name == 'game':
+        if obj.pk is None:
+            if not is_sharded():
+                return shards()[0]
+            obj.pk = allocate_game_ids(1)[0]
+        return game_db(obj.pk)
+    return game_db(obj.game_id)
+
+
+def atomic_on(aliases):
+    """Return one context manager running a transaction on each of the
+    databases, each alias once."""
+    stack = ExitStack()
+    for alias in dict.fromkeys(aliases):
+        stack.enter_context(transaction.atomic(using=alias))
+    return stack
+
+
+class GameRouter(object):
+    """Route games, and the rows stored alongside them, to their shard."""
+
+    def _db(self, model, **hints):
+        """Return the shard the hints point to, or None to use the
+        default database."""
+        if (model._meta.app_label != 'api' or
+                model._meta.model_name not in SHARDED_MODELS):
+            return None
+        if not is_sharded():
+            return shards()[0]
+        instance = hints.get('instance')
+        if instance is not None:
+            if instance._state.db is not None:
+                return instance._state.db
+            if instance._meta.model_name == 'game':
+                pk = instance.pk
+            else:
+                pk = getattr(instance, 'game_id', None)
+        else:
+            pk = hints.get('game_id')
+        if pk is None:
+            return None
+        return game_db(pk)
+
+    db_for_read = _db
+    db_for_write = _db
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Keep sharded models in the shards and the rest in default."""
+        if db == DEFAULT_DB_ALIAS:
+            return True
+        if db in shards():
+            return app_label == 'api' and model_name in SHARDED_MODELS
+        return None
+
+
+class ShardedQuerySet(models.QuerySet):
+    """A queryset of a sharded model that finds a game's shard itself.
+
+    Filtering on one game (by pk for Game, by game for the rest) hints
+    the router to that game's shard; create(), bulk_create() and, for
+    Game, in_bulk() go to each row's own shard."""
+
+    def _filter_or_exclude(self, negate, *args, **kwargs):
+        """Filter, noting the game filtered on for the router."""
+        clone = super()._filter_or_exclude(negate, *args, **kwargs)
+        if negate:
+            return clone
+        if self.model._meta.model_name == 'game':
+            lookups = ('pk', 'id')
+        else:
+            lookups = ('game', 'game_id')
+        for lookup in lookups:
+            if kwargs.get(lookup) is not None:
+                pk = kwargs[lookup]
+                if isinstance(pk, models.Model):
+                    pk = pk.pk
+                clone._hints = dict(clone._hints, game_id=pk)
+                break
+        return clone
+
+    def create(self, **kwargs):
+        """Create a row in its game's shard."""
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db or shard_of(obj))
+        return obj
+
+    def bulk_create(self, objs, batch_size=None):
+        """Insert rows into their games' shards, one bulk insert each.
+
+        New games are given their ids first when games are sharded."""
+        objs = list(objs)
+        if self._db is not None or not is_sharded():
+            return super().bulk_create(objs, batch_size)
+        if self.model._meta.model_name == 'game':
+            new = [obj for obj in objs if obj.pk is None]
+            for obj, pk in zip(new, allocate_game_ids(len(new))):
+                obj.pk = pk
+        by_shard = {}
+        for obj in objs:
+            by_shard.setdefault(shard_of(obj), []).append(obj)
+        for alias, group in by_shard.items():
+            self.using(alias).bulk_create(group, batch_size)
+        return objs
+
+    def in_bulk(self, id_list=None):
+        """Return games by id, read from each of their shards."""
+        if (self._db is not None or not is_sharded() or id_list is None or
+                self.model._meta.model_name != 'game'):
+            return super().in_bulk(id_list)
+        by_shard = {}
+        for pk in id_list:
+            by_shard.setdefault(game_db(pk), []).append(pk)
+        found = {}
+        for alias, ids in by_shard.items():
+            found.update(self.using(alias).in_bulk(ids))
+        return found
+
+
+class AllShards(object):
+    """A read-only queryset over every shard at once, for listings.
+
+    Supports what GameList's filters and cursor pagination use:
+    filtering, ordering, only() and slicing. A slice [start:stop] reads
+    the first stop rows from each shard and merges them by the
+    queryset's ordering, so it costs one query per shard."""
+
+    def __init__(self, queryset):
+        """Wrap a queryset to run on every shard."""
+        self.queryset = queryset
+        self.model = queryset.model
+
+    def all(self):
+        """Return the same queryset."""
+        return self
+
+    def filter(self, *args, **kwargs):
+        """Filter on every shard."""
+        return AllShards(self.queryset.filter(*args, **kwargs))
+
+    def exclude(self, *args, **kwargs):
+        """Exclude on every shard."""
+        return AllShards(self.queryset.exclude(*args, **kwargs))
+
+    def order_by(self, *field_names):
+        """Order the merged rows."""
+        return AllShards(self.queryset.order_by(*field_names))
+
+    def only(self, *fields):
+        """Load only the given fields on every shard."""
+        return AllShards(self.queryset.only(*fields))
+
+    def __getitem__(self, k):
+        """Return a slice of the merged rows, or one row."""
+        if not isinstance(k, slice):
+            return self[k:k + 1][0]
+        rows = []
+        for alias in shards():
+            queryset = self.queryset.using(alias)
+            rows.extend(queryset[:k.stop] if k.stop is not None else queryset)
+        # stable sorts, last ordering field first
+        for name in reversed(self.queryset.query.order_by):
+            rows.sort(key=lambda row: getattr(row, name.lstrip('-')),
+                      reverse=name.startswith('-'))
+        return rows[k]
+
+    def __iter__(self):
+        """Iterate over the merged rows."""
+        return iter(self[:])
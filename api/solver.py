@@ -0,0 +1,296 @@
+"""Computer player: alpha-beta search over bitboards.
+
+Positions are searched with negamax and alpha-beta pruning, and every
+result is remembered in a transposition table shared by all games of
+the same geometry. Boards small enough to solve outright (3x3) are
+searched to the end, with positions keyed on their canonical form under
+the board's 8 symmetries; the whole game tree is solved once, at
+startup or on first use. Larger boards are searched by iterative
+deepening with a heuristic evaluation, returning the best move of the
+deepest search completed within the time budget."""
+import time
+from functools import lru_cache
+from .board import _windows
+
+# Score of a win; wins sooner score higher
+WIN = 1000000
+# Largest board searched to the end rather than by iterative deepening
+MAX_SOLVED_CELLS = 9
+# Seconds a move on a larger board may think for
+DEFAULT_TIME_BUDGET = 0.5
+# Positions remembered per geometry before the table is cleared
+MAX_TABLE_ENTRIES = 1000000
+
+# Transposition table flags
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class _Timeout(Exception):
+    """The search ran out of time."""
+
+
+@lru_cache(maxsize=None)
+def symmetries(size):
+    """Return the 8 rotations/reflections of a board as cell permutations.
+
+    Each permutation maps a cell index to its index in the transformed
+    board; the identity comes first."""
+    def cell(r, c):
+        return r * size + c
+    transforms = [
+        lambda r, c: (r, c),
+        lambda r, c: (c, size - 1 - r),
+        lambda r, c: (size - 1 - r, size - 1 - c),
+        lambda r, c: (size - 1 - c, r),
+        lambda r, c: (r, size - 1 - c),
+        lambda r, c: (size - 1 - r, c),
+        lambda r, c: (c, r),
+        lambda r, c: (size - 1 - c, size - 1 - r),
+    ]
+    return tuple(
+        tuple(cell(*transform(r, c))
+              for r in range(size) for c in range(size))
+        for transform in transforms)
+
+
+def transform(bits, permutation):
+    """Return a bitboard with its cells moved by permutation."""
+    result = 0
+    cell = 0
+    while bits:
+        if bits & 1:
+            result |= 1 << permutation[cell]
+        bits >>= 1
+        cell += 1
+    return result
+
+
+def canonical(size, mine, theirs):
+    """Return ((mine, theirs), permutation index) of the least symmetric
+    image of a position, so all 8 images share one table entry."""
+    best = None
+    for index, permutation in enumerate(symmetries(size)):
+        image = (transform(mine, permutation),
+                 transform(theirs, permutation))
+        if best is None or image < best[0]:
+            best = (image, index)
+    return best
+
+
+def _popcount(bits):
+    """Return the number of set bits."""
+    return bin(bits).count('1')
+
+
+class Solver(object):
+    """Search positions of one board geometry, remembering results.
+
+    Positions are seen from the side to move: mine holds its pieces and
+    theirs its opponent's."""
+
+    def __init__(self, size, win_length):
+        """Create a solver with an empty transposition table."""
+        self.size = size
+        self.win_length = win_length
+        self.windows, self.windows_by_cell = _windows(size, win_length)
+        self.full = (1 << (size * size)) - 1
+        self.solved = size * size <= MAX_SOLVED_CELLS
+        self.table = {}
+        # cells ordered from the center out, tried first
+        center = (size - 1) / 2
+        self.cells = sorted(
+            range(size * size),
+            key=lambda cell: (abs(cell // size - center) +
+                              abs(cell % size - center)))
+        self.neighbours = [self._neighbours(cell)
+                           for cell in range(size * size)]
+        # heuristic value of a window holding n of one side's pieces
+        # and none of the other's
+        self.weights = [0] + [10 ** n for n in range(1, win_length)]
+
+    def best_move(self, mine, theirs, time_budget=DEFAULT_TIME_BUDGET):
+        """Return the cell the side to move should play."""
+        occupied = mine | theirs
+        if self.solved:
+            self._negamax(mine, theirs, self._empty_cells(occupied),
+                          -WIN - 1, WIN + 1, 0, None)
+            return self._table_move(mine, theirs)
+        if not occupied:
+            return self.cells[0]
+        deadline = time.monotonic() + time_budget
+        best = self._candidates(mine, theirs, None)[0]
+        depth = 1
+        while depth <= self._empty_cells(occupied):
+            try:
+                self._negamax(mine, theirs, depth, -WIN - 1, WIN + 1, 0,
+                              deadline)
+            except _Timeout:
+                break
+            best = self._table_move(mine, theirs)
+            depth += 1
+        return best
+
+    def solve(self):
+        """Search every reachable position of a solved board up front.
+
+        Afterwards every move is a table lookup. Returns the number of
+        distinct positions, up to symmetry."""
+        seen = set()
+        stack = [(0, 0)]
+        while stack:
+            mine, theirs = stack.pop()
+            key = self._key(mine, theirs)[0]
+            if key in seen:
+                continue
+            seen.add(key)
+            occupied = mine | theirs
+            if occupied == self.full:
+                continue
+            self._negamax(mine, theirs, self._empty_cells(occupied),
+                          -WIN - 1, WIN + 1, 0, None)
+            for cell in self._candidates(mine, theirs, None):
+                played = mine | (1 << cell)
+                if not self._wins(played, cell):
+                    stack.append((theirs, played))
+        return len(seen)
+
+    def _empty_cells(self, occupied):
+        """Return the number of cells left to play."""
+        return self.size * self.size - _popcount(occupied)
+
+    def _key(self, mine, theirs):
+        """Return (table key, permutation into the key's orientation)."""
+        if self.solved:
+            key, index = canonical(self.size, mine, theirs)
+            return key, symmetries(self.size)[index]
+        return (mine, theirs), None
+
+    def _table_move(self, mine, theirs):
+        """Return the best move recorded for a position."""
+        key, permutation = self._key(mine, theirs)
+        cell = self.table[key][3]
+        if permutation is not None:
+            cell = permutation.index(cell)
+        return cell
+
+    def _negamax(self, mine, theirs, depth, alpha, beta, ply, deadline):
+        """Return the value of a position for the side to move."""
+        if deadline is not None and time.monotonic() > deadline:
+            raise _Timeout()
+        occupied = mine | theirs
+        if occupied == self.full:
+            return 0
+        if depth == 0:
+            return self._evaluate(mine, theirs)
+
+        key, permutation = self._key(mine, theirs)
+        entry = self.table.get(key)
+        tt_cell = None
+        if entry is not None:
+            entry_depth, value, flag, tt_cell = entry
+            if permutation is not None:
+                tt_cell = permutation.index(tt_cell)
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return value
+                if flag == LOWER and value >= beta:
+                    return value
+                if flag == UPPER and value <= alpha:
+                    return value
+
+        original_alpha = alpha
+        best_value = -WIN - 1
+        best_cell = None
+        for cell in self._candidates(mine, theirs, tt_cell):
+            bit = 1 << cell
+            played = mine | bit
+            if self._wins(played, cell):
+                value = WIN - ply
+            else:
+                value = -self._negamax(theirs, played, depth - 1,
+                                       -beta, -alpha, ply + 1, deadline)
+            if value > best_value:
+                best_value = value
+                best_cell = cell
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= original_alpha:
+            flag = UPPER
+        elif best_value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        if len(self.table) >= MAX_TABLE_ENTRIES:
+            self.table.clear()
+        if permutation is not None:
+            best_cell = permutation[best_cell]
+        self.table[key] = (depth, best_value, flag, best_cell)
+        return best_value
+
+    def _wins(self, bits, cell):
+        """Return whether the piece at cell completes a window."""
+        for mask in self.windows_by_cell[cell]:
+            if bits & mask == mask:
+                return True
+        return False
+
+    def _candidates(self, mine, theirs, first):
+        """Return the cells worth trying, most promising first.
+
+        Solved boards try every empty cell; larger ones only cells next
+        to a piece already played."""
+        occupied = mine | theirs
+        if self.solved:
+            cells = [cell for cell in self.cells
+                     if not occupied & (1 << cell)]
+        else:
+            near = 0
+            for cell in self.cells:
+                if occupied & (1 << cell):
+                    near |= self.neighbours[cell]
+            near &= ~occupied
+            cells = [cell for cell in self.cells if near & (1 << cell)]
+        if first is not None and first in cells:
+            cells.remove(first)
+            cells.insert(0, first)
+        return cells
+
+    def _neighbours(self, cell):
+        """Return the mask of cells adjacent to cell."""
+        r, c = divmod(cell, self.size)
+        mask = 0
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                if (dr or dc) and 0 <= r + dr < self.size and \
+                        0 <= c + dc < self.size:
+                    mask |= 1 << ((r + dr) * self.size + c + dc)
+        return mask
+
+    def _evaluate(self, mine, theirs):
+        """Score a position by the windows each side can still fill."""
+        score = 0
+        for mask in self.windows:
+            if not theirs & mask:
+                score += self.weights[_popcount(mine & mask)]
+            elif not mine & mask:
+                score -= self.weights[_popcount(theirs & mask)]
+        return score
+
+
+@lru_cache(maxsize=None)
+def get_solver(size, win_length):
+    """Return the process-wide solver for a board geometry."""
+    return Solver(size, win_length)
+
+
+def best_move(board, player, time_budget=DEFAULT_TIME_BUDGET):
+    """Return the (row, col) the player should play on a Board."""
+    if player:
+        mine, theirs = board.x, board.o
+    else:
+        mine, theirs = board.o, board.x
+    cell = get_solver(board.size, board.win_length).best_move(
+        mine, theirs, time_budget)
+    return divmod(cell, board.size)
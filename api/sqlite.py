@@ -0,0 +1,31 @@
+"""Tuning sqlite for concurrent traffic.
+
+Every new sqlite connection is given settings.GAME_SQLITE_PRAGMAS. The
+defaults in settings switch to WAL journaling, so readers and the one
+writer never block each other; synchronous=NORMAL, which in WAL mode
+syncs at checkpoints rather than on every commit; a busy timeout, so a
+writer waits its turn for the lock instead of failing at once;
+memory-mapped reads; and a larger page cache. Together with persistent
+connections (CONN_MAX_AGE), that is what the project supports for
+serving many small writes from sqlite.
+
+Writers may still find the database locked past the busy timeout under
+heavy load; is_busy recognizes the error so the move path can retry."""
+from django.conf import settings
+
+
+def tune_connection(sender, connection, **kwargs):
+    """Apply GAME_SQLITE_PRAGMAS to a new sqlite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    for name, value in getattr(settings, 'GAME_SQLITE_PRAGMAS', {}).items():
+        # straight on the driver's connection, so tuning never counts
+        # as one of the request's queries
+        connection.connection.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def is_busy(error):
+    """Return whether a database error means the database was too busy
+    (locked by another writer) to take the query."""
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
@@ -1,15 +1,60 @@
+import asyncio
+import itertools
 import json
+import os
+import tempfile
+import threading
+import time
 import uuid
-from unittest.mock import MagicMock
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+from django.core.cache import caches
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
-from django.test import TestCase
+from django.db import OperationalError, connection
+from django.db.models.query import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
-from .models import Game
+from .archive import archive_games
+from .asgi import ASGIHandler
+from .bench import (
+    ClientTransport, play_game, run_micro, run_moves, run_serialization,
+    summarize, temporary_shards)
+from .board import Board
+from .broker import get_broker
+from .bulk import create_games
+from .cache import GAME_CACHE, LRUMemCache, cache_game
+from .export import export_games
+from .instrumentation import METRICS
+from .models import (
+    ArchivedGame, Game, MatchTicket, Move, PlayerSession, Snapshot)
+from .outcomes import DRAW, LOSS, WIN, OutcomeTable, build
+from .serializers import GameSerializer, game_reader, serialize_game
+from .sharding import game_db, shards
+from .solver import best_move, canonical, symmetries, transform
+from .tournament import run_tournament
+from .views import GameEvents, _Busy
 
 # @assume Game.BOARD_SIZE == 3 for simplicity in defining expected output
 
 
+def _seated_game(x_token, o_token):
+    """Create a game with both seats taken by the given tokens."""
+    game = Game.objects.create(x_token=x_token, o_token=o_token)
+    PlayerSession.open(game, True, x_token)
+    PlayerSession.open(game, False, o_token)
+    return game
+
+
+def _corner_strategy(board, player, rng):
+    """Always play the top left corner, taken or not."""
+    return 0, 0
+
+
 class ModelTestCase(TestCase):
     """Test the model."""
 
@@ -62,6 +107,56 @@ class ModelTestCase(TestCase):
             [False, None, None]
         ]), False)
 
+    def test_model_finds_the_winner_from_the_last_move(self):
+        """Test that checking the last move agrees with a full rescan."""
+        boards = [
+            [[True, None, None], [None, True, None], [None, None, True]],
+            [[False, None, None], [None, False, None], [None, None, False]],
+            [[True, False, True], [None, False, False], [True, None, True]],
+            [[True, True, True], [None, None, None], [None, None, None]],
+            [[None, None, False], [None, None, False], [None, None, False]],
+            [[False, None, None], [False, None, None], [False, None, None]],
+            [[None, None, True], [None, True, None], [True, None, None]],
+        ]
+        for board in boards:
+            game = Game()
+            played = Board(3)
+            for r, row in enumerate(board):
+                for c, val in enumerate(row):
+                    if val is not None:
+                        played.place(r, c, val)
+                        game.winner = game._winner_after_move(played, r, c)
+            self.assertEqual(game.winner, Game()._and_the_winner_is(board))
+
+    def test_model_can_find_k_in_a_row(self):
+        """Test that the model finds win_length in a row on large boards."""
+        game = Game(board_size=15, win_length=5)
+        board = [[None] * 15 for _ in range(15)]
+        for d in range(4):
+            board[5 + d][9 - d] = True
+        self.assertEqual(game._and_the_winner_is(board), None)
+        board[9][5] = True
+        self.assertEqual(game._winner_after_move(
+            Board.from_rows(board, 5), 9, 5), True)
+        self.assertEqual(game._and_the_winner_is(board), True)
+
+    def test_model_stores_the_board_as_bitboards(self):
+        """Test that the board round-trips through the bitboards."""
+        rows = [
+            [True, None, False],
+            [None, True, None],
+            [False, None, None]
+        ]
+        self.game.board = json.dumps(rows)
+        self.game.save()
+
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual(game.x_board, 0b000010001)
+        self.assertEqual(game.o_board, 0b001000100)
+        self.assertEqual(game.board, json.dumps(rows))
+        self.assertFalse(game.get_board().is_free(0, 2))
+        self.assertTrue(game.get_board().is_free(2, 2))
+
 
 class ViewTestCase(TestCase):
     """Test the view."""
@@ -79,12 +174,13 @@ class ViewTestCase(TestCase):
 
     def _join(self, player):
         fake_token = self.fake_token_prefix + player
-        uuid.uuid4 = MagicMock(return_value=fake_token)
-        response = self.client.post(
-            reverse(
-                'join',
-                kwargs={'pk': self.game.id, 'player': player}),
-            format='json')
+        with patch.object(PlayerSession, 'new_tokens',
+                          return_value=[fake_token]) as self.new_tokens:
+            response = self.client.post(
+                reverse(
+                    'join',
+                    kwargs={'pk': self.game.id, 'player': player}),
+                format='json')
         return response
 
     def test_api_can_get_a_game(self):
@@ -102,7 +198,7 @@ class ViewTestCase(TestCase):
             fake_token = self.fake_token_prefix + player
             response = self._join(player)
 
-            uuid.uuid4.assert_called_once()
+            self.new_tokens.assert_called_once_with(1)
             self.assertEquals(response.status_code, status.HTTP_200_OK)
             self.assertContains(response, fake_token)
 
@@ -336,3 +432,2075 @@ class ViewTestCase(TestCase):
 
         self.assertContains(response, expected_endgame_board)
         self.assertContains(response, '"winner":false')
+        self.assertEqual(
+            Game.objects.get(pk=self.game.id).status, Game.O_WON)
+
+    def test_api_tracks_the_game_status(self):
+        """Test that the status follows the game from seating to draw."""
+        def get_status():
+            game = Game.objects.get(pk=self.game.id)
+            return game.status, game.move_count
+
+        self.assertEqual(get_status(), (Game.WAITING, 0))
+        self._join(self.x)
+        self.assertEqual(get_status(), (Game.WAITING, 0))
+        self._join(self.o)
+        self.assertEqual(get_status(), (Game.IN_PROGRESS, 0))
+
+        player = True
+        for row, col in OutcomeTableTestCase.FORCED_DRAW:
+            response = self.client.post(
+                reverse('details', kwargs={'pk': self.game.id}),
+                {'row': row, 'col': col},
+                format='json',
+                HTTP_AUTHORIZATION='Token ' + self.fake_token_prefix + (
+                    self.x if player else self.o))
+            self.assertEquals(response.status_code, status.HTTP_200_OK)
+            player = not player
+
+        # neither side can win, so the game ends before the board fills
+        self.assertEqual(get_status(), (Game.DRAW, 8))
+
+    def test_api_can_create_a_large_game(self):
+        """Test that the API can create a game with k-in-a-row rules."""
+        response = self.client.post(
+            reverse('create'),
+            {'board_size': 15, 'win_length': 5},
+            format='json')
+
+        self.assertEquals(response.status_code, status.HTTP_201_CREATED)
+        game = Game.objects.get(pk=response.data['id'])
+        self.assertEquals(game.board_size, 15)
+        self.assertEquals(game.win_length, 5)
+        self.assertEquals(game.x_board | game.o_board, 0)
+
+        self.game = game
+        self._join(self.x)
+        self._join(self.o)
+        for col in range(5):
+            response = self.client.post(
+                reverse('details', kwargs={'pk': game.id}),
+                {'row': 14, 'col': 10 + col},
+                format='json',
+                HTTP_AUTHORIZATION='Token ' + self.fake_token_prefix + self.x)
+            self.assertEquals(response.status_code, status.HTTP_200_OK)
+            if col < 4:
+                self.client.post(
+                    reverse('details', kwargs={'pk': game.id}),
+                    {'row': 0, 'col': col},
+                    format='json',
+                    HTTP_AUTHORIZATION=(
+                        'Token ' + self.fake_token_prefix + self.o))
+
+        self.assertContains(response, '"winner":true')
+
+    def test_api_rejects_impossible_win_lengths(self):
+        """Test that the API rejects lines longer than the board."""
+        for data in [{'board_size': 2}, {'board_size': 20},
+                     {'board_size': 5, 'win_length': 6},
+                     {'win_length': 2}]:
+            response = self.client.post(
+                reverse('create'), data, format='json')
+
+            self.assertEquals(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SolverTestCase(TestCase):
+    """Test the computer player's search."""
+
+    def _play_out(self, board, player, moves):
+        """Play moves chosen by the given function until the game ends."""
+        while board.winner() is None and not board.is_full():
+            row, col = moves(board, player)
+            self.assertTrue(board.is_free(row, col))
+            board.place(row, col, player)
+            player = not player
+        return board.winner()
+
+    def test_solver_draws_against_itself(self):
+        """Test that perfect play on 3x3 ends in a draw."""
+        self.assertIsNone(self._play_out(Board(3), True, best_move))
+
+    def test_solver_never_loses(self):
+        """Test that the computer never loses against any reply."""
+        def replies(board, player):
+            """Yield each board after each possible reply."""
+            for row in range(3):
+                for col in range(3):
+                    if board.is_free(row, col):
+                        reply = Board(3, 3, board.x, board.o)
+                        reply.place(row, col, player)
+                        yield reply
+
+        def check(board, ai, player):
+            if board.winner() is not None or board.is_full():
+                self.assertNotEqual(board.winner(), not ai)
+                return
+            if player == ai:
+                row, col = best_move(board, ai)
+                board = Board(3, 3, board.x, board.o)
+                board.place(row, col, ai)
+                check(board, ai, not ai)
+            else:
+                for reply in replies(board, player):
+                    check(reply, ai, not player)
+
+        check(Board(3), True, True)
+        check(Board(3), False, True)
+
+    def test_solver_wins_and_blocks(self):
+        """Test that the computer takes a win, or else blocks one."""
+        board = Board.from_rows([
+            [True, True, None],
+            [False, False, None],
+            [None, None, None]
+        ])
+        self.assertEqual(best_move(board, False), (1, 2))
+        self.assertEqual(best_move(board, True), (0, 2))
+
+        board = Board.from_rows([
+            [True, True, None],
+            [None, False, None],
+            [None, None, None]
+        ])
+        self.assertEqual(best_move(board, False), (0, 2))
+
+    def test_solver_canonicalizes_symmetric_positions(self):
+        """Test that all 8 images of a position share one key."""
+        board = Board.from_rows([
+            [True, None, None],
+            [None, None, False],
+            [None, None, None]
+        ])
+        keys = {canonical(3, transform(board.x, p), transform(board.o, p))[0]
+                for p in symmetries(3)}
+        self.assertEqual(len(keys), 1)
+
+    def test_solver_keeps_to_its_time_budget(self):
+        """Test that larger boards are searched within the time budget."""
+        board = Board(15, 5)
+        board.place(7, 7, True)
+        board.place(7, 8, False)
+        board.place(6, 6, True)
+        board.place(8, 8, False)
+        board.place(5, 5, True)
+        # each read of the solver's clock moves it on a millisecond, so
+        # a 0.2 second budget is spent after 200 reads however fast the
+        # search runs
+        reads = itertools.count()
+        with patch('api.solver.time.monotonic',
+                   side_effect=lambda: next(reads) / 1000):
+            row, col = best_move(board, False, time_budget=0.2)
+
+            # one read sets the deadline, and the search stops at the
+            # 201st check, the first past it
+            self.assertEqual(next(reads), 202)
+            self.assertTrue(board.is_free(row, col))
+
+            board.place(4, 4, True)
+            self.assertIn(
+                best_move(board, False, time_budget=0.2), [(3, 3), (8, 8)])
+
+
+class OutcomeTableTestCase(TestCase):
+    """Test the precomputed outcomes of 3x3 positions."""
+
+    # Moves leaving only a draw possible, with X still to play (2, 2)
+    FORCED_DRAW = [
+        (1, 1), (0, 0), (0, 1), (2, 1), (1, 0), (1, 2), (0, 2), (2, 0)]
+
+    def setUp(self):
+        """Set up the tests."""
+        self.table = OutcomeTable(build())
+
+    def test_table_agrees_with_the_solver(self):
+        """Test that the solver's move is among the table's best moves
+        in every reachable position."""
+        seen = set()
+
+        def check(board, player):
+            if (board.x, board.o) in seen:
+                return
+            seen.add((board.x, board.o))
+            value, moves, _ = self.table.lookup(board)
+            if board.winner() is not None:
+                self.assertEqual((value, moves), (LOSS, []))
+                return
+            if board.is_full():
+                self.assertEqual((value, moves), (DRAW, []))
+                return
+            self.assertIn(best_move(board, player), moves)
+            for row in range(3):
+                for col in range(3):
+                    if board.is_free(row, col):
+                        reply = Board(3, 3, board.x, board.o)
+                        reply.place(row, col, player)
+                        check(reply, not player)
+
+        check(Board(3), True)
+        self.assertEqual(len(seen), 5478)
+
+    def test_table_knows_forced_draws(self):
+        """Test that the table tells a lost cause from a dead draw."""
+        board = Board.from_rows([
+            [True, True, None],
+            [False, False, None],
+            [None, None, None]
+        ])
+        self.assertEqual(self.table.lookup(board), (WIN, [(0, 2)], False))
+
+        board = Board(3)
+        player = True
+        for row, col in self.FORCED_DRAW:
+            self.assertFalse(self.table.lookup(board)[2])
+            board.place(row, col, player)
+            player = not player
+        self.assertEqual(self.table.lookup(board), (DRAW, [(2, 2)], True))
+
+    def test_table_rejects_unreachable_positions(self):
+        """Test that positions play cannot reach have no outcome."""
+        board = Board.from_rows([
+            [True, True, None],
+            [None, None, None],
+            [None, None, None]
+        ])
+        with self.assertRaises(ValueError):
+            self.table.lookup(board)
+
+    def test_command_writes_a_mappable_table(self):
+        """Test that the built file maps to the same table."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'outcomes.bin')
+            call_command('build_outcome_table', output=path, stdout=StringIO())
+            table = OutcomeTable.load(path)
+            board = Board(3)
+            board.place(1, 1, True)
+            self.assertEqual(table.lookup(board), self.table.lookup(board))
+            table._buffer.close()
+
+    def test_api_gives_hints(self):
+        """Test that the API suggests the best moves."""
+        game = Game.objects.create()
+        response = APIClient().get(reverse('hint', kwargs={'pk': game.id}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['outcome'], 'draw')
+        self.assertEqual(len(response.data['moves']), 9)
+        self.assertFalse(response.data['forced_draw'])
+
+        game = Game.objects.create(board_size=4)
+        response = APIClient().get(reverse('hint', kwargs={'pk': game.id}))
+        self.assertContains(
+            response, 'only available for 3x3 games',
+            status_code=status.HTTP_400_BAD_REQUEST)
+
+        response = APIClient().get(reverse('hint', kwargs={'pk': 0}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_api_gives_no_hints_for_finished_games(self):
+        """Test that a finished 3x3 game gets no hint, and says why."""
+        game = _seated_game('x-token', 'o-token')
+        client = APIClient()
+        moves = [((0, 0), 'x-token'), ((1, 0), 'o-token'),
+                 ((0, 1), 'x-token'), ((1, 1), 'o-token'),
+                 ((0, 2), 'x-token')]
+        for (row, col), token in moves:
+            client.post(
+                reverse('details', kwargs={'pk': game.id}),
+                {'row': row, 'col': col}, format='json',
+                HTTP_AUTHORIZATION='Token ' + token)
+
+        response = client.get(reverse('hint', kwargs={'pk': game.id}))
+
+        self.assertContains(
+            response, 'Game is over', status_code=status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Game.objects.get(pk=game.id).status, Game.X_WON)
+
+    def test_api_gives_no_hints_for_unreachable_positions(self):
+        """Test that a 3x3 position that cannot arise in play gets no
+        hint, and says why."""
+        game = Game.objects.create(current_player=False)
+
+        response = APIClient().get(reverse('hint', kwargs={'pk': game.id}))
+
+        self.assertContains(
+            response, 'cannot arise in play',
+            status_code=status.HTTP_400_BAD_REQUEST)
+
+    def test_api_ends_forced_draws(self):
+        """Test that no moves are taken once only a draw is possible."""
+        game = _seated_game('x-token', 'o-token')
+        client = APIClient()
+        player = True
+        for row, col in self.FORCED_DRAW:
+            response = client.post(
+                reverse('details', kwargs={'pk': game.id}),
+                {'row': row, 'col': col},
+                format='json',
+                HTTP_AUTHORIZATION='Token ' + (
+                    'x-token' if player else 'o-token'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            player = not player
+
+        response = client.post(
+            reverse('details', kwargs={'pk': game.id}),
+            {'row': 2, 'col': 2},
+            format='json',
+            HTTP_AUTHORIZATION='Token x-token')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertContains(
+            response, 'Game is over', status_code=status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Game.objects.get(pk=game.id).status, Game.DRAW)
+
+
+class GameListTestCase(TestCase):
+    """Test listing games."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+        self.open = Game.objects.create(x_token='x')
+        self.in_progress = Game.objects.create(x_token='x', o_token='o')
+        self.x_won = Game.objects.create(
+            x_token='x', o_token='o', winner=True)
+        self.o_won = Game.objects.create(
+            x_token='x', o_token='o', winner=False)
+
+    def _ids(self, response):
+        return [game['id'] for game in response.data['results']]
+
+    def test_api_paginates_games_by_cursor(self):
+        """Test that the API pages through games by cursor."""
+        response = self.client.get(
+            reverse('create'), {'page_size': 3}, format='json')
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(self._ids(response), [
+            self.open.id, self.in_progress.id, self.x_won.id])
+
+        response = self.client.get(response.data['next'], format='json')
+
+        self.assertEquals(self._ids(response), [self.o_won.id])
+        self.assertIsNone(response.data['next'])
+
+    def test_api_can_order_games(self):
+        """Test that the API can order games by descending id."""
+        response = self.client.get(
+            reverse('create'), {'ordering': '-id'}, format='json')
+
+        self.assertEquals(self._ids(response), [
+            self.o_won.id, self.x_won.id, self.in_progress.id, self.open.id])
+
+    def test_api_can_filter_games(self):
+        """Test that the API can filter games by status and winner."""
+        draw = Game(x_token='x', o_token='o')
+        draw.board = json.dumps([
+            [True, False, True],
+            [True, False, False],
+            [False, True, True]
+        ])
+        draw.save()
+        expected = {
+            (('status', 'open'),): [self.open.id],
+            (('status', 'in_progress'),): [self.in_progress.id],
+            (('status', 'finished'),): [
+                self.x_won.id, self.o_won.id, draw.id],
+            (('status', 'waiting'),): [self.open.id],
+            (('status', 'draw'),): [draw.id],
+            (('winner', 'o'),): [self.o_won.id],
+            (('status', 'finished'), ('winner', 'x')): [self.x_won.id],
+        }
+        for params, ids in expected.items():
+            response = self.client.get(
+                reverse('create'), dict(params), format='json')
+
+            self.assertEquals(self._ids(response), ids)
+
+        for params in [{'status': 'over'}, {'winner': 'z'}]:
+            response = self.client.get(reverse('create'), params)
+
+            self.assertEquals(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_api_can_select_fields(self):
+        """Test that the API can return only the selected fields."""
+        response = self.client.get(
+            reverse('create'), {'fields': 'id,board,winner'}, format='json')
+
+        self.assertEquals(
+            set(response.data['results'][0]), {'id', 'board', 'winner'})
+        self.assertEquals(
+            response.data['results'][0]['board'], self.open.board)
+
+        response = self.client.get(
+            reverse('create'), {'fields': 'id,secret'}, format='json')
+
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PlayerSessionTestCase(TestCase):
+    """Test authorizing players by their sessions."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+        self.game = _seated_game('x', 'o')
+
+    def test_model_stores_only_hashed_tokens(self):
+        """Test that sessions store a hash of the token, not the token."""
+        session = PlayerSession.objects.get(game=self.game, player=True)
+
+        self.assertNotEquals(session.token_hash, 'x')
+        self.assertEquals(session.token_hash, PlayerSession.hash_token('x'))
+
+    def test_api_authorizes_moves_in_one_query(self):
+        """Test that one lookup authorizes the move and loads the game."""
+        # session and game, then the write and its log entry, inside a
+        # savepoint as the test runs in a transaction
+        with self.assertNumQueries(5):
+            response = self.client.post(
+                reverse('details', kwargs={'pk': self.game.id}),
+                {'row': 0, 'col': 0},
+                format='json',
+                HTTP_AUTHORIZATION='Token x')
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+
+    def test_api_cannot_create_seated_games(self):
+        """Test that new games cannot be given tokens; seats are only
+        taken by joining."""
+        response = self.client.post(
+            reverse('create'), {'x_token': 'x1', 'o_token': 'o1'},
+            format='json')
+
+        self.assertEquals(response.status_code, status.HTTP_201_CREATED)
+        game = Game.objects.get(pk=response.data['id'])
+        self.assertEquals(
+            (game.x_token, game.o_token, game.status),
+            (None, None, Game.WAITING))
+
+    def test_resetting_a_game_closes_its_sessions(self):
+        """Test that loading the fixture frees the game's seats and
+        stops its old tokens working."""
+        Game.objects.all().delete()
+        game = Game.objects.create(pk=1, x_token='x1', o_token='o1')
+        PlayerSession.open(game, True, 'x1')
+        PlayerSession.open(game, False, 'o1')
+
+        call_command('loaddata', 'game', verbosity=0)
+
+        self.assertFalse(PlayerSession.objects.filter(game_id=1).exists())
+        response = self.client.post(
+            reverse('details', kwargs={'pk': 1}), {'row': 0, 'col': 0},
+            format='json', HTTP_AUTHORIZATION='Token x1')
+        self.assertNotEquals(response.status_code, status.HTTP_200_OK)
+        with patch.object(PlayerSession, 'new_tokens', return_value=['x2']):
+            response = self.client.post(
+                reverse('join', kwargs={'pk': 1, 'player': 'x'}))
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+
+    def test_api_requires_a_session(self):
+        """Test that a token without a session is not authorized."""
+        game = Game.objects.create(x_token='plain', o_token='text')
+        response = self.client.post(
+            reverse('details', kwargs={'pk': game.id}),
+            {'row': 0, 'col': 0},
+            format='json',
+            HTTP_AUTHORIZATION='Token plain')
+
+        self.assertEquals(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_api_cannot_move_in_another_game(self):
+        """Test that a token only authorizes moves in its own game."""
+        other = _seated_game('x2', 'o2')
+        response = self.client.post(
+            reverse('details', kwargs={'pk': other.id}),
+            {'row': 0, 'col': 0},
+            format='json',
+            HTTP_AUTHORIZATION='Token x')
+
+        self.assertEquals(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_api_can_list_my_games(self):
+        """Test that the API lists the games of the given token."""
+        response = self.client.get(
+            reverse('mine'), format='json', HTTP_AUTHORIZATION='Token o')
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(
+            [(game['id'], game['player']) for game in response.data],
+            [(self.game.id, 'o')])
+
+        response = self.client.get(reverse('mine'), format='json')
+
+        self.assertEquals(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class MatchmakingTestCase(TestCase):
+    """Test pairing players through the matchmaking queue."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+
+    def test_api_pairs_players(self):
+        """Test that the second player in is paired with the first."""
+        waiting = self.client.post(reverse('match'))
+        self.assertEquals(waiting.status_code, status.HTTP_202_ACCEPTED)
+
+        paired = self.client.post(reverse('match'))
+        self.assertEquals(paired.status_code, status.HTTP_201_CREATED)
+        self.assertEquals(paired.data['player'], 'o')
+        game = Game.objects.get(pk=paired.data['id'])
+        self.assertEquals(game.status, Game.IN_PROGRESS)
+        self.assertFalse(MatchTicket.objects.exists())
+
+        response = self.client.get(
+            reverse('mine'),
+            HTTP_AUTHORIZATION='Token ' + waiting.data['token'])
+        self.assertEquals(response.data[0]['id'], game.id)
+        self.assertEquals(response.data[0]['player'], 'x')
+        response = self.client.post(
+            reverse('details', kwargs={'pk': game.id}),
+            {'row': 1, 'col': 1},
+            format='json',
+            HTTP_AUTHORIZATION='Token ' + waiting.data['token'])
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+
+    def test_api_pairs_first_come_first_served(self):
+        """Test that the longest-waiting player is paired first."""
+        first = MatchTicket.objects.create(token='first')
+        MatchTicket.objects.create(token='second')
+        response = self.client.post(reverse('match'))
+
+        game = Game.objects.get(pk=response.data['id'])
+        self.assertEquals(game.x_token, 'first')
+        self.assertFalse(MatchTicket.objects.filter(pk=first.pk).exists())
+        self.assertEquals(MatchTicket.objects.count(), 1)
+
+
+class ComputerPlayerTestCase(TestCase):
+    """Test playing against the computer."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+        self.game = Game.objects.create()
+
+    def _join(self, player, ai=False):
+        with patch.object(PlayerSession, 'new_tokens',
+                          return_value=['token-' + player]):
+            return self.client.post(
+                reverse('join',
+                        kwargs={'pk': self.game.id, 'player': player}),
+                {'ai': True} if ai else {},
+                format='json')
+
+    def test_computer_answers_moves(self):
+        """Test that the computer replies to each move."""
+        self._join('x')
+        response = self._join('o', ai=True)
+
+        self.assertEquals(response.data, {'ai': True})
+
+        response = self.client.post(
+            reverse('details', kwargs={'pk': self.game.id}),
+            {'row': 0, 'col': 0},
+            format='json',
+            HTTP_AUTHORIZATION='Token token-x')
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(response.data['current_player'], True)
+        game = Game.objects.get(pk=self.game.id)
+        self.assertEquals(game.board, json.dumps([
+            [True, None, None],
+            [None, False, None],
+            [None, None, None]
+        ]))
+        self.assertEquals(game.ai_player, False)
+
+    def test_computer_moves_later_on_a_busy_database(self):
+        """Test that a move the computer cannot save yet leaves the
+        human's move committed, and is made before the next one."""
+        self._join('x')
+        self._join('o', ai=True)
+        url = reverse('details', kwargs={'pk': self.game.id})
+
+        with patch('api.views._ai_move', side_effect=_Busy):
+            response = self.client.post(
+                url, {'row': 0, 'col': 0}, format='json',
+                HTTP_AUTHORIZATION='Token token-x')
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(response.data['current_player'], False)
+        self.assertEquals(Game.objects.get(pk=self.game.id).move_count, 1)
+
+        response = self.client.post(
+            url, {'row': 2, 'col': 2}, format='json',
+            HTTP_AUTHORIZATION='Token token-x')
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(Game.objects.get(pk=self.game.id).move_count, 4)
+
+    def test_computer_joins_on_a_busy_database(self):
+        """Test that the computer takes its seat even if its first move
+        cannot be saved yet."""
+        with patch('api.views._ai_move', side_effect=_Busy):
+            response = self._join('x', ai=True)
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(response.data, {'ai': True})
+        self.assertEquals(Game.objects.get(pk=self.game.id).ai_player, True)
+
+    def test_computer_moves_first_as_x(self):
+        """Test that the computer opens the game when it plays X."""
+        self._join('x', ai=True)
+
+        game = Game.objects.get(pk=self.game.id)
+        self.assertEquals(bin(game.x_board).count('1'), 1)
+        self.assertEquals(game.current_player, False)
+        self.assertFalse(
+            PlayerSession.objects.filter(game=self.game).exists())
+
+        response = self._join('o', ai=True)
+
+        self.assertEquals(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class GameCacheTestCase(TransactionTestCase):
+    """Test caching games.
+
+    A TransactionTestCase, because games are written through on commit."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+        self.game = _seated_game('x', 'o')
+        self.url = reverse('details', kwargs={'pk': self.game.id})
+
+    def test_api_reads_games_through_the_cache(self):
+        """Test that the API serves an unchanged game from the cache."""
+        response = self.client.get(self.url, format='json')
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url, format='json')
+
+        self.assertEquals(cached.status_code, status.HTTP_200_OK)
+        self.assertEquals(cached.data, response.data)
+        self.assertEquals(cached['ETag'], '"{}-0"'.format(self.game.id))
+
+    def test_api_writes_games_through_the_cache(self):
+        """Test that moves and joins update the cached game."""
+        game = Game.objects.create()
+        url = reverse('details', kwargs={'pk': game.id})
+        self.client.get(url, format='json')
+        with patch.object(PlayerSession, 'new_tokens',
+                          return_value=['x-token']):
+            self.client.post(
+                reverse('join', kwargs={'pk': game.id, 'player': 'x'}),
+                format='json')
+        self.client.post(
+            url, {'row': 1, 'col': 1}, format='json',
+            HTTP_AUTHORIZATION='Token x-token')
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, format='json')
+
+        self.assertEquals(response['ETag'], '"{}-2"'.format(game.id))
+        self.assertEquals(response.data['x_token'], 'x-token')
+        self.assertEquals(
+            response.data['board'], Game.objects.get(pk=game.id).board)
+
+    def test_moves_patch_the_cached_game(self):
+        """Test that a move patches the cached game to what serializing
+        it afresh gives, and caches a game that was not cached whole."""
+        self.client.get(self.url, format='json')
+        self.client.post(
+            self.url, {'row': 0, 'col': 0}, format='json',
+            HTTP_AUTHORIZATION='Token x')
+
+        with self.assertNumQueries(0):
+            patched = self.client.get(self.url, format='json')
+        game = Game.objects.get(pk=self.game.id)
+        self.assertEquals(patched.data, GameSerializer(game).data)
+
+        caches[GAME_CACHE].clear()
+        self.client.post(
+            self.url, {'row': 1, 'col': 1}, format='json',
+            HTTP_AUTHORIZATION='Token o')
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, format='json')
+        self.assertEquals(response['ETag'], '"{}-2"'.format(game.id))
+        self.assertEquals(
+            response.data, GameSerializer(Game.objects.get(pk=game.id)).data)
+
+    def test_api_answers_not_modified(self):
+        """Test that the API answers 304 for an unchanged game."""
+        etag = self.client.get(self.url, format='json')['ETag']
+
+        response = self.client.get(
+            self.url, format='json', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEquals(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        for if_none_match in ('"0-0", ' + etag, 'W/' + etag, '*'):
+            response = self.client.get(
+                self.url, format='json', HTTP_IF_NONE_MATCH=if_none_match)
+            self.assertEquals(
+                response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.post(
+            self.url, {'row': 0, 'col': 0}, format='json',
+            HTTP_AUTHORIZATION='Token x')
+        response = self.client.get(
+            self.url, format='json', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertNotEquals(response['ETag'], etag)
+
+    def test_api_refuses_etags_from_before_a_reset(self):
+        """Test that a game reset by loading the fixture does not answer
+        304 to an ETag it gave out before."""
+        Game.objects.all().delete()
+        game = Game.objects.create(pk=1, x_token='x', o_token='o')
+        PlayerSession.open(game, True, 'x')
+        url = reverse('details', kwargs={'pk': 1})
+        self.client.post(url, {'row': 0, 'col': 0}, format='json',
+                         HTTP_AUTHORIZATION='Token x')
+        etag = self.client.get(url, format='json')['ETag']
+
+        call_command('loaddata', 'game', verbosity=0)
+        game = Game.objects.get(pk=1)
+        game.x_token, game.o_token = 'x', 'o'
+        game.save()
+        PlayerSession.open(game, True, 'x')
+        self.client.post(url, {'row': 1, 'col': 1}, format='json',
+                         HTTP_AUTHORIZATION='Token x')
+        response = self.client.get(
+            url, format='json', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(json.loads(response.data['board'])[1][1], True)
+
+    def test_readers_cannot_cache_an_overtaken_version(self):
+        """Test that a reader caching the version it read after a move
+        overtook it leaves the cache on the move's version."""
+        read = Game.objects.get(pk=self.game.id)
+        self.client.post(
+            self.url, {'row': 0, 'col': 0}, format='json',
+            HTTP_AUTHORIZATION='Token x')
+
+        cache_game(read)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, format='json')
+        self.assertEquals(response['ETag'], '"{}-1"'.format(self.game.id))
+        self.assertEquals(response.data['move_count'], 1)
+
+    def test_cache_evicts_the_least_recently_used_game(self):
+        """Test that the cache evicts the least recently used key."""
+        cache = LRUMemCache('test-lru', {'OPTIONS': {'MAX_ENTRIES': 2}})
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEquals(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEquals(cache.get('c'), 3)
+
+
+class BatchMovesTestCase(TestCase):
+    """Test making moves in batches."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+        self.game = _seated_game('x1', 'o1')
+        self.other = _seated_game('x2', 'o2')
+
+    def _batch(self, moves, **kwargs):
+        return self.client.post(
+            reverse('moves'), {'moves': moves}, format='json', **kwargs)
+
+    def test_computer_answers_batch_moves(self):
+        """Test that the computer replies to a move made in a batch."""
+        game = Game.objects.create(x_token='x3', o_token='ai', ai_player=False)
+        PlayerSession.open(game, True, 'x3')
+
+        response = self._batch([
+            {'game': game.id, 'row': 0, 'col': 0, 'token': 'x3'}])
+
+        self.assertEquals(
+            response.data['results'][0]['status'], status.HTTP_200_OK)
+        self.assertEquals(
+            response.data['games'][game.id]['current_player'], True)
+        game = Game.objects.get(pk=game.id)
+        self.assertEquals(game.move_count, 2)
+        self.assertEquals(game.current_player, True)
+
+    def test_api_can_make_moves_in_one_game(self):
+        """Test that the API plays a whole game in one request."""
+        response = self._batch([
+            {'game': self.game.id, 'row': 0, 'col': 0, 'token': 'x1'},
+            {'game': self.game.id, 'row': 1, 'col': 0, 'token': 'o1'},
+            {'game': self.game.id, 'row': 0, 'col': 1, 'token': 'x1'},
+            {'game': self.game.id, 'row': 1, 'col': 1, 'token': 'o1'},
+            {'game': self.game.id, 'row': 0, 'col': 2, 'token': 'x1'},
+        ])
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(
+            [result['status'] for result in response.data['results']],
+            [status.HTTP_200_OK] * 5)
+        self.assertEquals(
+            response.data['games'][self.game.id]['winner'], True)
+        game = Game.objects.get(pk=self.game.id)
+        self.assertEquals(game.board, json.dumps([
+            [True, True, True],
+            [False, False, None],
+            [None, None, None]
+        ]))
+        self.assertEquals(game.winner, True)
+        self.assertEquals(game.version, 1)
+        self.assertEquals(
+            list(game.moves.order_by('ply').values_list(
+                'ply', 'row', 'col', 'player')),
+            [(1, 0, 0, True), (2, 1, 0, False), (3, 0, 1, True),
+             (4, 1, 1, False), (5, 0, 2, True)])
+
+    def test_api_can_make_moves_across_games(self):
+        """Test that the API applies moves across games in one write each."""
+        # sessions, savepoint, games, one write per game, the move log,
+        # release
+        with self.assertNumQueries(7):
+            response = self._batch([
+                {'game': self.game.id, 'row': 0, 'col': 0, 'token': 'x1'},
+                {'game': self.other.id, 'row': 2, 'col': 2, 'token': 'x2'},
+            ])
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(Game.objects.get(pk=self.game.id).x_board, 1)
+        self.assertEquals(
+            Game.objects.get(pk=self.other.id).x_board, 1 << 8)
+
+    def test_api_reports_invalid_moves(self):
+        """Test that the API skips and reports each invalid move."""
+        response = self._batch([
+            {'game': self.game.id, 'row': 0, 'col': 0},
+            {'game': self.game.id, 'row': 0, 'col': 0, 'token': 'o1'},
+            {'game': self.game.id, 'row': 1, 'col': 1},
+            {'game': self.game.id, 'row': 3, 'col': 0, 'token': 'o1'},
+            {'game': self.game.id, 'row': 2, 'col': 2, 'token': 'nope'},
+            {'game': 0, 'row': 0, 'col': 0},
+            {'game': self.game.id, 'row': 2, 'col': 2, 'token': 'o1'},
+        ], HTTP_AUTHORIZATION='Token x1')
+
+        self.assertEquals(
+            [result['status'] for result in response.data['results']], [
+                status.HTTP_200_OK,
+                status.HTTP_400_BAD_REQUEST,
+                status.HTTP_400_BAD_REQUEST,
+                status.HTTP_400_BAD_REQUEST,
+                status.HTTP_403_FORBIDDEN,
+                status.HTTP_404_NOT_FOUND,
+                status.HTTP_200_OK,
+            ])
+        game = Game.objects.get(pk=self.game.id)
+        self.assertEquals(game.x_board, 1)
+        self.assertEquals(game.o_board, 1 << 8)
+
+    def test_api_requires_a_list_of_moves(self):
+        """Test that the API requires a non-empty list of moves."""
+        for moves in [[], 'moves', [1]]:
+            response = self._batch(moves)
+
+            self.assertEquals(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MoveLogTestCase(TestCase):
+    """Test the move log and replaying games from it."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+        self.game = _seated_game('x-token', 'o-token')
+        self.game.board_size = self.game.win_length = 7
+        self.game.save()
+        # 20 moves without a win: X fills rows 0 and 2 up to 6 pieces
+        # long, O the rows below
+        self.moves = []
+        for i in range(20):
+            turn = i // 2
+            row = (i % 2) + (0 if turn < 6 else 2)
+            self.moves.append((row, turn % 6, i % 2 == 0))
+
+    def _play(self, moves):
+        for row, col, player in moves:
+            response = self.client.post(
+                reverse('details', kwargs={'pk': self.game.id}),
+                {'row': row, 'col': col},
+                format='json',
+                HTTP_AUTHORIZATION='Token ' + (
+                    'x-token' if player else 'o-token'))
+            self.assertEquals(response.status_code, status.HTTP_200_OK)
+
+    def test_api_logs_each_move(self):
+        """Test that each move is appended to the log."""
+        self._play(self.moves[:3])
+        response = self.client.get(
+            reverse('history', kwargs={'pk': self.game.id}))
+
+        self.assertEquals(
+            [(move['ply'], move['row'], move['col'], move['player'])
+             for move in response.data],
+            [(ply, row, col, player) for ply, (row, col, player)
+             in enumerate(self.moves[:3], 1)])
+
+    def test_model_rebuilds_the_board_at_any_ply(self):
+        """Test that boards are rebuilt from a bounded replay."""
+        self._play(self.moves)
+        game = Game.objects.get(pk=self.game.id)
+
+        self.assertEquals(
+            list(game.snapshots.values_list('ply', flat=True)),
+            [Snapshot.INTERVAL])
+        board = Board(7)
+        for ply, (row, col, player) in enumerate(self.moves, 1):
+            board.place(row, col, player)
+            self.assertEquals(
+                (game.board_at(ply).x, game.board_at(ply).o),
+                (board.x, board.o))
+        # the snapshot, then the 4 moves after it
+        with self.assertNumQueries(2):
+            game.board_at(20)
+
+    def test_api_replays_a_game(self):
+        """Test that the API serves the board after a given ply."""
+        self._play(self.moves[:2])
+        response = self.client.get(
+            reverse('replay', kwargs={'pk': self.game.id, 'ply': 1}))
+
+        board = Board(7)
+        board.place(*self.moves[0])
+        self.assertEquals(response.data, {'ply': 1, 'board': board.to_json()})
+
+        response = self.client.get(
+            reverse('replay', kwargs={'pk': self.game.id, 'ply': 3}))
+        self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_resetting_a_game_clears_its_log(self):
+        """Test that a game reset by loading the fixture is logged and
+        replayed afresh."""
+        Game.objects.all().delete()
+        self.game = Game.objects.create(
+            pk=1, x_token='x-token', o_token='o-token')
+        PlayerSession.open(self.game, True, 'x-token')
+        PlayerSession.open(self.game, False, 'o-token')
+        self._play(self.moves[:2])
+
+        call_command('loaddata', 'game', verbosity=0)
+        game = Game.objects.get(pk=1)
+        game.x_token, game.o_token = 'x-token', 'o-token'
+        game.save()
+        PlayerSession.open(game, True, 'x-token')
+        PlayerSession.open(game, False, 'o-token')
+        self._play([(2, 2, True)])
+
+        response = self.client.get(reverse('history', kwargs={'pk': 1}))
+        self.assertEquals(
+            [(move['ply'], move['row'], move['col'], move['player'])
+             for move in response.data],
+            [(1, 2, 2, True)])
+        self.assertEquals(game.board_at(1).to_rows()[2], [None, None, True])
+
+    def test_api_cannot_replay_a_missing_game(self):
+        """Test that the API cannot replay a game that does not exist."""
+        for url in (reverse('history', kwargs={'pk': 0}),
+                    reverse('replay', kwargs={'pk': 0, 'ply': 1})):
+            response = self.client.get(url)
+
+            self.assertEquals(
+                response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_model_replays_from_a_starting_board(self):
+        """Test that a game created with a board replays from it."""
+        game = Game(board=json.dumps([
+            [True, None, None],
+            [None, False, None],
+            [None, None, None]
+        ]))
+        game.save()
+
+        self.assertEquals(game.board_at(2).x, game.x_board)
+        self.assertEquals(Move.objects.filter(game=game).count(), 0)
+        with self.assertRaises(ValueError):
+            game.board_at(1)
+
+
+class ArchiveTestCase(TestCase):
+    """Test archiving finished games."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+        self.won = _seated_game('x1', 'o1')
+        self.client.post(
+            reverse('moves'), {'moves': [
+                {'game': self.won.id, 'row': row, 'col': col, 'token': token}
+                for row, col, token in [(0, 0, 'x1'), (1, 0, 'o1'),
+                                        (0, 1, 'x1'), (1, 1, 'o1'),
+                                        (0, 2, 'x1')]]},
+            format='json')
+        self.won_recently = Game.objects.create(winner=False)
+        self.in_progress = Game.objects.create(x_token='x', o_token='o')
+        long_ago = timezone.now() - timedelta(days=60)
+        Game.objects.exclude(pk=self.won_recently.pk).update(
+            modified=long_ago)
+
+    def test_command_archives_old_finished_games(self):
+        """Test that only long-finished games are moved, chunk by chunk."""
+        old_wins = [Game.objects.create(winner=True) for _ in range(2)]
+        Game.objects.filter(pk__in=[game.pk for game in old_wins]).update(
+            modified=timezone.now() - timedelta(days=60))
+        out = StringIO()
+        call_command('archive_games', days=30, chunk_size=2, stdout=out)
+
+        self.assertEquals(out.getvalue(), 'Archived 3 games\n')
+        self.assertEquals(
+            set(Game.objects.values_list('id', flat=True)),
+            {self.won_recently.id, self.in_progress.id})
+        self.assertEquals(ArchivedGame.objects.count(), 3)
+        self.assertFalse(PlayerSession.objects.filter(game_id=self.won.id))
+        record = ArchivedGame.objects.get(pk=self.won.id).load()
+        self.assertEquals(
+            record['moves'][-1], [5, 0, 2, True])
+
+    def test_api_reads_archived_games(self):
+        """Test that archived games are still served at their URL."""
+        url = reverse('details', kwargs={'pk': self.won.id})
+        before = self.client.get(url, format='json')
+        archive_games(timedelta(days=30))
+
+        after = self.client.get(url, format='json')
+        self.assertFalse(Game.objects.filter(pk=self.won.id))
+        self.assertEquals(after.status_code, status.HTTP_200_OK)
+        self.assertEquals(after.data, before.data)
+        self.assertEquals(after['ETag'], before['ETag'])
+
+        response = self.client.get(
+            reverse('details', kwargs={'pk': self.won.id + 1000}))
+        self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ExportTestCase(TestCase):
+    """Test exporting games."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+        self.games = [
+            Game.objects.create(x_token='x', winner=bool(i % 2))
+            for i in range(5)]
+        self.games[0].board = json.dumps([
+            [True, None, None],
+            [None, False, None],
+            [None, None, None]
+        ])
+        self.games[0].save()
+
+    def _export(self, params=None):
+        response = self.client.get(reverse('export'), params or {})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in
+                b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_api_streams_every_game(self):
+        """Test that the API streams every game as a line of JSON."""
+        games = self._export()
+
+        self.assertEquals(
+            [game['id'] for game in games], [g.id for g in self.games])
+        self.assertEquals(games[0]['board'], self.games[0].board)
+        self.assertEquals(games[1]['winner'], True)
+        self.assertNotIn('x_token', games[0])
+
+    def test_api_resumes_after_an_id(self):
+        """Test that the API resumes the export after a given id."""
+        games = self._export({'after_id': self.games[2].id})
+
+        self.assertEquals(
+            [game['id'] for game in games], [g.id for g in self.games[3:]])
+
+    def test_api_exports_games_modified_since(self):
+        """Test that the API exports only games modified since a time."""
+        since = self.games[0].modified
+        Game.objects.filter(pk=self.games[1].pk).update(
+            modified=since - timedelta(days=1))
+        games = self._export({'since': since.isoformat()})
+
+        self.assertNotIn(self.games[1].id, [game['id'] for game in games])
+        self.assertIn(self.games[0].id, [game['id'] for game in games])
+
+        response = self.client.get(reverse('export'), {'since': 'yesterday'})
+
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_reads_in_chunks(self):
+        """Test that the export pages through the table in chunks."""
+        with self.assertNumQueries(3):
+            games = list(export_games(chunk_size=2))
+
+        self.assertEquals(len(games), len(self.games))
+
+    def test_command_exports_games(self):
+        """Test that the management command exports games."""
+        out = StringIO()
+        call_command(
+            'export_games', after_id=self.games[3].id, stdout=out)
+
+        games = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEquals([game['id'] for game in games], [self.games[4].id])
+
+
+class RecordingBroker(object):
+    """Stand-in broker that records what it is asked to publish."""
+
+    def __init__(self):
+        """Create a broker with nothing published."""
+        self.published = []
+
+    def subscribe(self, pk):
+        """Subscribe to nothing."""
+        return None
+
+    def unsubscribe(self, pk, subscription):
+        """Unsubscribe from nothing."""
+
+    def publish(self, pk, event):
+        """Record the event."""
+        self.published.append((pk, event))
+
+
+class GameEventsTestCase(TransactionTestCase):
+    """Test pushing game updates.
+
+    A TransactionTestCase, because updates are published on commit."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+        self.game = _seated_game('x', 'o')
+
+    def _move(self, row, col, token):
+        return self.client.post(
+            reverse('details', kwargs={'pk': self.game.id}),
+            {'row': row, 'col': col},
+            format='json',
+            HTTP_AUTHORIZATION='Token ' + token)
+
+    def _event(self, chunk):
+        lines = chunk.decode().splitlines()
+        self.assertEquals(lines[1], 'event: game')
+        return json.loads(lines[2][len('data: '):])
+
+    @override_settings(GAME_BROKER='api.tests.RecordingBroker')
+    def test_moves_are_published(self):
+        """Test that committed moves are published to the broker."""
+        self._move(0, 0, 'x')
+        self._move(0, 0, 'o')
+        self.client.post(
+            reverse('moves'),
+            {'moves': [{'game': self.game.id, 'row': 1, 'col': 1,
+                        'token': 'o'}]},
+            format='json')
+
+        published = get_broker().published
+        self.assertEquals([pk for pk, _ in published], [self.game.id] * 2)
+        self.assertEquals(
+            [event['version'] for _, event in published], [1, 2])
+        self.assertEquals(published[1][1]['board'], json.dumps([
+            [True, None, None],
+            [None, False, None],
+            [None, None, None]
+        ]))
+
+    def test_api_streams_moves_until_won(self):
+        """Test that the API streams each move until the game is won."""
+        response = self.client.get(
+            reverse('events', kwargs={'pk': self.game.id}))
+        self.assertEquals(response['Content-Type'], 'text/event-stream')
+        stream = iter(response.streaming_content)
+
+        self.assertEquals(self._event(next(stream))['version'], 0)
+
+        moves = [(0, 0, 'x'), (1, 0, 'o'), (0, 1, 'x'), (1, 1, 'o'),
+                 (0, 2, 'x')]
+        for version, move in enumerate(moves, 1):
+            self._move(*move)
+            event = self._event(next(stream))
+
+            self.assertEquals(event['version'], version)
+            self.assertEquals(event['current_player'], version % 2 == 0)
+
+        self.assertEquals(event['winner'], True)
+        self.assertEquals(list(stream), [])
+
+    def test_api_cannot_stream_a_missing_game(self):
+        """Test that the API cannot stream a game that does not exist."""
+        response = self.client.get(reverse('events', kwargs={'pk': 0}))
+
+        self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ASGITestCase(TransactionTestCase):
+    """Test serving the API over ASGI.
+
+    A TransactionTestCase, because requests are answered in the pool's
+    threads, on their own database connections."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+        self.app = ASGIHandler(WSGIHandler(), threads=2, streams=2)
+        self.game = Game.objects.create()
+        self.url = reverse('details', kwargs={'pk': self.game.id})
+
+    def tearDown(self):
+        """Let the pools' threads go."""
+        self.app.executor.shutdown()
+        self.app.stream_executor.shutdown()
+
+    def _scope(self, method, path, token=None):
+        headers = [(b'host', b'testserver'),
+                   (b'content-type', b'application/json'),
+                   (b'accept', b'application/json')]
+        if token is not None:
+            headers.append((b'authorization', b'Token ' + token.encode()))
+        return {'type': 'http', 'method': method, 'path': path,
+                'query_string': b'', 'headers': headers}
+
+    async def _call(self, scope, body=b''):
+        """Return the status, headers and body chunks of a response."""
+        requests = [{'type': 'http.request', 'body': body}]
+        sent = []
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            # the client stays connected
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        await self.app(scope, receive, send)
+        self.assertEqual(sent[0]['type'], 'http.response.start')
+        self.assertFalse(sent[-1].get('more_body', False))
+        return (sent[0]['status'], dict(sent[0]['headers']),
+                [message['body'] for message in sent[1:] if message['body']])
+
+    def _request(self, method, path, data=None, token=None):
+        """Answer one request over ASGI; return the status, the headers
+        and the body."""
+        body = json.dumps(data).encode() if data is not None else b''
+        loop = asyncio.new_event_loop()
+        try:
+            status_code, headers, chunks = loop.run_until_complete(
+                self._call(self._scope(method, path, token), body))
+        finally:
+            loop.close()
+        return status_code, headers, b''.join(chunks)
+
+    def test_api_can_join_and_move(self):
+        """Test that the API joins and moves over ASGI as over WSGI."""
+        with patch.object(PlayerSession, 'new_tokens',
+                          side_effect=[['asgi-x'], ['asgi-o']]):
+            for player in ('x', 'o'):
+                status_code, _, body = self._request('POST', reverse(
+                    'join', kwargs={'pk': self.game.id, 'player': player}))
+
+                self.assertEqual(status_code, status.HTTP_200_OK)
+                self.assertEqual(
+                    json.loads(body.decode())['token'], 'asgi-' + player)
+
+        status_code, headers, body = self._request(
+            'POST', self.url, {'row': 0, 'col': 0}, token='asgi-x')
+
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(headers[b'content-type'], b'application/json')
+        self.assertEqual(json.loads(body.decode())['board'], json.dumps([
+            [True, None, None],
+            [None, None, None],
+            [None, None, None]
+        ]))
+        response = self.client.get(self.url, format='json')
+        self.assertEqual(self._request('GET', self.url)[2], response.content)
+
+    def test_api_keeps_permissions_and_validation(self):
+        """Test that moves over ASGI are refused as over WSGI."""
+        _seated_game('x', 'o')
+        game = _seated_game('x2', 'o2')
+        url = reverse('details', kwargs={'pk': game.id})
+        self.client.post(url, {'row': 0, 'col': 0}, format='json',
+                         HTTP_AUTHORIZATION='Token x2')
+        refusals = [
+            ({'row': 1, 'col': 1}, None),
+            ({'row': 1, 'col': 1}, 'x2'),
+            ({'row': 0, 'col': 0}, 'o2'),
+            ({'row': 3, 'col': 0}, 'o2'),
+        ]
+
+        for data, token in refusals:
+            status_code, _, body = self._request('POST', url, data, token)
+            kwargs = {'HTTP_AUTHORIZATION': 'Token ' + token} if token else {}
+            response = self.client.post(url, data, format='json', **kwargs)
+
+            self.assertIn(status_code, (status.HTTP_400_BAD_REQUEST,
+                                        status.HTTP_401_UNAUTHORIZED,
+                                        status.HTTP_403_FORBIDDEN))
+            self.assertEqual(status_code, response.status_code)
+            self.assertEqual(body, response.content)
+        self.assertEqual(Game.objects.get(pk=game.id).move_count, 1)
+
+    def test_api_streams_responses(self):
+        """Test that a streamed response is sent a chunk at a time."""
+        _seated_game('x', 'o')
+        loop = asyncio.new_event_loop()
+        try:
+            status_code, headers, chunks = loop.run_until_complete(
+                self._call(self._scope('GET', reverse('export'))))
+        finally:
+            loop.close()
+
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(len(chunks), Game.objects.count())
+        self.assertEqual(
+            [json.loads(chunk.decode())['id'] for chunk in chunks],
+            list(Game.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_requests_wait_for_a_thread(self):
+        """Test that no more requests are answered at once than the pool
+        has threads."""
+        answering = []
+        most = []
+        lock = threading.Lock()
+        wsgi_application = self.app.wsgi_application
+
+        def counted(environ, start_response):
+            with lock:
+                answering.append(threading.get_ident())
+                most.append(len(answering))
+            time.sleep(0.02)
+            try:
+                return wsgi_application(environ, start_response)
+            finally:
+                with lock:
+                    answering.remove(threading.get_ident())
+
+        self.app.wsgi_application = counted
+        loop = asyncio.new_event_loop()
+        try:
+            responses = loop.run_until_complete(asyncio.gather(*[
+                self._call(self._scope('GET', self.url))
+                for _ in range(8)], loop=loop))
+        finally:
+            loop.close()
+
+        self.assertEqual(
+            [status_code for status_code, _, _ in responses],
+            [status.HTTP_200_OK] * 8)
+        self.assertEqual(max(most), 2)
+
+    def test_streams_leave_the_request_threads_free(self):
+        """Test that open event streams do not hold up other requests."""
+        started = []
+
+        async def subscribe(leave):
+            requests = [{'type': 'http.request', 'body': b''}]
+
+            async def receive():
+                if requests:
+                    return requests.pop()
+                await leave.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                started.append(message)
+
+            await self.app(self._scope(
+                'GET', reverse('events', kwargs={'pk': self.game.id})),
+                receive, send)
+
+        async def run(loop):
+            leave = asyncio.Event(loop=loop)
+            streams = [asyncio.ensure_future(subscribe(leave), loop=loop)
+                       for _ in range(self.app.threads)]
+            while len([message for message in started
+                       if message['type'] == 'http.response.start']) < 2:
+                await asyncio.sleep(0.01, loop=loop)
+            try:
+                return await asyncio.wait_for(
+                    self._call(self._scope('GET', self.url)), 5, loop=loop)
+            finally:
+                leave.set()
+                await asyncio.gather(*streams, loop=loop)
+
+        loop = asyncio.new_event_loop()
+        try:
+            with patch.object(GameEvents, 'KEEPALIVE', 0.05):
+                status_code, _, _ = loop.run_until_complete(run(loop))
+        finally:
+            loop.close()
+
+        self.assertEqual(status_code, status.HTTP_200_OK)
+
+    def test_lifespan(self):
+        """Test that the application answers the lifespan protocol."""
+        messages = [{'type': 'lifespan.shutdown'},
+                    {'type': 'lifespan.startup'}]
+        sent = []
+
+        async def receive():
+            return messages.pop()
+
+        async def send(message):
+            sent.append(message['type'])
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(
+                self.app({'type': 'lifespan'}, receive, send))
+        finally:
+            loop.close()
+
+        self.assertEqual(sent, ['lifespan.startup.complete',
+                                'lifespan.shutdown.complete'])
+
+
+class InstrumentationTestCase(TestCase):
+    """Test the opt-in request instrumentation."""
+
+    def setUp(self):
+        """Set up the tests."""
+        for metric in METRICS:
+            metric.clear()
+        self.game = _seated_game('x-token', 'o-token')
+
+    def _move(self):
+        return APIClient().post(
+            reverse('details', kwargs={'pk': self.game.id}),
+            {'row': 1, 'col': 1},
+            format='json',
+            HTTP_AUTHORIZATION='Token x-token')
+
+    @override_settings(GAME_INSTRUMENTATION=True)
+    def test_moves_report_their_phases(self):
+        """Test that a move's phases and queries are reported."""
+        response = self._move()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timings = dict(
+            entry.split(';', 1) for entry in
+            response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {
+            'auth', 'lookup', 'decode', 'validate', 'winner', 'save', 'ai',
+            'db', 'total'})
+        self.assertIn('desc="5 queries"', timings['db'])
+
+        metrics = APIClient().get(reverse('metrics'))
+        self.assertEqual(metrics['Content-Type'], 'text/plain; version=0.0.4')
+        text = metrics.content.decode()
+        self.assertIn(
+            'tictactoe_phase_duration_seconds_count'
+            '{endpoint="details",phase="winner"} 1', text)
+        self.assertIn(
+            'tictactoe_db_queries_bucket{endpoint="details",le="5"} 1', text)
+        self.assertIn(
+            'tictactoe_request_duration_seconds_count'
+            '{endpoint="details",method="POST",status="200"} 1', text)
+
+    def test_instrumentation_is_off_by_default(self):
+        """Test that nothing is measured or served unless enabled."""
+        response = self._move()
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(
+            APIClient().get(reverse('metrics')).status_code,
+            status.HTTP_404_NOT_FOUND)
+
+
+class ShardingTestCase(TransactionTestCase):
+    """Test spreading games over several databases.
+
+    Games are spread over the default database and two temporary ones;
+    a TransactionTestCase, so every database is flushed between tests."""
+
+    multi_db = True
+
+    @classmethod
+    def setUpClass(cls):
+        """Create the extra databases."""
+        cls.shards = temporary_shards(2)
+        cls.shards.__enter__()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Drop the extra databases."""
+        super().tearDownClass()
+        cls.shards.__exit__(None, None, None)
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+        self.ids = [
+            self.client.post(reverse('create'), {}, format='json').data['id']
+            for _ in range(6)]
+
+    def _join(self, pk):
+        """Seat both players in a game; return their tokens."""
+        tokens = []
+        for player in ('x', 'o'):
+            with patch.object(PlayerSession, 'new_tokens',
+                              return_value=['{}-{}'.format(player, pk)]):
+                tokens.append(self.client.post(
+                    reverse('join', kwargs={'pk': pk, 'player': player}),
+                    format='json').data['token'])
+        return tokens
+
+    def test_games_are_created_in_bulk_in_their_shards(self):
+        """Test that games created in bulk, and their sessions, go to
+        their shards."""
+        created = list(create_games(6, seated=True, batch_size=4))
+
+        self.assertEqual(len({pk for pk, _, _ in created}), 6)
+        for pk, x_token, o_token in created:
+            alias = game_db(pk)
+            self.assertEqual(
+                Game.objects.using(alias).get(pk=pk).x_token, x_token)
+            self.assertEqual(
+                PlayerSession.objects.using(alias).filter(
+                    game_id=pk).count(), 2)
+
+    def test_games_are_spread_over_shards(self):
+        """Test that games get unique ids placing two in each shard."""
+        self.assertEqual(len(set(self.ids)), 6)
+        for alias in shards():
+            stored = Game.objects.using(alias).values_list('id', flat=True)
+            self.assertEqual(len(stored), 2)
+            self.assertTrue(all(game_db(pk) == alias for pk in stored))
+
+    def test_games_are_played_in_their_shard(self):
+        """Test that a game's moves and sessions are kept with it."""
+        pk = self.ids[1]
+        x_token, o_token = self._join(pk)
+        url = reverse('details', kwargs={'pk': pk})
+        response = self.client.post(
+            url, {'row': 0, 'col': 0}, format='json',
+            HTTP_AUTHORIZATION='Token ' + x_token)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        alias = game_db(pk)
+        self.assertEqual(Move.objects.using(alias).get().game_id, pk)
+        self.assertEqual(
+            PlayerSession.objects.using(alias).filter(game_id=pk).count(), 2)
+        self.assertEqual(
+            self.client.get(url, format='json').data['move_count'], 1)
+        history = self.client.get(
+            reverse('history', kwargs={'pk': pk}), format='json')
+        self.assertEqual(len(history.data), 1)
+        mine = self.client.get(
+            reverse('mine'), HTTP_AUTHORIZATION='Token ' + o_token)
+        self.assertEqual(mine.data[0]['id'], pk)
+
+    def test_listing_merges_every_shard(self):
+        """Test that pages of games are merged across shards in order."""
+        first = self.client.get(
+            reverse('create'), {'page_size': 4, 'ordering': '-id'},
+            format='json')
+        second = self.client.get(first.data['next'], format='json')
+
+        self.assertEqual(
+            [game['id'] for game in first.data['results'] +
+             second.data['results']],
+            sorted(self.ids, reverse=True))
+
+    def test_batch_moves_span_shards(self):
+        """Test that one batch moves in games stored in different shards."""
+        moves = []
+        for pk in self.ids[:3]:
+            x_token, _ = self._join(pk)
+            moves.append({'game': pk, 'row': 1, 'col': 1, 'token': x_token})
+        response = self.client.post(
+            reverse('moves'), {'moves': moves}, format='json')
+
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            [status.HTTP_200_OK] * 3)
+        for pk in self.ids[:3]:
+            self.assertEqual(
+                Move.objects.using(game_db(pk)).filter(game_id=pk).count(), 1)
+
+    def test_export_and_archive_cover_every_shard(self):
+        """Test that exports merge shards by id and archiving empties
+        each shard into the default database."""
+        lines = b''.join(self.client.get(
+            reverse('export'), format='json').streaming_content).splitlines()
+        self.assertEqual(
+            [json.loads(line.decode('utf-8'))['id'] for line in lines],
+            sorted(self.ids))
+
+        won = [Game.objects.create(winner=True) for _ in range(3)]
+        for alias in shards():
+            Game.objects.using(alias).filter(winner=True).update(
+                modified=timezone.now() - timedelta(days=60))
+
+        self.assertEqual(archive_games(timedelta(days=30)), 3)
+        self.assertEqual(
+            set(ArchivedGame.objects.values_list('id', flat=True)),
+            {game.pk for game in won})
+        response = self.client.get(
+            reverse('details', kwargs={'pk': won[0].pk}), format='json')
+        self.assertEqual(response.data['status'], Game.X_WON)
+
+
+class SQLiteTestCase(TestCase):
+    """Test the sqlite tuning and retrying moves on a busy database."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+        self.game = _seated_game('x', 'o')
+        self.url = reverse('details', kwargs={'pk': self.game.id})
+
+    def _locked_saves(self, failures):
+        """Return a save_if_current failing the first failures calls as
+        if the database were locked."""
+        save_if_current = Game.save_if_current
+        calls = []
+
+        def locked(game, update_fields):
+            calls.append(update_fields)
+            if len(calls) <= failures:
+                raise OperationalError('database is locked')
+            return save_if_current(game, update_fields)
+        return locked
+
+    def test_connections_are_tuned(self):
+        """Test that connections get the pragmas from settings."""
+        with connection.cursor() as cursor:
+            pragmas = {}
+            for name in ('journal_mode', 'synchronous', 'busy_timeout'):
+                cursor.execute('PRAGMA {}'.format(name))
+                pragmas[name] = cursor.fetchone()[0]
+
+        self.assertEqual(
+            pragmas,
+            {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000})
+
+    @patch('api.views.BUSY_BACKOFF', 0)
+    def test_busy_moves_are_retried(self):
+        """Test that a move waits out a locked database."""
+        with patch.object(Game, 'save_if_current', self._locked_saves(2)):
+            response = self.client.post(
+                self.url, {'row': 0, 'col': 0}, format='json',
+                HTTP_AUTHORIZATION='Token x')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        game = Game.objects.get(pk=self.game.id)
+        self.assertEqual((game.version, game.move_count), (1, 1))
+        self.assertEqual(game.moves.count(), 1)
+
+    @patch('api.views.BUSY_BACKOFF', 0)
+    def test_moves_give_up_on_a_busy_database(self):
+        """Test that a database that stays locked answers 503."""
+        with patch.object(Game, 'save_if_current', self._locked_saves(100)):
+            response = self.client.post(
+                self.url, {'row': 0, 'col': 0}, format='json',
+                HTTP_AUTHORIZATION='Token x')
+            batch = self.client.post(
+                reverse('moves'), {'moves': [
+                    {'game': self.game.id, 'row': 0, 'col': 0,
+                     'token': 'x'}]}, format='json')
+
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(
+            batch.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(Game.objects.get(pk=self.game.id).move_count, 0)
+
+
+class TournamentTestCase(TestCase):
+    """Test offline tournaments."""
+
+    def test_strategies_play_by_the_rules(self):
+        """Test that games are won and drawn as through the API."""
+        result = run_tournament(['first', 'solver'], 3, processes=1)
+
+        pairings = {(p['x'], p['o']): p for p in result['pairings']}
+        self.assertEqual(pairings['first', 'first']['x_wins'], 3)
+        self.assertEqual(pairings['solver', 'solver']['draws'], 3)
+        self.assertEqual(pairings['first', 'solver']['o_wins'], 3)
+        self.assertEqual(
+            result['standings']['solver'],
+            {'wins': 6, 'draws': 6, 'losses': 0})
+        self.assertEqual(result['games'], 12)
+
+    def test_moves_not_allowed_forfeit(self):
+        """Test that a strategy playing a taken cell loses the game."""
+        result = run_tournament(
+            ['first', 'api.tests._corner_strategy'], 2, processes=1)
+
+        pairings = {(p['x'], p['o']): p for p in result['pairings']}
+        self.assertEqual(
+            pairings['first', 'api.tests._corner_strategy']['o_forfeits'],
+            2)
+        self.assertEqual(
+            result['standings']['api.tests._corner_strategy']['losses'], 6)
+        with self.assertRaises(ValueError):
+            run_tournament(['first', 'api.tests.nothing'], 1, processes=1)
+
+    def test_worker_processes_play_the_same_games(self):
+        """Test that a seeded tournament gives the same results in a
+        pool of workers as in this process."""
+        alone = run_tournament(['random'], 50, seed=7, processes=1)
+        pooled = run_tournament(['random'], 50, seed=7, processes=2)
+
+        self.assertEqual(pooled['pairings'], alone['pairings'])
+
+    def test_finished_games_are_saved(self):
+        """Test that saved games keep their final position and status."""
+        result = run_tournament(['first'], 2, processes=1, save=True)
+
+        self.assertEqual(result['saved'], 2)
+        game = Game.objects.first()
+        self.assertEqual(Game.objects.filter(status=Game.X_WON).count(), 2)
+        self.assertEqual(game.get_board().winner(), True)
+        self.assertEqual(game.move_count, 7)
+
+
+class SerializationTestCase(TestCase):
+    """Test serializing games without GameSerializer."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+        self.games = [
+            Game.objects.create(),
+            Game.objects.create(board_size=5, win_length=4, x_token='x'),
+            Game.objects.create(ai_player=False, x_token='x', o_token='o'),
+        ]
+        won = _seated_game('x2', 'o2')
+        for ply, (row, col) in enumerate(
+                [(0, 0), (1, 0), (0, 1), (1, 1), (0, 2)]):
+            self.client.post(
+                reverse('details', kwargs={'pk': won.id}),
+                {'row': row, 'col': col}, format='json',
+                HTTP_AUTHORIZATION='Token ' + ('x2', 'o2')[ply % 2])
+        self.games.append(Game.objects.get(pk=won.id))
+
+    def test_games_serialize_as_with_game_serializer(self):
+        """Test that serialize_game gives GameSerializer's JSON."""
+        for game in self.games:
+            expected = GameSerializer(game).data
+
+            self.assertEqual(
+                json.dumps(serialize_game(game)), json.dumps(expected))
+        self.assertEqual(self.games[-1].winner, True)
+
+    def test_games_serialize_the_requested_fields(self):
+        """Test that game_reader gives only the requested fields, and
+        reads only those."""
+        for fields in (['board'], ['status', 'id', 'winner']):
+            read = game_reader(fields)
+            columns = [column for field in fields
+                       for column in GameSerializer.SOURCE_COLUMNS.get(
+                           field, (field,))]
+            game = Game.objects.only(*columns).get(pk=self.games[-1].pk)
+
+            with self.assertNumQueries(0):
+                data = read(game)
+            self.assertEqual(
+                json.dumps(data),
+                json.dumps(GameSerializer(game, fields=fields).data))
+
+    def test_listings_are_the_same_either_way(self):
+        """Test that listings are the same with fast serialization on or
+        off."""
+        for path in ('', '?fields=board,status', '?page_size=2'):
+            fast = self.client.get(reverse('create') + path, format='json')
+            with override_settings(GAME_FAST_SERIALIZATION=False):
+                slow = self.client.get(
+                    reverse('create') + path, format='json')
+
+            self.assertEqual(fast.status_code, status.HTTP_200_OK)
+            self.assertEqual(fast.content, slow.content)
+
+    def test_browsable_api_lists_games(self):
+        """Test that the browsable API still lists games."""
+        response = self.client.get(
+            reverse('create'), HTTP_ACCEPT='text/html')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, 'move_count')
+
+    def test_api_cannot_join_with_an_invalid_token(self):
+        """Test that a token the serializer refuses is still refused."""
+        with patch.object(PlayerSession, 'new_tokens',
+                          return_value=['t' * 256]):
+            response = self.client.post(reverse(
+                'join', kwargs={'pk': self.games[0].id, 'player': 'x'}))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'x_token': [
+            'Ensure this field has no more than 255 characters.']})
+        self.assertIsNone(Game.objects.get(pk=self.games[0].id).x_token)
+
+
+class BulkGamesTestCase(TestCase):
+    """Test creating games in bulk."""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.client = APIClient()
+
+    def _lines(self, response):
+        return [json.loads(line) for line in b''.join(
+            response.streaming_content).decode().splitlines()]
+
+    def test_api_creates_seated_games(self):
+        """Test that the API creates games with both seats taken and
+        streams their working tokens."""
+        response = self.client.post(
+            reverse('bulk'), {'count': 5, 'seats': True}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = self._lines(response)
+        self.assertEqual(len({line['id'] for line in lines}), 5)
+        for line in lines:
+            game = Game.objects.get(pk=line['id'])
+            self.assertEqual(
+                (game.x_token, game.o_token, game.status),
+                (line['x_token'], line['o_token'], Game.IN_PROGRESS))
+        moved = self.client.post(
+            reverse('details', kwargs={'pk': lines[-1]['id']}),
+            {'row': 0, 'col': 0}, format='json',
+            HTTP_AUTHORIZATION='Token ' + lines[-1]['x_token'])
+        self.assertEqual(moved.status_code, status.HTTP_200_OK)
+
+    def test_api_creates_open_games(self):
+        """Test that the API creates games waiting for players."""
+        response = self.client.post(
+            reverse('bulk'), {'count': 3, 'board_size': 5, 'win_length': 4},
+            format='json')
+
+        lines = self._lines(response)
+        self.assertEqual([set(line) for line in lines], [{'id'}] * 3)
+        games = Game.objects.filter(pk__in=[line['id'] for line in lines])
+        self.assertEqual(
+            {(game.board_size, game.win_length, game.status, game.x_token)
+             for game in games}, {(5, 4, Game.WAITING, None)})
+
+    def test_api_cannot_create_invalid_games(self):
+        """Test that bulk creation validates the count and the games."""
+        for data in ({}, {'count': 0}, {'count': 10001}, {'count': 'many'},
+                     {'count': 2, 'board_size': 99},
+                     {'count': 2, 'win_length': 4}):
+            response = self.client.post(reverse('bulk'), data, format='json')
+
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Game.objects.count(), 0)
+
+    def test_games_are_created_in_batches(self):
+        """Test that each batch takes one insert per table."""
+        # sqlite returns no ids from a bulk insert, so each batch also
+        # reads the highest id before it and its games' ids after it
+        with self.assertNumQueries(2 * 6):
+            created = list(create_games(5, seated=True, batch_size=3))
+
+        self.assertEqual(
+            [pk for pk, _, _ in created],
+            list(Game.objects.order_by('pk').values_list('pk', flat=True)))
+        self.assertEqual(PlayerSession.objects.count(), 10)
+
+    def test_games_inserted_meanwhile_are_not_mistaken_for_the_batch(self):
+        """Test that the ids read back are those of the batch's games,
+        not of games inserted by others at the same time."""
+        bulk_create = QuerySet.bulk_create
+
+        def interleaved(queryset, objs, *args, **kwargs):
+            created = bulk_create(queryset, objs, *args, **kwargs)
+            others.append(Game.objects.create().pk)
+            return created
+
+        for seated in (True, False):
+            others = []
+            with patch.object(QuerySet, 'bulk_create', interleaved):
+                created = list(create_games(3, seated=seated))
+
+            games = Game.objects.in_bulk([pk for pk, _, _ in created])
+            self.assertEqual(len(games), 3)
+            self.assertNotIn(others[0], games)
+            for pk, x_token, o_token in created:
+                self.assertEqual(
+                    (games[pk].x_token, games[pk].o_token),
+                    (x_token, o_token))
+
+    def test_tokens_are_formatted_like_uuid4(self):
+        """Test that generated tokens are distinct version 4 UUIDs."""
+        tokens = PlayerSession.new_tokens(100)
+
+        self.assertEqual(len(set(tokens)), 100)
+        for token in tokens:
+            self.assertEqual(str(uuid.UUID(token)), token)
+            self.assertEqual(uuid.UUID(token).version, 4)
+            self.assertEqual(uuid.UUID(token).variant, uuid.RFC_4122)
+
+    def test_command_creates_games(self):
+        """Test that the command writes a line per game created."""
+        out = StringIO()
+        call_command('create_games', '3', '--seats', stdout=out,
+                     stderr=StringIO())
+
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(
+            sorted(line['id'] for line in lines),
+            list(Game.objects.order_by('pk').values_list('pk', flat=True)))
+        self.assertEqual(
+            PlayerSession.objects.filter(
+                token_hash=PlayerSession.hash_token(lines[0]['o_token']),
+                player=False).get().game_id, lines[0]['id'])
+
+
+class BenchTestCase(TestCase):
+    """Test the benchmark suite's building blocks."""
+
+    def test_summary_reports_percentiles(self):
+        """Test that latencies are summarized by nearest rank."""
+        summary = summarize([i / 1000 for i in range(100, 0, -1)], 2)
+
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['per_second'], 50)
+        self.assertAlmostEqual(summary['p50_ms'], 50)
+        self.assertAlmostEqual(summary['p99_ms'], 99)
+        self.assertAlmostEqual(summary['max_ms'], 100)
+
+    def test_benchmark_plays_a_whole_game(self):
+        """Test that the benchmark's game flow runs against the API."""
+        timings = {}
+        play_game(ClientTransport(), timings)
+
+        self.assertEqual(Game.objects.get().status, Game.DRAW)
+        self.assertEqual(
+            {name: len(latencies) for name, latencies in timings.items()},
+            {'GameList.post': 1, 'JoinGame.post': 2, 'GameDetail.post': 8,
+             'GameDetail.get': 8, 'GameList.get': 1})
+        self.assertEqual(len(run_micro(1)), 6)
+
+    def test_move_benchmark_counts_queries(self):
+        """Test that the move benchmark plays whole games and sees the
+        move path's queries."""
+        result = run_moves(1)
+
+        self.assertEqual(result['moves'], 8)
+        self.assertEqual(Game.objects.get().status, Game.DRAW)
+        self.assertGreaterEqual(result['queries'], 8 * 4)
+
+    def test_serialization_benchmark_times_both_serializers(self):
+        """Test that the serialization benchmark reads through both
+        serializers."""
+        results = run_serialization(2, 2)
+
+        self.assertEqual(set(results), {'GameSerializer', 'game_reader'})
+        for timings in results.values():
+            self.assertEqual(
+                set(timings), {'GameDetail.get', 'GameList.get'})
+
+
+class ConcurrencyTestCase(TransactionTestCase):
+    """Hammer one game from many threads at once."""
+
+    THREADS = 16
+
+    def setUp(self):
+        """Set up the tests."""
+        self.game = _seated_game('x-token', 'o-token')
+
+    def _hammer(self, request):
+        """Run request(client, i) on every thread at once; return statuses."""
+        barrier = threading.Barrier(self.THREADS)
+        statuses = [None] * self.THREADS
+
+        def worker(i):
+            client = APIClient()
+            barrier.wait()
+            try:
+                statuses[i] = request(client, i).status_code
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return statuses
+
+    def test_racing_moves_are_applied_exactly_once(self):
+        """Test that of many racing moves by X, exactly one lands."""
+        def move(client, i):
+            return client.post(
+                reverse('details', kwargs={'pk': self.game.id}),
+                {'row': i // 3 % 3, 'col': i % 3},
+                format='json',
+                HTTP_AUTHORIZATION='Token x-token')
+
+        statuses = self._hammer(move)
+
+        self.assertEqual(statuses.count(status.HTTP_200_OK), 1)
+        self.assertEqual(statuses.count(status.HTTP_400_BAD_REQUEST) +
+                         statuses.count(status.HTTP_409_CONFLICT),
+                         self.THREADS - 1)
+        game = Game.objects.get(pk=self.game.id)
+        self.assertEqual(bin(game.x_board).count('1'), 1)
+        self.assertEqual(game.o_board, 0)
+        self.assertEqual(game.current_player, False)
+        self.assertEqual(game.version, 1)
+
+    def test_racing_joins_hand_out_each_seat_once(self):
+        """Test that of many racing joins as X, exactly one gets the seat."""
+        game = Game.objects.create()
+
+        def join(client, i):
+            return client.post(
+                reverse('join', kwargs={'pk': game.id, 'player': 'x'}),
+                format='json')
+
+        statuses = self._hammer(join)
+
+        self.assertEqual(statuses.count(status.HTTP_200_OK), 1)
+        self.assertEqual(statuses.count(status.HTTP_403_FORBIDDEN) +
+                         statuses.count(status.HTTP_409_CONFLICT),
+                         self.THREADS - 1)
+
+    def test_racing_joiners_are_each_seated_once(self):
+        """Test that of many racing joiners, each is paired or queued."""
+        statuses = self._hammer(
+            lambda client, i: client.post(reverse('match')))
+
+        games = Game.objects.exclude(pk=self.game.id)
+        self.assertEqual(
+            statuses.count(status.HTTP_201_CREATED), games.count())
+        self.assertEqual(
+            2 * games.count() + MatchTicket.objects.count(), self.THREADS)
+        self.assertEqual(
+            PlayerSession.objects.filter(game__in=games).count(),
+            2 * games.count())
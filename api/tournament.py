@@ -0,0 +1,212 @@
+"""Offline bot-vs-bot tournaments.
+
+Games are played in memory under the API's own rules: every move goes
+through the rules module the move path uses, so it is validated as
+GameDetail.post validates it and the game is won or drawn exactly when
+it would be there. Games are played in batches spread over a pool of
+worker processes, and only the aggregate results (plus, optionally,
+the final positions to save) travel back to the parent.
+
+A strategy is a callable taking (board, player, rng) -- a Board, True
+for X or False for O, and a random.Random to draw from -- and returning
+the (row, col) to play. A strategy whose move is not allowed forfeits
+the game."""
+import itertools
+import multiprocessing
+import random
+import time
+from django.utils.module_loading import import_string
+from .models import Game
+from .rules import IllegalMove, apply_move, check_move, parse_row_col
+from .solver import best_move
+
+# Games of one pairing played per task sent to a worker
+TOURNAMENT_BATCH_SIZE = 200
+# Seconds the solver strategy may think per move on boards too large to
+# solve outright
+SOLVER_TIME_BUDGET = 0.01
+
+
+def random_strategy(board, player, rng):
+    """Play any free cell."""
+    return rng.choice([
+        (row, col)
+        for row in range(board.size) for col in range(board.size)
+        if board.is_free(row, col)])
+
+
+def first_free_strategy(board, player, rng):
+    """Play the first free cell, row by row."""
+    for row in range(board.size):
+        for col in range(board.size):
+            if board.is_free(row, col):
+                return row, col
+
+
+def solver_strategy(board, player, rng):
+    """Play the computer player's move."""
+    return best_move(board, player, SOLVER_TIME_BUDGET)
+
+
+STRATEGIES = {
+    'random': random_strategy,
+    'first': first_free_strategy,
+    'solver': solver_strategy,
+}
+
+
+def get_strategy(name):
+    """Return the strategy registered as name, or importable by its
+    dotted path (e.g. 'bots.strategies.greedy').
+
+    Raises ValueError if there is none."""
+    if name in STRATEGIES:
+        return STRATEGIES[name]
+    try:
+        return import_string(name)
+    except ImportError as e:
+        raise ValueError('Unknown strategy {}'.format(name)) from e
+
+
+def play(x_strategy, o_strategy, board_size, win_length, rng):
+    """Play one game between two strategies.
+
+    Returns the finished, unsaved Game and the player who forfeited it
+    by attempting a move that is not allowed (None if nobody did); a
+    forfeited game is left as it was before that move."""
+    game = Game(board_size=board_size, win_length=win_length)
+    board = game.get_board()
+    while not game.is_over():
+        player = game.current_player
+        strategy = x_strategy if player else o_strategy
+        move = strategy(game.get_board(), player, rng)
+        try:
+            row, col = move
+        except (TypeError, ValueError):
+            return game, player
+        try:
+            row, col = parse_row_col({'row': row, 'col': col}, board_size)
+            check_move(game, board, player, row, col)
+        except IllegalMove:
+            return game, player
+        apply_move(game, board, player, row, col)
+    return game, None
+
+
+def _play_batch(task):
+    """Play a batch of games of one pairing; runs in a worker.
+
+    Returns (x_wins, o_wins, draws, x_forfeits, o_forfeits, finished)
+    where finished lists the columns of each game finished without a
+    forfeit if they are to be saved, else is empty."""
+    x_name, o_name, board_size, win_length, games, seed, keep = task
+    x_strategy = get_strategy(x_name)
+    o_strategy = get_strategy(o_name)
+    rng = random.Random(seed)
+    counts = {Game.X_WON: 0, Game.O_WON: 0, Game.DRAW: 0}
+    forfeits = {True: 0, False: 0}
+    finished = []
+    for _ in range(games):
+        game, forfeit = play(
+            x_strategy, o_strategy, board_size, win_length, rng)
+        if forfeit is not None:
+            forfeits[forfeit] += 1
+            continue
+        counts[game.status] += 1
+        if keep:
+            finished.append((
+                game.x_board, game.o_board, game.current_player,
+                game.winner, game.status, game.move_count))
+    return (counts[Game.X_WON], counts[Game.O_WON], counts[Game.DRAW],
+            forfeits[True], forfeits[False], finished)
+
+
+def _tasks(strategies, games, board_size, win_length, seed, keep):
+    """Yield ((x, o), task) for the batches of every pairing."""
+    for index, (x_name, o_name) in enumerate(
+            itertools.product(strategies, repeat=2)):
+        for start in range(0, games, TOURNAMENT_BATCH_SIZE):
+            batch = min(TOURNAMENT_BATCH_SIZE, games - start)
+            yield (x_name, o_name), (
+                x_name, o_name, board_size, win_length, batch,
+                '{}-{}-{}'.format(seed, index, start), keep)
+
+
+def run_tournament(strategies, games, board_size=Game.BOARD_SIZE,
+                   win_length=None, processes=None, seed=None, save=False,
+                   batch_size=1000):
+    """Play games games of every pairing of strategies, either way round.
+
+    strategies are names accepted by get_strategy; each also plays
+    itself, and is credited with both sides of those games. Batches
+    are spread over processes worker processes (default: one per CPU;
+    1 plays in this process). Given a seed, the results are
+    reproducible. With save, games finished without a forfeit are
+    inserted into the Game table batch_size at a time; they have no
+    tokens and no move log.
+
+    Returns a dict of the results per pairing and per strategy, the
+    games played and saved, and the time taken."""
+    for name in strategies:
+        get_strategy(name)
+    if win_length is None:
+        win_length = board_size
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    pairings = {}
+    standings = {
+        name: {'wins': 0, 'draws': 0, 'losses': 0} for name in strategies}
+    batches = list(_tasks(
+        strategies, games, board_size, win_length, seed, save))
+    keys = [key for key, task in batches]
+    tasks = [task for key, task in batches]
+    saved = 0
+    started = time.perf_counter()
+    if processes == 1:
+        results = map(_play_batch, tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_play_batch, tasks)
+    try:
+        for (x_name, o_name), result in zip(keys, results):
+            x_wins, o_wins, draws, x_forfeits, o_forfeits, finished = result
+            pairing = pairings.setdefault((x_name, o_name), {
+                'x': x_name, 'o': o_name, 'x_wins': 0, 'o_wins': 0,
+                'draws': 0, 'x_forfeits': 0, 'o_forfeits': 0})
+            pairing['x_wins'] += x_wins
+            pairing['o_wins'] += o_wins
+            pairing['draws'] += draws
+            pairing['x_forfeits'] += x_forfeits
+            pairing['o_forfeits'] += o_forfeits
+            standings[x_name]['wins'] += x_wins + o_forfeits
+            standings[x_name]['losses'] += o_wins + x_forfeits
+            standings[o_name]['wins'] += o_wins + x_forfeits
+            standings[o_name]['losses'] += x_wins + o_forfeits
+            standings[x_name]['draws'] += draws
+            standings[o_name]['draws'] += draws
+            if finished:
+                Game.objects.bulk_create([
+                    Game(x_board=x_board, o_board=o_board,
+                         board_size=board_size, win_length=win_length,
+                         current_player=current_player, winner=winner,
+                         status=status, move_count=move_count)
+                    for (x_board, o_board, current_player, winner, status,
+                         move_count) in finished], batch_size=batch_size)
+                saved += len(finished)
+    finally:
+        if processes != 1:
+            pool.terminate()
+            pool.join()
+    elapsed = time.perf_counter() - started
+    played = games * len(strategies) ** 2
+    return {
+        'games': played,
+        'saved': saved,
+        'seconds': elapsed,
+        'processes': processes,
+        'games_per_second': played / elapsed,
+        'pairings': list(pairings.values()),
+        'standings': standings,
+    }
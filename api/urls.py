@@ -1,11 +1,30 @@
 from django.conf.urls import url
 from rest_framework.urlpatterns import format_suffix_patterns
-from .views import GameList, GameDetail, JoinGame
+from .views import (
+    BatchMoves, BulkGames, ExportGames, GameEvents, GameHint, GameHistory,
+    GameList, GameDetail, JoinGame, Matchmaking, MyGames, metrics)
 
 
 urlpatterns = {
+    url(r'^metrics$', metrics, name='metrics'),
     url(r'^games/$', GameList.as_view(), name='create'),
+    url(r'^games/bulk/$', BulkGames.as_view(), name='bulk'),
+    url(r'^games/export/$', ExportGames.as_view(), name='export'),
+    url(r'^games/moves/$', BatchMoves.as_view(), name='moves'),
+    url(r'^games/mine/$', MyGames.as_view(), name='mine'),
+    url(r'^games/match/$', Matchmaking.as_view(), name='match'),
     url(r'^games/(?P<pk>[0-9]+)/$', GameDetail.as_view(), name='details'),
+    url(
+        r'^games/(?P<pk>[0-9]+)/hint/$', GameHint.as_view(), name='hint'),
+    url(
+        r'^games/(?P<pk>[0-9]+)/history/$',
+        GameHistory.as_view(), name='history'),
+    url(
+        r'^games/(?P<pk>[0-9]+)/history/(?P<ply>[0-9]+)/$',
+        GameHistory.as_view(), name='replay'),
+    url(
+        r'^games/(?P<pk>[0-9]+)/events/$',
+        GameEvents.as_view(), name='events'),
     url(
         r'^games/(?P<pk>[0-9]+)/join/(?P<player>[x|o])/$',
         JoinGame.as_view(), name='join'),
@@ -1,19 +1,341 @@
 import json
-import uuid
-from rest_framework import generics, status
+import time
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
+from rest_framework import filters, generics, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from .serializers import GameSerializer
-from .models import Game
+from .archive import get_archived_game
+from .broker import get_broker
+from .bulk import create_games
+from .cache import cache_game, cache_saved_game, get_cached_game
+from .export import export_games, parse_since
+from .filters import GameStatusFilter
+from .instrumentation import phase, render_metrics
+from .pagination import GamePagination
+from .rules import IllegalMove, apply_move, parse_row_col
+from .serializers import (
+    GameSerializer, MoveSerializer, game_reader, serialize_game,
+    validate_move, validate_token)
+from .sharding import (
+    AllShards, atomic_on, game_db, is_sharded, shard_of, shards)
+from .solver import DEFAULT_TIME_BUDGET, best_move
+from .sqlite import is_busy
+from .models import Game, MatchTicket, Move, PlayerSession, Snapshot
+from .outcomes import DRAW, LOSS, WIN, OutcomeTable
 from .permissions import IsOwnerOrReadOnly
 
+# Times a request re-reads a game that changed under it before giving up
+MAX_ATTEMPTS = 5
+# Times a write is retried while the database is too busy to take it,
+# and the pause before the first retry, in seconds; it doubles each time
+BUSY_RETRIES = 4
+BUSY_BACKOFF = 0.02
+# Most moves accepted by one BatchMoves request
+MAX_BATCH_MOVES = 1000
+# Most games created by one BulkGames request
+MAX_BULK_GAMES = 10000
+# Game fields a move changes
+MOVE_FIELDS = [
+    'x_board', 'o_board', 'current_player', 'winner', 'status', 'move_count']
+
+
+class _Conflict(Exception):
+    """A game changed between reading and saving it."""
+
+
+class _Busy(Exception):
+    """The database stayed too busy to take a write."""
+
+
+def _conflict():
+    """Return the response for a game too busy to update."""
+    return Response(
+        'Game was updated concurrently too many times; try again',
+        status=status.HTTP_409_CONFLICT)
+
+
+def _busy():
+    """Return the response for a database too busy to write to."""
+    return Response(
+        'The database is busy; try again',
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={'Retry-After': '1'})
+
+
+def _when_not_busy(write):
+    """Return write(), retried with backoff while the database is busy.
+
+    write must run in a transaction of its own, so a failed try leaves
+    nothing behind. Raises _Busy once BUSY_RETRIES retries have failed."""
+    for attempt in range(BUSY_RETRIES + 1):
+        try:
+            return write()
+        except OperationalError as e:
+            if not is_busy(e):
+                raise
+        if attempt < BUSY_RETRIES:
+            time.sleep(BUSY_BACKOFF * 2 ** attempt)
+    raise _Busy()
+
+
+def _parse_row_col(data, size):
+    """Extract row and col from a request body, if able.
+
+    Both must fall on the game's size x size board.
+
+    Returns:
+    row, col, err Response
+    """
+    try:
+        row, col = parse_row_col(data, size)
+    except IllegalMove as e:
+        return None, None, Response(
+            str(e), status=status.HTTP_400_BAD_REQUEST)
+    return row, col, None
+
+
+def _play(game, board, player, row, col):
+    """Validate a move and apply it to the game in memory.
+
+    Raises ValidationError if the move is not allowed."""
+    with phase('validate'):
+        validate_move(game, board, player, row, col)
+    with phase('winner'):
+        apply_move(game, board, player, row, col)
+
+
+def _save_log(rows):
+    """Insert move log rows, one INSERT per table."""
+    moves = [row for row in rows if isinstance(row, Move)]
+    snapshots = [row for row in rows if isinstance(row, Snapshot)]
+    if moves:
+        Move.objects.bulk_create(moves)
+    if snapshots:
+        Snapshot.objects.bulk_create(snapshots)
+
+
+def _save_move(game, board, player, row, col):
+    """Save a move made by _play, logging it in the same transaction.
+
+    Returns False, saving nothing, if the game changed since it was
+    read. Raises _Busy if the database stays too busy to take it."""
+    version = game.version
+
+    def write():
+        game.version = version
+        with transaction.atomic(using=game_db(game.pk)):
+            if not game.save_if_current(MOVE_FIELDS):
+                return False
+            _save_log(game._log_move(board, player, row, col))
+        return True
+
+    if not _when_not_busy(write):
+        return False
+    _game_changed(game, MOVE_FIELDS)
+    return True
+
+
+def _ai_move(game):
+    """Let the computer take its turn, if it is its turn.
+
+    Returns the game as left after the computer's move, if any."""
+    for _ in range(MAX_ATTEMPTS):
+        if (game.ai_player is None or
+                game.current_player != game.ai_player):
+            return game
+        if game.is_over():
+            return game
+        board = game.get_board()
+        row, col = best_move(board, game.ai_player, getattr(
+            settings, 'GAME_AI_TIME_BUDGET', DEFAULT_TIME_BUDGET))
+        _play(game, board, game.ai_player, row, col)
+        if _save_move(game, board, game.ai_player, row, col):
+            return game
+        game = Game.objects.get(pk=game.pk)
+    return game
+
+
+def _ai_reply(game):
+    """Let the computer answer a move that has been committed.
+
+    If the database stays too busy to take the computer's move, the
+    game is returned as committed, on the computer's turn; the computer
+    then moves before the next move made in the game (see
+    GameDetail.post)."""
+    try:
+        return _ai_move(game)
+    except _Busy:
+        return Game.objects.get(pk=game.pk)
+
+
+def _game_event(game):
+    """Return the update pushed to a game's subscribers."""
+    return {
+        'id': game.pk,
+        'board': game.board,
+        'current_player': game.current_player,
+        'winner': game.winner,
+        'status': game.status,
+        'version': game.version}
+
+
+def _game_changed(game, update_fields):
+    """Once committed, cache the game's new state and push it out.
+
+    update_fields are the fields just saved with save_if_current."""
+    event = _game_event(game)
+
+    def on_commit():
+        cache_saved_game(game, update_fields)
+        get_broker().publish(game.pk, event)
+    transaction.on_commit(on_commit, using=game_db(game.pk))
+
+
+def _etag_matches(etag, if_none_match):
+    """Return whether an If-None-Match header matches the ETag.
+
+    The header is a comma-separated list of ETags, weak or strong, or
+    *; If-None-Match compares them weakly."""
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags or 'W/' + etag in etags
+
+
+def metrics(request, format=None):
+    """Serve the instrumentation's metrics in Prometheus text format.
+
+    Only available with settings.GAME_INSTRUMENTATION on."""
+    if not getattr(settings, 'GAME_INSTRUMENTATION', False):
+        raise Http404('Instrumentation is off')
+    return HttpResponse(
+        render_metrics(), content_type='text/plain; version=0.0.4')
 
 
 class GameList(generics.ListCreateAPIView):
-    """List and create operations on games."""
+    """List and create operations on games.
+
+    Listings are paginated by cursor and ordered by ?ordering= (id or
+    modified, optionally descending). They can be filtered with
+    ?status= and ?winner= (see GameStatusFilter) and narrowed with
+    ?fields=, a comma-separated subset of the serialized fields. With
+    games sharded, each page is read from every shard and merged."""
 
     queryset = Game.objects.all()
     serializer_class = GameSerializer
+    pagination_class = GamePagination
+    filter_backends = (GameStatusFilter, filters.OrderingFilter)
+    ordering_fields = ('id', 'modified')
+    ordering = ('id',)
+
+    def get_queryset(self):
+        """Load only the columns behind the requested fields, from every
+        shard."""
+        queryset = super().get_queryset()
+        fields = self._requested_fields()
+        if fields is not None:
+            columns = {'id', 'modified'}
+            for field in fields:
+                columns.update(
+                    GameSerializer.SOURCE_COLUMNS.get(field, (field,)))
+            queryset = queryset.only(*columns)
+        if is_sharded():
+            return AllShards(queryset)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """List a page of games, serialized by game_reader rather than
+        GameSerializer; the browsable API keeps GameSerializer."""
+        if request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(self.filter_queryset(
+            self.get_queryset()))
+        read = game_reader(self._requested_fields())
+        return self.get_paginated_response([read(game) for game in page])
+
+    def get_serializer(self, *args, **kwargs):
+        """Serialize only the requested fields when listing."""
+        if self.request.method == 'GET':
+            kwargs['fields'] = self._requested_fields()
+        return super().get_serializer(*args, **kwargs)
+
+    def _requested_fields(self):
+        """Return the fields named in ?fields=, or None for all."""
+        fields = self.request.query_params.get('fields')
+        if not fields:
+            return None
+        fields = [field.strip() for field in fields.split(',')]
+        unknown = set(fields) - set(GameSerializer.Meta.fields)
+        if unknown:
+            raise ValidationError('Unknown fields: {}'.format(
+                ', '.join(sorted(unknown))))
+        return fields
+
+
+class BulkGames(APIView):
+    """Create many games in one request."""
+
+    def post(self, request, format=None):
+        """Create games in batches, streaming them as newline-delimited
+        JSON as each batch is committed.
+
+        The body is {"count": <games>, "board_size": <size>,
+        "win_length": <length>, "seats": <bool>}; board_size and
+        win_length are optional and validated as for a single game.
+        With "seats" true both seats of every game are taken, and each
+        game is streamed with its X and O tokens; otherwise with its id
+        alone."""
+        try:
+            count = int(request.data.get('count'))
+        except (TypeError, ValueError):
+            return Response(
+                'A count of games is required in request body',
+                status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= count <= MAX_BULK_GAMES:
+            return Response(
+                'Count must be between 1 and {}'.format(MAX_BULK_GAMES),
+                status=status.HTTP_400_BAD_REQUEST)
+        serializer = GameSerializer(data={
+            name: request.data[name] for name in ('board_size', 'win_length')
+            if name in request.data})
+        serializer.is_valid(raise_exception=True)
+        size = serializer.validated_data.get('board_size', Game.BOARD_SIZE)
+        win_length = serializer.validated_data.get('win_length', size)
+        seated = str(request.data.get('seats', '')).lower() in ('true', '1')
+        games = create_games(count, size, win_length, seated)
+        if seated:
+            lines = (
+                json.dumps({'id': pk, 'x_token': x_token,
+                            'o_token': o_token}) + '\n'
+                for pk, x_token, o_token in games)
+        else:
+            lines = (json.dumps({'id': pk}) + '\n' for pk, _, _ in games)
+        return StreamingHttpResponse(
+            lines, status=status.HTTP_201_CREATED,
+            content_type='application/x-ndjson')
+
+
+class ExportGames(APIView):
+    """Stream every game as newline-delimited JSON."""
+
+    def get(self, request, format=None):
+        """Export games in id order.
+
+        ?after_id= resumes after the last id received, and ?since=
+        limits the export to games modified at or after an ISO 8601
+        timestamp."""
+        try:
+            after_id = request.query_params.get('after_id')
+            after_id = int(after_id) if after_id else None
+            since = request.query_params.get('since')
+            since = parse_since(since) if since else None
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+        return StreamingHttpResponse(
+            export_games(after_id=after_id, modified_since=since),
+            content_type='application/x-ndjson')
 
 
 class GameDetail(APIView):
@@ -22,75 +344,418 @@ class GameDetail(APIView):
     permission_classes = (IsOwnerOrReadOnly,)
 
     def get(self, request, pk, format=None):
-        """Get a game."""
-        # per http://stackoverflow.com/a/4300377
-        game = Game.objects.get(pk=pk)
-        serializer = GameSerializer(game)
-        return Response(serializer.data)
+        """Get a game.
+
+        Games are read through the game cache, so an unchanged game is
+        served without touching the database. Games no longer in the
+        Game table are read from the archive. The ETag names the game's
+        version; a matching If-None-Match gets 304 Not Modified."""
+        with phase('cache'):
+            cached = get_cached_game(pk)
+        if cached is None:
+            try:
+                # per http://stackoverflow.com/a/4300377
+                cached = cache_game(Game.objects.get(pk=pk))
+            except Game.DoesNotExist:
+                cached = get_archived_game(pk)
+                if cached is None:
+                    raise Http404('No such game')
+        version, data = cached
+        etag = '"{}-{}"'.format(pk, version)
+        if _etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH', '')):
+            return Response(
+                status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(data, headers={'ETag': etag})
 
     def post(self, request, pk, format=None):
-        """Make a move."""
-        game = Game.objects.get(pk=pk)
-        # per http://stackoverflow.com/a/22567895
-        self.check_object_permissions(self.request, game)
+        """Make a move.
 
-        player = game._get_player(self._parse_header_token(self.request))
-        row, col, err = self._parse_row_col()
-        if err:
-            return err
-        board = json.loads(game.board)
-        GameSerializer().validate_move(game, board, player, row, col)
+        The game comes with the player's session from authentication.
+        If another move lands between reading the game and saving it,
+        the game is re-read and the move re-validated against it. A
+        database too busy to take the move gets 503; one too busy to take
+        the computer's reply gets the move as committed."""
+        with phase('lookup'):
+            session = self.request.auth
+            if session is not None and str(session.game_id) == pk:
+                game = session.game
+            else:
+                game = Game.objects.get(pk=pk)
+        for _ in range(MAX_ATTEMPTS):
+            # per http://stackoverflow.com/a/22567895
+            self.check_object_permissions(self.request, game)
 
-        board[row][col] = player
+            if game.current_player == game.ai_player:
+                # a computer's move left undone by a busy database
+                try:
+                    with phase('ai'):
+                        game = _ai_move(game)
+                except _Busy:
+                    return _busy()
+            player = session.player
+            with phase('decode'):
+                row, col, err = _parse_row_col(
+                    self.request.data, game.board_size)
+                if err:
+                    return err
+                board = game.get_board()
+            _play(game, board, player, row, col)
+            try:
+                with phase('save'):
+                    saved = _save_move(game, board, player, row, col)
+            except _Busy:
+                return _busy()
+            if saved:
+                with phase('ai'):
+                    game = _ai_reply(game)
+                return Response({
+                    'board': game.board,
+                    'current_player': game.current_player,
+                    'winner': game.winner})
+            with phase('lookup'):
+                game = Game.objects.get(pk=pk)
+        return _conflict()
 
-        serializer = GameSerializer(data={
-            'board': json.dumps(board),
-            'current_player': (not game.current_player),
-            'winner': game._and_the_winner_is(board)})
-        serializer.is_valid(raise_exception=True)
-        serializer.update(game, serializer.data)
-        return Response(serializer.data)
 
-    # @DRY permissions.py
-    def _parse_header_token(self, request):
-        """Extract authorization token from request headers."""
+class GameHint(APIView):
+    """Suggest moves for the player to move."""
+
+    # How the outcome table's values are served
+    OUTCOMES = {WIN: 'win', DRAW: 'draw', LOSS: 'loss'}
+
+    def get(self, request, pk, format=None):
+        """Get the best moves and the outcome they lead to.
+
+        The outcome is that of perfect play from both sides, for the
+        player to move. Hints come from the precomputed outcome table,
+        so they are only available for 3x3 games, and only while the
+        game goes on from a position that can arise in play."""
         try:
-            # per http://stackoverflow.com/a/3889790
-            return request.META.get(
-                'HTTP_AUTHORIZATION'
-            ).strip().split()[1]
-        except Exception:
-            return None
+            game = Game.objects.only(
+                'x_board', 'o_board', 'board_size', 'win_length',
+                'current_player', 'winner', 'status').get(pk=pk)
+        except Game.DoesNotExist:
+            raise Http404('No such game')
+        board = game.get_board()
+        if not OutcomeTable.covers(board):
+            return Response(
+                'Hints are only available for 3x3 games',
+                status=status.HTTP_400_BAD_REQUEST)
+        if game.is_over():
+            return Response(
+                'Game is over', status=status.HTTP_400_BAD_REQUEST)
+        outcome = game._outcome(board)
+        if outcome is None:
+            return Response(
+                'No hint for this position, as it cannot arise in play',
+                status=status.HTTP_400_BAD_REQUEST)
+        value, moves, forced_draw = outcome
+        return Response({
+            'current_player': game.current_player,
+            'outcome': self.OUTCOMES[value],
+            'moves': [{'row': row, 'col': col} for row, col in moves],
+            'forced_draw': forced_draw})
+
+
+class GameHistory(APIView):
+    """Replay a game from its move log."""
 
-    def _parse_row_col(self):
-        """Extract row and col from request body, if able.
+    def get(self, request, pk, ply=None, format=None):
+        """List a game's moves in order, or get its board after a ply.
 
-        Returns:
-        row, col, err Response
-        """
-        row = self.request.data.get('row')
-        col = self.request.data.get('col')
+        Boards are rebuilt from the nearest snapshot, so any ply costs
+        two queries and a bounded replay. Archived games have no move
+        log to replay."""
         try:
-            row = int(row)
-            col = int(col)
-        except Exception:
-            return None, None, Response(
-                'Row and col required in request body',
+            game = Game.objects.get(pk=pk)
+        except Game.DoesNotExist:
+            raise Http404('No such game')
+        if ply is None:
+            return Response(MoveSerializer(
+                game.moves.order_by('ply'), many=True).data)
+        ply = int(ply)
+        if ply > game.move_count:
+            raise Http404('Game has only {} moves'.format(game.move_count))
+        try:
+            board = game.board_at(ply)
+        except ValueError as e:
+            raise Http404(str(e)) from e
+        return Response({'ply': ply, 'board': board.to_json()})
+
+
+class BatchMoves(APIView):
+    """Make many moves, in one or many games, in one request."""
+
+    def post(self, request, format=None):
+        """Make a list of moves in order.
+
+        The body is {"moves": [{"game": <id>, "row": <row>, "col": <col>,
+        "token": <token>}, ...]}; a move without a token uses the one in
+        the Authorization header. Each move is validated against the
+        game as left by the moves before it, and one that fails is
+        skipped without affecting the rest. All games are then saved in
+        one transaction with one write each (per shard, if games are
+        sharded), and the moves logged in one bulk insert; if any of the
+        games changed concurrently, the whole batch is rolled back and
+        replayed. Once committed, the computer replies in the games it
+        plays, so such a game takes one move per batch.
+
+        Returns the outcome of each move and the final state of each
+        game."""
+        moves = request.data.get('moves')
+        if not isinstance(moves, list) or not moves:
+            return Response(
+                'A non-empty list of moves is required in request body',
                 status=status.HTTP_400_BAD_REQUEST)
-        if not 0 <= row < Game.BOARD_SIZE or not 0 <= col < Game.BOARD_SIZE:
-            return None, None, Response(
-                'Row and col must be between {} and {}'.format(
-                    0, Game.BOARD_SIZE - 1),
+        if len(moves) > MAX_BATCH_MOVES:
+            return Response(
+                'At most {} moves are allowed per request'.format(
+                    MAX_BATCH_MOVES),
                 status=status.HTTP_400_BAD_REQUEST)
-        return row, col, None
+        if not all(isinstance(move, dict) for move in moves):
+            return Response(
+                'Each move must be an object',
+                status=status.HTTP_400_BAD_REQUEST)
+        sessions = self._sessions(moves)
+
+        def write():
+            with atomic_on(shards()):
+                return self._apply(moves, sessions)
+
+        for _ in range(MAX_ATTEMPTS):
+            try:
+                results, games = _when_not_busy(write)
+            except _Conflict:
+                continue
+            except _Busy:
+                return _busy()
+            for pk, game in games.items():
+                if game.ai_player is not None:
+                    games[pk] = _ai_reply(game)
+            return Response({
+                'results': results,
+                'games': {pk: {
+                    'board': game.board,
+                    'current_player': game.current_player,
+                    'winner': game.winner} for pk, game in games.items()}})
+        return _conflict()
+
+    def _sessions(self, moves):
+        """Return the PlayerSession (or None) authorizing each move.
+
+        The sessions of all the moves' tokens are looked up at once;
+        moves without a token use the request's own session."""
+        tokens = [move.get('token') for move in moves]
+        hashes = {token: PlayerSession.hash_token(token)
+                  for token in tokens if token and isinstance(token, str)}
+        by_hash = {
+            session.token_hash: session for alias in shards()
+            for session in PlayerSession.objects.using(alias).filter(
+                token_hash__in=hashes.values())}
+        sessions = []
+        for token in tokens:
+            if not token:
+                sessions.append(self.request.auth)
+            elif isinstance(token, str):
+                sessions.append(by_hash.get(hashes[token]))
+            else:
+                sessions.append(None)
+        return sessions
+
+    def _apply(self, moves, sessions):
+        """Play the moves and save every game they changed.
+
+        Raises _Conflict if a game changed since it was read."""
+        ids = set()
+        for move in moves:
+            try:
+                ids.add(int(move.get('game')))
+            except (TypeError, ValueError):
+                pass
+        games = Game.objects.in_bulk(ids)
+        boards = {pk: game.get_board() for pk, game in games.items()}
+        changed = set()
+        log = []
+        results = []
+        for move, session in zip(moves, sessions):
+            result = {key: move.get(key) for key in ('game', 'row', 'col')}
+            results.append(result)
+            try:
+                game = games[int(move.get('game'))]
+            except (KeyError, TypeError, ValueError):
+                result['status'] = status.HTTP_404_NOT_FOUND
+                result['error'] = 'No such game'
+                continue
+            if session is None or session.game_id != game.pk:
+                result['status'] = status.HTTP_403_FORBIDDEN
+                result['error'] = 'Unauthorized token'
+                continue
+            player = session.player
+            row, col, err = _parse_row_col(move, game.board_size)
+            if err:
+                result['status'] = err.status_code
+                result['error'] = err.data
+                continue
+            try:
+                _play(game, boards[game.pk], player, row, col)
+            except ValidationError as e:
+                result['status'] = status.HTTP_400_BAD_REQUEST
+                result['error'] = e.detail[0]
+                continue
+            log.extend(game._log_move(boards[game.pk], player, row, col))
+            changed.add(game.pk)
+            result['status'] = status.HTTP_200_OK
+
+        for pk in changed:
+            if not games[pk].save_if_current(MOVE_FIELDS):
+                raise _Conflict()
+            _game_changed(games[pk], MOVE_FIELDS)
+        _save_log(log)
+        return results, {pk: games[pk] for pk in changed}
+
+
+class MyGames(APIView):
+    """List the games the request's token is seated in."""
+
+    def get(self, request, format=None):
+        """List the token's games, found through its session alone.
+
+        Each game is listed with the side the token plays."""
+        session = request.auth
+        if session is None:
+            return Response(
+                'A valid token is required',
+                status=status.HTTP_403_FORBIDDEN)
+        data = serialize_game(session.game)
+        data['player'] = 'x' if session.player else 'o'
+        return Response([data])
+
+
+class GameEvents(APIView):
+    """Push a game's updates as server-sent events."""
+
+    # Seconds between keep-alive comments on an idle stream
+    KEEPALIVE = 15
+
+    def get(self, request, pk, format=None):
+        """Stream the game's state, then every move made in it.
+
+        The stream ends once the game is over. Each event's id is
+        the game's version, so clients can discard stale updates."""
+        pk = int(pk)
+        broker = get_broker()
+        # subscribe before reading, so no move can slip in between
+        subscription = broker.subscribe(pk)
+        try:
+            game = Game.objects.get(pk=pk)
+        except Game.DoesNotExist:
+            broker.unsubscribe(pk, subscription)
+            raise Http404('No such game')
+        response = StreamingHttpResponse(
+            self._stream(broker, pk, subscription, _game_event(game)),
+            content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def _stream(self, broker, pk, subscription, event):
+        """Yield events until the game is over or the client leaves."""
+        try:
+            yield self._format(event)
+            while event['status'] not in Game.FINISHED:
+                update = subscription.get(self.KEEPALIVE)
+                if update is None:
+                    yield ': keepalive\n\n'
+                elif update['version'] > event['version']:
+                    event = update
+                    yield self._format(event)
+        finally:
+            broker.unsubscribe(pk, subscription)
+
+    def _format(self, event):
+        """Return an event in text/event-stream framing."""
+        return 'id: {}\nevent: game\ndata: {}\n\n'.format(
+            event['version'], json.dumps(event))
+
+
+class Matchmaking(APIView):
+    """Pair players into new games, first come, first served."""
+
+    # Oldest tickets tried per attempt, so racing requests spread over
+    # the head of the queue instead of all fighting over its first
+    # ticket
+    CLAIM_WINDOW = 8
+
+    def post(self, request, format=None):
+        """Join the queue.
+
+        If someone is waiting, a game is created with them as X and the
+        caller as O, and the caller gets 201 with the game id and their
+        token. Otherwise the caller is queued and gets 202 with their
+        token; once paired, the game is listed by /games/mine/ for it."""
+        token = PlayerSession.new_tokens(1)[0]
+        for _ in range(MAX_ATTEMPTS):
+            opponent = self._claim(MatchTicket.objects.order_by('id'))
+            if opponent is not None:
+                return self._pair(opponent, token)
+        ticket = MatchTicket.objects.create(token=token)
+        # Another request may have queued at the same moment after also
+        # finding the queue empty; pair with it rather than both wait
+        older = MatchTicket.objects.filter(id__lt=ticket.id).order_by('id')
+        if older.exists() and self._take(ticket):
+            opponent = self._claim(older)
+            if opponent is not None:
+                return self._pair(opponent, token)
+            ticket = MatchTicket.objects.create(token=token)
+        return Response(
+            {'ticket': ticket.pk, 'token': token},
+            status=status.HTTP_202_ACCEPTED)
+
+    def _claim(self, tickets):
+        """Claim the first ticket of tickets nobody else claims first.
+
+        Returns the claimed ticket, or None if every ticket in the
+        window went to someone else."""
+        for ticket in tickets[:self.CLAIM_WINDOW]:
+            if self._take(ticket):
+                return ticket
+        return None
+
+    def _take(self, ticket):
+        """Delete the ticket; return whether this request deleted it."""
+        deleted, _ = MatchTicket.objects.filter(pk=ticket.pk).delete()
+        return bool(deleted)
+
+    def _pair(self, opponent, token):
+        """Create the game for a claimed ticket and the caller."""
+        game = Game(x_token=opponent.token, o_token=token)
+        with transaction.atomic(using=shard_of(game)):
+            game.save(force_insert=True)
+            PlayerSession.open(game, True, opponent.token)
+            PlayerSession.open(game, False, token)
+        return Response(
+            {'id': game.pk, 'player': 'o', 'token': token},
+            status=status.HTTP_201_CREATED)
 
 
 class JoinGame(APIView):
     """Join a game."""
 
     def post(self, request, pk, player, format=None):
-        """Join a game."""
-        game = Game.objects.get(pk=pk)
+        """Join a game.
+
+        If someone else joins between reading the game and saving it,
+        the game is re-read so the seat is never handed out twice."""
+        for _ in range(MAX_ATTEMPTS):
+            with phase('lookup'):
+                game = Game.objects.get(pk=pk)
+            response = self._join(game, player)
+            if response is not None:
+                return response
+        return _conflict()
+
+    def _join(self, game, player):
+        """Take a seat, or return None if the game changed meanwhile."""
         if game.x_token and game.o_token:
             return Response(
                 'Both X and O have already joined this game',
@@ -111,12 +776,32 @@ class JoinGame(APIView):
                 return self._update_token(game, player)
 
     def _update_token(self, game, player):
-        """Generate an authorization token for either the X or O player."""
-        token = str(uuid.uuid4())
+        """Generate an authorization token for either the X or O player.
+
+        With "ai" set in the request body the computer takes the seat
+        instead; its token is never handed out."""
+        ai = str(self.request.data.get('ai', '')).lower() in ('true', '1')
+        if ai and game.ai_player is not None:
+            return Response(
+                'The computer has already joined this game',
+                status=status.HTTP_403_FORBIDDEN)
+        token = PlayerSession.new_tokens(1)[0]
         token_field_name = player.lower() + '_token'
-        serializer = GameSerializer(data={
-            'board': game.board,
-            token_field_name: token})
-        serializer.is_valid(raise_exception=True)
-        serializer.update(game, serializer.data)
+        with phase('validate'):
+            token = validate_token(token_field_name, token)
+        setattr(game, token_field_name, token)
+        game.status = game._compute_status(game.get_board())
+        update_fields = [token_field_name, 'status']
+        if ai:
+            game.ai_player = player == 'x'
+            update_fields.append('ai_player')
+        with phase('save'), transaction.atomic(using=game_db(game.pk)):
+            if not game.save_if_current(update_fields):
+                return None
+            if not ai:
+                PlayerSession.open(game, player == 'x', token)
+        _game_changed(game, update_fields)
+        if ai:
+            _ai_reply(game)
+            return Response({'ai': True})
         return Response({'token': token})
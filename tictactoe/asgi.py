@@ -0,0 +1,21 @@
+"""
+ASGI config for tictactoe project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``, for an ASGI server such as uvicorn:
+
+    uvicorn tictactoe.asgi:application
+
+Requests are answered by the same Django application as under WSGI, in
+a bounded pool of threads; see api.asgi.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+from api.asgi import ASGIHandler
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tictactoe.settings")
+
+application = ASGIHandler(get_wsgi_application())
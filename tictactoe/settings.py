@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,6 +75,26 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'tictactoe.wsgi.application'
 
+# Threads answering requests when served over ASGI (tictactoe.asgi);
+# connections beyond that wait on the event loop without holding one
+GAME_ASGI_THREADS = 32
+# Threads answering event streams over ASGI, apart from the ones above,
+# as each open stream holds its thread until it ends
+GAME_ASGI_STREAMS = 256
+
+
+# Django REST framework
+# http://www.django-rest-framework.org/api-guide/settings/
+
+REST_FRAMEWORK = {
+    # Players authenticate with the token they were given on joining;
+    # the header is parsed, and the player's session looked up, once
+    # per request
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'api.authentication.GameTokenAuthentication',
+    ),
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
@@ -82,7 +103,70 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Keep connections open across requests rather than paying to
+        # connect, and to tune the connection, on every one
+        'CONN_MAX_AGE': 60,
+        # An on-disk test database, unlike the default in-memory one,
+        # lets the concurrency tests' threads wait on each other's
+        # locks instead of failing outright.
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
+    }
+}
+
+# Databases games are spread over by id, each holding its games' move
+# logs and sessions too; see api.sharding. Set TICTACTOE_GAME_SHARDS to
+# a number of databases to try sharding locally over that many sqlite
+# files. Choose before storing games: they are placed by id modulo the
+# number of shards.
+GAME_SHARDS = ['default']
+for shard in range(1, int(os.environ.get('TICTACTOE_GAME_SHARDS', 1))):
+    alias = 'shard{}'.format(shard)
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_{}.sqlite3'.format(alias)),
+        'CONN_MAX_AGE': 60,
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db_{}.sqlite3'.format(alias)),
+        },
     }
+    GAME_SHARDS.append(alias)
+
+DATABASE_ROUTERS = ['api.sharding.GameRouter']
+
+# Pragmas set on every new sqlite connection; see api.sqlite. WAL lets
+# reads go on while a move is written, and only syncs at checkpoints
+# with synchronous=NORMAL; writers wait up to busy_timeout ms for the
+# lock. mmap_size is in bytes, and a negative cache_size in KiB.
+GAME_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Serialized games, read through by GameDetail and written through
+    # on every move and join. Each process keeps its own copy, so when
+    # running several processes point this at a shared backend such as
+    # memcached instead.
+    'games': {
+        'BACKEND': 'api.cache.LRUMemCache',
+        'LOCATION': 'games',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
 }
 
 
@@ -123,3 +207,47 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.11/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Game updates
+
+# Fans game updates out to clients subscribed to /games/<pk>/events/.
+# LocalBroker only reaches subscribers connected to the same process.
+GAME_BROKER = 'api.broker.LocalBroker'
+
+
+# Serialization
+
+# Serialize games for the cache, listings and archive by reading their
+# fields straight off the model (api.serializers.game_reader) instead of
+# building a GameSerializer each time; the JSON is the same. The
+# browsable API always uses GameSerializer.
+GAME_FAST_SERIALIZATION = True
+
+
+# Computer player
+
+# Solve 3x3 tic-tac-toe at startup, so the computer's moves on classic
+# boards are table lookups from the first game on
+GAME_AI_PRECOMPUTE = True
+# Seconds the computer may think per move on boards larger than 3x3
+GAME_AI_TIME_BUDGET = 0.5
+# Outcome table of every 3x3 position, written by
+# `manage.py build_outcome_table` and memory-mapped by every process.
+# Until it is built, each process computes the table in memory.
+GAME_OUTCOME_TABLE = os.path.join(BASE_DIR, 'outcomes3x3.bin')
+
+
+# Archive
+
+# Finished games untouched for this many days are moved out of the Game
+# table by `manage.py archive_games`
+GAME_ARCHIVE_AFTER_DAYS = 30
+
+
+# Instrumentation
+
+# Time each request and the phases of the move path, reporting them in
+# a Server-Timing header and as Prometheus metrics at /metrics. Off,
+# the middleware uninstalls itself and costs nothing.
+GAME_INSTRUMENTATION = False